@@ -0,0 +1,160 @@
+"""End to end benchmark of converting cohort workbooks with fhir_sheets.
+
+Writes synthetic workbooks (see synthetic_workbook.py) for every combination of the requested sizes, converts each with
+the CLI entry point and reports patients/second, peak RSS and the time spent reading, converting and writing, taken from
+the --metrics_out instrumentation. Every run happens in a fresh process, so peak RSS covers that run only; with --workers
+it is the largest of the parent and its worker processes. Results are written as JSON, to compare between releases.
+Run from the repository root:
+
+    python benchmarks/bench_conversion.py [--patients N ...] [--entities N ...] [--fields N ...] [--output results.json]
+"""
+import argparse
+import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import pathlib
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tomllib
+
+REPO_ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(REPO_ROOT / 'benchmarks'))
+
+from synthetic_workbook import DEFAULT_VALUE_TYPES, OBSERVATION_FIELDS, write_synthetic_workbook  # noqa: E402
+
+# Version of the results layout; bump when fields are renamed or change meaning
+RESULTS_FORMAT_VERSION = 1
+
+
+def peak_rss_bytes():
+    usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def stage_seconds(stages, prefix):
+    return sum(stage['seconds'] for name, stage in stages.items() if name == prefix or name.startswith(prefix + '.'))
+
+
+def run_conversion(workbook_path, config_data, results):
+    """Convert one workbook in this process and put its measurements on the results queue."""
+    from src.fhir_sheets.cli.main import main
+    from src.fhir_sheets.core.config.FhirSheetsConfiguration import FhirSheetsConfiguration
+    with tempfile.TemporaryDirectory() as output_folder:
+        metrics_path = pathlib.Path(output_folder) / 'metrics.json'
+        config = FhirSheetsConfiguration({**config_data, 'metrics_out': str(metrics_path)})
+        start = time.perf_counter()
+        main(workbook_path, pathlib.Path(output_folder) / 'output', config)
+        seconds = time.perf_counter() - start
+        run_metrics = json.loads(metrics_path.read_text())
+    results.put({'seconds': seconds, 'peak_rss_bytes': peak_rss_bytes(), 'metrics': run_metrics})
+
+
+def measure(workbook_path, config_data):
+    """Convert one workbook in a fresh process and return its measurements."""
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=run_conversion, args=(workbook_path, config_data, results))
+    process.start()
+    result = results.get()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"Benchmark run of {workbook_path} exited with code {process.exitcode}")
+    return result
+
+
+def bench_case(workbook_path, patients, config_data, repeat):
+    """The fastest of repeat runs converting one workbook."""
+    best = min((measure(workbook_path, config_data) for _ in range(repeat)), key=lambda result: result['seconds'])
+    stages = best['metrics']['stages']
+    return {
+        'seconds': best['seconds'],
+        'patients_per_second': patients / best['seconds'] if best['seconds'] else None,
+        'peak_rss_bytes': best['peak_rss_bytes'],
+        'read_seconds': stage_seconds(stages, 'read'),
+        'convert_seconds': stage_seconds(stages, 'convert.bundle'),
+        'write_seconds': stage_seconds(stages, 'write'),
+        'stages': stages,
+        'counters': best['metrics']['counters'],
+        'caches': best['metrics']['caches'],
+    }
+
+
+def environment():
+    with open(REPO_ROOT / 'pyproject.toml', 'rb') as pyproject_file:
+        version = tomllib.load(pyproject_file)['tool']['poetry']['version']
+    return {
+        'fhir_sheets_version': version,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark converting synthetic cohort workbooks.")
+    parser.add_argument('--patients', type=int, nargs='+', default=[100, 1000], help="Patient rows of each workbook.")
+    parser.add_argument('--entities', type=int, nargs='+', default=[5], help="Entities per patient, including PrimaryPatient.")
+    parser.add_argument('--fields', type=int, nargs='+', default=[10], help="Columns per Observation entity.")
+    parser.add_argument('--value_types', nargs='+', choices=list(OBSERVATION_FIELDS), default=DEFAULT_VALUE_TYPES, help="Value types the Observation columns cycle through.")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1], help="Worker processes converting patients.")
+    parser.add_argument('--output_format', type=str, nargs='+', default=['json'], choices=['json', 'ndjson', 'bulk', 'tar'], help="Output formats to write.")
+    parser.add_argument('--compact_output', action='store_true', help="Write output JSON without indentation.")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per case; the fastest is reported.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the generated workbooks and of the conversion.")
+    parser.add_argument('--output', type=str, default=None, help="Path of the JSON results file. Printed to stdout by default.")
+    args = parser.parse_args(argv)
+
+    cases = []
+    with tempfile.TemporaryDirectory() as workbook_folder:
+        for patients, entities, fields in itertools.product(args.patients, args.entities, args.fields):
+            workbook_path = str(pathlib.Path(workbook_folder) / f"synthetic_{patients}_{entities}_{fields}.xlsx")
+            columns = write_synthetic_workbook(workbook_path, patients, entities, fields, args.value_types, args.seed)
+            for workers, output_format in itertools.product(args.workers, args.output_format):
+                config_data = {
+                    'random_seed': args.seed,
+                    'workers': workers,
+                    'output_format': output_format,
+                    'compact_output': args.compact_output,
+                }
+                result = bench_case(workbook_path, patients, config_data, args.repeat)
+                cases.append({
+                    'patients': patients,
+                    'entities': entities,
+                    'fields': fields,
+                    'columns': columns,
+                    'value_types': args.value_types,
+                    'workers': workers,
+                    'output_format': output_format,
+                    'compact_output': args.compact_output,
+                    **result,
+                })
+                print(f"patients={patients} entities={entities} fields={fields} workers={workers} format={output_format}: "
+                      f"{result['patients_per_second']:.1f} patients/s, peak RSS {result['peak_rss_bytes'] / 2**20:.1f} MiB, "
+                      f"read {result['read_seconds']:.3f}s convert {result['convert_seconds']:.3f}s write {result['write_seconds']:.3f}s",
+                      file=sys.stderr)
+
+    results = {
+        'format_version': RESULTS_FORMAT_VERSION,
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'environment': environment(),
+        'repeat': args.repeat,
+        'cases': cases,
+    }
+    if args.output:
+        with open(args.output, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
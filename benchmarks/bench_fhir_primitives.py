@@ -0,0 +1,60 @@
+"""Micro-benchmark of the FHIR primitive formatters in fhir_sheets.core.fhir_formatting.
+
+Times assign_value for a representative value of each primitive valueType, with the formatter resolved once
+beforehand the way conversion plans do. Run from the repository root:
+
+    python benchmarks/bench_fhir_primitives.py [--number N] [--repeat R]
+"""
+import argparse
+import pathlib
+import sys
+import timeit
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from src.fhir_sheets.core import fhir_formatting  # noqa: E402
+
+# valueType -> sample cell value
+PRIMITIVE_SAMPLES = {
+    'code': 'final',
+    'decimal': '98.6',
+    'id': 'patient-0001',
+    'integer': '-42',
+    'oid': 'urn:oid:2.16.840.1.113883.6.238',
+    'positiveInt': '17',
+    'unsignedInt': '0',
+    'uuid': 'urn:uuid:9f1c7a52-3b6e-4d0b-8e5c-2a7f4c1d9e30',
+    'boolean': 'yes',
+    'date': '2021-03-14',
+    'dateTime': '2021-03-14T09:26:53',
+    'instant': '2021-03-14T09:26:53.589Z',
+    'time': '09:26:53',
+    'Coding': 'http://loinc.org^8480-6^Systolic blood pressure',
+    'CodeableConcept': 'http://loinc.org^8480-6^Systolic blood pressure^Systolic',
+    'Quantity': '120^mm[Hg]',
+    'Address': '123 Main St^Atlanta^Fulton^30332^GA^USA',
+}
+
+
+def bench_primitive(valueType, value, number, repeat):
+    formatter = fhir_formatting.resolve_value_formatter(valueType)
+    assign_value = fhir_formatting.assign_value
+    def run():
+        assign_value({}, 'value', value, valueType, formatter)
+    best = min(timeit.repeat(run, number=number, repeat=repeat))
+    return best / number
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmark the FHIR primitive formatters.")
+    parser.add_argument('--number', type=int, default=20000, help="Calls per timing run.")
+    parser.add_argument('--repeat', type=int, default=5, help="Timing runs per primitive; the best is reported.")
+    args = parser.parse_args(argv)
+    print(f"{'valueType':<16} {'ns/value':>10}")
+    for valueType, value in PRIMITIVE_SAMPLES.items():
+        seconds = bench_primitive(valueType, value, args.number, args.repeat)
+        print(f"{valueType:<16} {seconds * 1e9:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""Synthetic cohort workbooks for benchmarking fhir_sheets.
+
+Writes workbooks laid out like the templates under samples/: a ResourceDefinitions sheet, a ResourceLinks sheet and a
+PatientData sheet whose first 6 rows describe each column (Entity To Query, JsonPath, Data Type, Value Set, Recommended
+Profile, Data Element), followed by one row per patient. Every workbook has a PrimaryPatient entity with the Patient
+columns of the samples (name, identifiers, race, ethnicity, birth sex, address); the remaining entities are Observations
+whose columns cycle through the requested value types. Cell values are drawn from a seeded random generator, so the same
+arguments always write the same workbook. Run from the repository root:
+
+    python benchmarks/synthetic_workbook.py OUTPUT.xlsx [--patients N] [--entities N] [--fields N] [--value_types T ...]
+"""
+import argparse
+import datetime
+import random
+
+import openpyxl
+
+PATIENT_PROFILE = 'http://hl7.org/fhir/us/core/StructureDefinition/us-core-patient'
+OBSERVATION_PROFILE = 'http://hl7.org/fhir/us/core/StructureDefinition/us-core-observation-lab'
+
+# (jsonPath, valueType, value generator) of the PrimaryPatient columns, taken from the sample workbooks
+PATIENT_FIELDS = [
+    ('Patient.extension[Race].ombCategory', 'code', lambda rng: rng.choice(['Asian', 'White', 'Black or African American'])),
+    ('Patient.extension[Ethnicity].ombCategory.value', 'code', lambda rng: rng.choice(['Hispanic or Latino', 'Not Hispanic or Latino'])),
+    ('Patient.extension[Birthsex].value', 'code', lambda rng: rng.choice(['M', 'F'])),
+    ('Patient.identifier[type=MRN].system', 'string', lambda rng: 'urn:mrn:http://hl7.org/fhir/sid/us-mrn'),
+    ('Patient.identifier[type=MRN].value', 'string', lambda rng: str(rng.randrange(10000000, 99999999))),
+    ('Patient.name.[0].family', 'string', lambda rng: rng.choice(['Smith', 'Johnson', 'Garcia', 'Nguyen', 'Okafor'])),
+    ('Patient.name.[0].given', 'string[]', lambda rng: rng.choice(['Alex', 'Sam', 'Jordan', 'Riley', 'Casey'])),
+    ('Patient.gender', 'code', lambda rng: rng.choice(['male', 'female'])),
+    ('Patient.birthDate', 'date', lambda rng: random_date(rng).isoformat()),
+    ('Patient.address.[0]', 'Address', lambda rng: f"{rng.randrange(1, 9999)} Main St^Atlanta^Fulton^30332^GA^USA"),
+]
+
+# valueType -> (jsonPath template, value generator) of the Observation columns.
+# {n} is the occurrence of the value type within the entity, so any number of columns can share a value type.
+OBSERVATION_FIELDS = {
+    'code': ('Observation.identifier.[{n}].use', lambda rng: rng.choice(['usual', 'official', 'secondary'])),
+    'string': ('Observation.note.[{n}].text', lambda rng: f"Synthetic note {rng.randrange(100000)}"),
+    'CodeableConcept': ('Observation.category.[{n}]', lambda rng: rng.choice([
+        'http://terminology.hl7.org/CodeSystem/observation-category^vital-signs^Vital Signs^Vital Signs',
+        'http://terminology.hl7.org/CodeSystem/observation-category^laboratory^Laboratory^Laboratory',
+        'http://terminology.hl7.org/CodeSystem/observation-category^exam^Exam^Exam',
+    ])),
+    'Coding': ('Observation.code.coding.[{n}]', lambda rng: rng.choice([
+        'http://loinc.org^8480-6^Systolic blood pressure',
+        'http://loinc.org^8462-4^Diastolic blood pressure',
+        'http://loinc.org^8867-4^Heart rate',
+    ])),
+    'Quantity': ('Observation.component.[{n}].valueQuantity', lambda rng: f"{rng.randrange(40, 200)}^mm[Hg]"),
+    'integer': ('Observation.component.[{n}].valueInteger', lambda rng: rng.randrange(-1000, 1000)),
+    'decimal': ('Observation.referenceRange.[{n}].low.value', lambda rng: round(rng.uniform(0, 300), 2)),
+    'boolean': ('Observation.component.[{n}].valueBoolean', lambda rng: rng.choice(['true', 'false', 'yes', 'no'])),
+    'date': ('Observation.component.[{n}].valuePeriod.start', lambda rng: random_date(rng).isoformat()),
+    'dateTime': ('Observation.component.[{n}].valueDateTime', lambda rng: random_datetime(rng).isoformat()),
+    'instant': ('Observation.extension.[{n}].valueInstant', lambda rng: random_datetime(rng).isoformat() + '.000Z'),
+    'time': ('Observation.component.[{n}].valueTime', lambda rng: random_datetime(rng).time().isoformat()),
+}
+
+# Value types of the Observation columns when none are requested
+DEFAULT_VALUE_TYPES = ['code', 'CodeableConcept', 'Quantity', 'dateTime', 'string']
+
+PATIENT_DATA_DESCRIPTIONS = ['Entity To Query', 'JsonPath', 'Data Type', 'Value Set', 'Recommended Profile', 'Data Element']
+
+
+def random_date(rng):
+    return datetime.date(1950, 1, 1) + datetime.timedelta(days=rng.randrange(365 * 70))
+
+
+def random_datetime(rng):
+    return datetime.datetime.combine(random_date(rng), datetime.time()) + datetime.timedelta(seconds=rng.randrange(86400))
+
+
+def plan_columns(entities, fields, value_types):
+    """The (entityName, resourceType, jsonPath, valueType, value generator) of every PatientData column."""
+    columns = [('PrimaryPatient', 'Patient', jsonPath, valueType, generate)
+               for jsonPath, valueType, generate in PATIENT_FIELDS]
+    for entity in range(1, entities):
+        entityName = f"Observation{entity}"
+        occurrences = {}
+        for field in range(fields):
+            valueType = value_types[field % len(value_types)]
+            occurrence = occurrences.get(valueType, 0)
+            occurrences[valueType] = occurrence + 1
+            jsonPath, generate = OBSERVATION_FIELDS[valueType]
+            columns.append((entityName, 'Observation', jsonPath.format(n=occurrence), valueType, generate))
+    return columns
+
+
+def write_synthetic_workbook(file_path, patients=100, entities=5, fields=10, value_types=None, seed=0):
+    """
+    Write a synthetic cohort workbook to file_path.
+    entities counts the PrimaryPatient entity; every other entity is an Observation with fields columns, whose value
+    types cycle through value_types. Returns the number of PatientData columns written.
+    """
+    value_types = list(value_types or DEFAULT_VALUE_TYPES)
+    unknown_value_types = [valueType for valueType in value_types if valueType not in OBSERVATION_FIELDS]
+    if unknown_value_types:
+        raise ValueError(f"Unsupported value types {unknown_value_types}. Expected some of: {', '.join(OBSERVATION_FIELDS)}")
+    rng = random.Random(seed)
+    columns = plan_columns(max(entities, 1), fields, value_types)
+    entity_definitions = {}
+    for entityName, resourceType, _, _, _ in columns:
+        entity_definitions.setdefault(entityName, resourceType)
+
+    workbook = openpyxl.Workbook(write_only=True)
+    definitions_sheet = workbook.create_sheet('ResourceDefinitions')
+    definitions_sheet.append(['Entity Name', 'ResourceType', 'Profile(s)'])
+    definitions_sheet.append(['The name of the entity.', 'The FHIR resourceType of the entity.', 'Comma separated profiles.'])
+    for entityName, resourceType in entity_definitions.items():
+        definitions_sheet.append([entityName, resourceType, PATIENT_PROFILE if resourceType == 'Patient' else OBSERVATION_PROFILE])
+
+    links_sheet = workbook.create_sheet('ResourceLinks')
+    links_sheet.append(['OriginResource', 'ReferencePath', 'DestinationResource'])
+    links_sheet.append(['The referencing entity.', 'The reference field.', 'The referenced entity.'])
+    for entityName, resourceType in entity_definitions.items():
+        if resourceType != 'Patient':
+            links_sheet.append([entityName, 'subject', 'PrimaryPatient'])
+
+    patient_data_sheet = workbook.create_sheet('PatientData')
+    header_rows = [
+        [column[0] for column in columns],
+        [column[2] for column in columns],
+        [column[3] for column in columns],
+        [None for _ in columns],
+        [PATIENT_PROFILE if column[1] == 'Patient' else OBSERVATION_PROFILE for column in columns],
+        [f"{column[0]} {column[2].split('.', 1)[1]}" for column in columns],
+    ]
+    for description, header_row in zip(PATIENT_DATA_DESCRIPTIONS, header_rows):
+        patient_data_sheet.append([description, None, *header_row])
+    for _ in range(patients):
+        patient_data_sheet.append([None, None, *(column[4](rng) for column in columns)])
+    workbook.save(file_path)
+    return len(columns)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic cohort workbook.")
+    parser.add_argument('output_file', type=str, help="Path of the xlsx workbook to write.")
+    parser.add_argument('--patients', type=int, default=100, help="Patient rows.")
+    parser.add_argument('--entities', type=int, default=5, help="Entities per patient, including PrimaryPatient.")
+    parser.add_argument('--fields', type=int, default=10, help="Columns per Observation entity.")
+    parser.add_argument('--value_types', nargs='+', choices=list(OBSERVATION_FIELDS), default=DEFAULT_VALUE_TYPES, help="Value types the Observation columns cycle through.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the generated cell values.")
+    args = parser.parse_args(argv)
+    column_count = write_synthetic_workbook(args.output_file, args.patients, args.entities, args.fields, args.value_types, args.seed)
+    print(f"Wrote {args.patients} patients x {column_count} columns to {args.output_file}")
+
+
+if __name__ == '__main__':
+    main()
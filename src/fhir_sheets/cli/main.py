@@ -1,26 +1,17 @@
 from ..core.config.FhirSheetsConfiguration import FhirSheetsConfiguration
 from ..core import read_input
 from ..core import conversion
+from ..core import parallel
+from ..core import metrics
+from ..core.conversion_plan import ConversionPlan
+from ..core.output import create_sink
 
 import logging
 import argparse
-import orjson
-import json
 from pathlib import Path
 
 logger: logging.Logger = logging.getLogger("fhirsheets.cli.main")
 
-def find_sets(d, path=""):
-    if isinstance(d, dict):
-        for key, value in d.items():
-            new_path = f"{path}.{key}" if path else str(key)
-            find_sets(value, new_path)
-    elif isinstance(d, list):  # Handle lists of dictionaries
-        for idx, item in enumerate(d):
-            find_sets(item, f"{path}[{idx}]")
-    elif isinstance(d, set):
-        logger.info(f"Set found at path: {path}")
-        
 def main(input_file, output_folder, config=FhirSheetsConfiguration({})):
     # Step 1: Read the input file using read_input module
     
@@ -31,22 +22,35 @@ def main(input_file, output_folder, config=FhirSheetsConfiguration({})):
         output_folder_path = Path().cwd() / Path(output_folder)
     if not output_folder_path.exists():
         output_folder_path.mkdir(parents=True, exist_ok=True)  # Create the folder if it doesn't exist
-    resource_definition_entities, resource_link_entities, cohort_data = read_input.read_xlsx_and_process(input_file)
-    #For each index of patients
-    for i in range(0,cohort_data.get_num_patients()):
-        # Construct the file path for each JSON file
-        file_path = output_folder_path / f"{i}.json"
-        #Create a bundle
-        fhir_bundle = conversion.create_transaction_bundle(resource_definition_entities, resource_link_entities, cohort_data, i, config)
-        # Step 3: Write the processed data to the output file
-        find_sets(fhir_bundle)
-        json_string = orjson.dumps(fhir_bundle)
-        with open(file_path, 'wb') as json_file:
-            json_file.write(json_string)
-        with open(file_path, 'r') as json_file:
-            json_string = json.load(json_file)
-        with open(file_path, 'w') as json_file:
-            json.dump(json_string, json_file, indent = 4)
+    if config.metrics_out:
+        metrics.enable_metrics()
+        try:
+            with metrics.stage('total'):
+                convert_workbook(input_file, output_folder_path, config)
+            metrics.record_cache_stats()
+            metrics.get_metrics().write_json(Path(config.metrics_out))
+        finally:
+            metrics.disable_metrics()
+    else:
+        convert_workbook(input_file, output_folder_path, config)
+
+def convert_workbook(input_file, output_folder_path, config):
+    # The CLI never writes back to the workbook, so stream it in read-only mode one patient at a time
+    resource_definition_entities, resource_link_entities, cohort_data, patients = read_input.stream_xlsx_and_process(input_file)
+    # Everything that does not change between patients is resolved once for the whole workbook
+    with metrics.stage('plan.compile'):
+        conversion_plan = ConversionPlan.compile(resource_definition_entities, cohort_data.headers, resource_link_entities)
+    # Step 2: Create a bundle for each patient, on a pool of worker processes when more than one worker is configured
+    if config.workers > 1:
+        bundles = parallel.convert_patients_in_parallel(resource_definition_entities, resource_link_entities, cohort_data, patients, config, conversion_plan, config.workers)
+    else:
+        bundles = ((i, conversion.create_transaction_bundle(resource_definition_entities, resource_link_entities, cohort_data, i, config, patient_entry, conversion_plan))
+                   for i, patient_entry in patients)
+    # Step 3: Write the processed data in the configured output format, in patient order
+    with create_sink(output_folder_path, config) as sink:
+        for i, fhir_bundle in bundles:
+            with metrics.stage('write'):
+                sink.write(i, fhir_bundle)
 
 if __name__ == "__main__":
     # Create the argparse CLI
@@ -63,6 +67,23 @@ if __name__ == "__main__":
     
     # Define the output file argument
     parser.add_argument('--medications_as_reference', type=str, help="Configuration option to create medication references. You may still provide medicationCodeableConcept, but a post process will convert the codeableconcepts to medication resources", default=False)
+    parser.add_argument('--deduplicate_medications', action='store_true', help="Configuration option, used with medications_as_reference, to give every Medication created for a medication code one id across the cohort. With the 'bulk' output format each Medication is then written once.")
+    
+    # Output formatting
+    parser.add_argument('--compact_output', action='store_true', help="Configuration option to write output JSON without indentation or line breaks. Output is pretty printed with 2 space indentation by default.")
+    parser.add_argument('--output_format', type=str, choices=['json', 'ndjson', 'bulk', 'tar'], default='json', help="Configuration option for the output layout. 'json' writes one {index}.json bundle file per patient, 'ndjson' writes every bundle as a line of Bundle.ndjson, 'bulk' writes every resource as a line of {resourceType}.ndjson (FHIR Bulk Data style), and 'tar' streams every bundle as an {index}.json member of Bundle.tar.")
+    parser.add_argument('--compression', type=str, choices=['none', 'gzip', 'zstd'], default='none', help="Configuration option to compress 'ndjson', 'bulk' and 'tar' output. 'zstd' requires the optional zstandard package.")
+    parser.add_argument('--compression_level', type=int, default=None, help="Configuration option for the compression level. Defaults to 6 for gzip and 3 for zstd.")
+    
+    # Resource ids
+    parser.add_argument('--deterministic_ids', action='store_true', help="Configuration option to derive bundle and resource ids from the random seed, patient index and entity name instead of generating random ids, so repeated, parallel and sharded runs produce identical output. Use with --random_seed.")
+    parser.add_argument('--random_seed', type=int, default=argparse.SUPPRESS, help="Configuration option for the seed of generated values and deterministic ids. Defaults to the current time.")
+    
+    # Parallelism
+    parser.add_argument('--workers', type=int, default=1, help="Configuration option for the number of worker processes converting patients. Output is written in patient order either way.")
+    
+    # Instrumentation
+    parser.add_argument('--metrics_out', type=str, default=None, help="Configuration option to record per-stage wall times, counters and cache hit rates of the run, and write them as JSON to this path. Nothing is recorded by default.")
     # Parse the arguments
     args = parser.parse_args()
 
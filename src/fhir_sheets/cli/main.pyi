@@ -1,6 +1,10 @@
-from ..core import conversion as conversion, read_input as read_input
+import logging
+from ..core import conversion as conversion, metrics as metrics, parallel as parallel, read_input as read_input
 from ..core.config.FhirSheetsConfiguration import FhirSheetsConfiguration as FhirSheetsConfiguration
-from pprint import pprint as pprint
+from ..core.conversion_plan import ConversionPlan as ConversionPlan
+from ..core.output import create_sink as create_sink
+
+logger: logging.Logger
 
-def find_sets(d, path: str = '') -> None: ...
 def main(input_file, output_folder, config=...) -> None: ...
+def convert_workbook(input_file, output_folder_path, config) -> None: ...
@@ -8,10 +8,26 @@ class FhirSheetsConfiguration():
         self.medications_as_reference = data.get('medications_as_reference', False)
         self.random_seed = data.get('random_seed', int(time.time() * 1000))
         self.build_empty_resources = data.get('build_empty_resources', False)
+        self.compact_output = data.get('compact_output', False)
+        self.output_format = data.get('output_format', 'json')
+        self.compression = data.get('compression', 'none')
+        self.compression_level = data.get('compression_level', None)
+        self.workers = data.get('workers', 1)
+        self.deterministic_ids = data.get('deterministic_ids', False)
+        self.deduplicate_medications = data.get('deduplicate_medications', False)
+        self.metrics_out = data.get('metrics_out', None)
     
     def __repr__(self) -> str:
         return (f"FhirSheetsConfiguration("
                 f"preview_mode={self.preview_mode}, "
                 f"medications_as_reference={self.medications_as_reference}, "
                 f"random_seed={self.random_seed}, "
-                f"build_empty_resources={self.build_empty_resources})")
\ No newline at end of file
+                f"build_empty_resources={self.build_empty_resources}, "
+                f"compact_output={self.compact_output}, "
+                f"output_format={self.output_format}, "
+                f"compression={self.compression}, "
+                f"compression_level={self.compression_level}, "
+                f"workers={self.workers}, "
+                f"deterministic_ids={self.deterministic_ids}, "
+                f"deduplicate_medications={self.deduplicate_medications}, "
+                f"metrics_out={self.metrics_out})")
\ No newline at end of file
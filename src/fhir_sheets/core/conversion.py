@@ -1,16 +1,20 @@
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 import uuid
 import random
 import logging
+import orjson
 from jsonpath_ng.jsonpath import Fields, Slice, Where
 from jsonpath_ng.ext import parse as parse_ext
 
 from .config.FhirSheetsConfiguration import FhirSheetsConfiguration
+from .conversion_plan import ConversionPlan, EntityPlan, PlannedField, ResourceLinkPlan, compile_entity_plan
+from .json_path import IndexSegment, KeyIndexSegment, KeySegment, PathSegment, parse_json_path
 
-from .model.cohort_data_entity import CohortData, CohortData
+from .model.cohort_data_entity import CohortData, PatientEntry
 from .model.resource_definition_entity import ResourceDefinition
 from .model.resource_link_entity import ResourceLink
 from . import fhir_formatting
+from . import metrics
 from . import special_values
 
 logger = logging.getLogger("fhirsheets.core.conversion")
@@ -19,28 +23,40 @@ logger = logging.getLogger("fhirsheets.core.conversion")
 _file_random = random.Random()
 #Main top level function
 #Creates a full transaction bundle for a patient at index
+#When patient_entry is given it is converted instead of cohort_data.patients[index]; cohort_data then only has to supply
+#the headers, which lets callers stream patients (see read_input.stream_xlsx_and_process) without materializing them.
+#conversion_plan should be compiled once per workbook with ConversionPlan.compile and reused for every patient.
 def create_transaction_bundle(
     resource_definition_entities: List[ResourceDefinition],
     resource_link_entities: List[ResourceLink],
     cohort_data: CohortData,
     index: int = 0,
     config: FhirSheetsConfiguration = FhirSheetsConfiguration({}),
+    patient_entry: Optional[PatientEntry] = None,
+    conversion_plan: Optional[ConversionPlan] = None,
 ) -> Dict[str, Any]:
     global _file_random
     _file_random = random.Random(config.random_seed)
-    root_bundle = initialize_bundle(config)
-    created_resources = create_resources(
-        resource_definition_entities,
-        resource_link_entities,
-        cohort_data,
-        index,
-        config
-    )
-    #Construct into fhir bundle
-    for fhir_resource in created_resources.values():
-        add_resource_to_transaction_bundle(root_bundle, fhir_resource)
-    if config.medications_as_reference:
-        post_process_create_medication_references(root_bundle)
+    metrics.count('patients')
+    with metrics.stage('convert.bundle'):
+        id_generator = ResourceIdGenerator(config, index)
+        root_bundle = initialize_bundle(config, id_generator.generate('Bundle'))
+        created_resources = create_resources(
+            resource_definition_entities,
+            resource_link_entities,
+            cohort_data,
+            index,
+            config,
+            patient_entry,
+            conversion_plan,
+            id_generator,
+        )
+        #Construct into fhir bundle
+        for fhir_resource in created_resources.values():
+            add_resource_to_transaction_bundle(root_bundle, fhir_resource)
+        if config.medications_as_reference:
+            with metrics.stage('convert.medication_references'):
+                post_process_create_medication_references(root_bundle, id_generator)
     return root_bundle
 
 def create_resources(
@@ -49,22 +65,37 @@ def create_resources(
     cohort_data: CohortData,
     index: int = 0,
     config: FhirSheetsConfiguration = FhirSheetsConfiguration({}),
+    patient_entry: Optional[PatientEntry] = None,
+    conversion_plan: Optional[ConversionPlan] = None,
+    id_generator: Optional['ResourceIdGenerator'] = None,
 ) -> Dict[str, Dict[str, Any]]:
+    if conversion_plan is None:
+        conversion_plan = ConversionPlan.compile(resource_definition_entities, cohort_data.headers)
+    if id_generator is None:
+        id_generator = ResourceIdGenerator(config, index)
+    entries_by_entity = group_entries_by_entity(get_patient_entry(cohort_data, index, patient_entry))
     # Mapping from entity name to the created FHIR resource dictionary
     created_resources: Dict[str, Dict[str, Any]] = {}
-    for resource_definition in resource_definition_entities:
-        entityName = resource_definition.entityName
-        if not entries_exist(entityName, cohort_data, index) and not config.build_empty_resources:
+    for entity_plan in conversion_plan.entity_plans:
+        entityName = entity_plan.resource_definition.entityName
+        entity_entries = entries_by_entity.get(entityName, [])
+        if not entity_entries and not config.build_empty_resources:
             logger.info(f"Patient index {index} - Skipping resource creation for entity '{entityName}' as no data entries found and build_empty_resources is set to False")
             continue
         #Create and collect fhir resources
-        fhir_resource = create_fhir_resource(resource_definition, cohort_data, index, config)
+        with metrics.stage(f"convert.resource.{entityName}"):
+            fhir_resource = build_fhir_resource(entity_plan, entity_entries, index, id_generator.generate(entityName))
         created_resources[entityName] = fhir_resource
+    metrics.count('resources', len(created_resources))
     #Link resources after creation
-    add_default_resource_links(created_resources, resource_link_entities)
-    create_resource_links(created_resources, resource_link_entities, config.preview_mode)
+    with metrics.stage('convert.links'):
+        link_plan = conversion_plan.link_plan
+        if link_plan is None:
+            link_plan = ResourceLinkPlan(resource_link_entities, resource_definition_entities)
+        create_resource_links(created_resources, link_plan.resolve_links(created_resources), config.preview_mode)
     #Post-Process to clean the empty references from the resources
-    created_resources = clean_empty(created_resources)
+    with metrics.stage('convert.prune_empty'):
+        prune_empty_in_place(created_resources)
     return created_resources
 
 def create_singular_resource(
@@ -83,15 +114,16 @@ def create_singular_resource(
         created_resources[entityName] = fhir_resource
         if entityName == singleton_entityName:
             singleton_fhir_resource = fhir_resource
-    add_default_resource_links(created_resources, resource_link_entities)
-    create_resource_links(created_resources, resource_link_entities, preview_mode=True)
+    resource_links = add_default_resource_links(created_resources, resource_link_entities)
+    create_resource_links(created_resources, resource_links, preview_mode=True)
     return singleton_fhir_resource
 
 #Initialize root bundle definition
-def initialize_bundle(config: FhirSheetsConfiguration) -> Dict[str, Any]:
+#A random id is generated when bundle_id is not given
+def initialize_bundle(config: FhirSheetsConfiguration, bundle_id: Optional[str] = None) -> Dict[str, Any]:
     root_bundle: Dict[str, Any] = {}
     root_bundle['resourceType'] = 'Bundle'
-    root_bundle['id'] = str(generate_UUID()).strip()
+    root_bundle['id'] = bundle_id if bundle_id is not None else str(generate_UUID()).strip()
     root_bundle['meta'] = {
         'security': [{
             'system': 'http://terminology.hl7.org/CodeSystem/v3-ActReason',
@@ -104,19 +136,20 @@ def initialize_bundle(config: FhirSheetsConfiguration) -> Dict[str, Any]:
     return root_bundle
 
 #Initialize a resource from a resource definition. Adding basic information all resources need
-def initialize_resource(resource_definition: ResourceDefinition) -> Dict[str, Any]:
+def initialize_resource(resource_definition: ResourceDefinition, resource_id: Optional[str] = None) -> Dict[str, Any]:
     """Create a minimal FHIR resource dictionary based on a ``ResourceDefinition``.
 
     The function populates the mandatory ``resourceType`` and ``id`` fields and, if
     the definition includes ``profiles``, adds a ``meta`` block with the profile
-    information and a standard security tag.
+    information and a standard security tag. A random ``id`` is generated when
+    ``resource_id`` is not given.
     """
     # The original implementation mistakenly referenced an undefined variable
     # ``initial_resource`` and also created an unused ``created_resources`` dict.
     # We initialise a fresh dictionary here and populate it correctly.
     initial_resource: Dict[str, Any] = {}
     initial_resource["resourceType"] = resource_definition.resourceType.strip()
-    initial_resource["id"] = str(generate_UUID()).strip()
+    initial_resource["id"] = resource_id if resource_id is not None else str(generate_UUID()).strip()
     if getattr(resource_definition, "profiles", None):
         initial_resource["meta"] = {
             "profile": resource_definition.profiles,
@@ -134,109 +167,54 @@ def create_fhir_resource(
     cohort_data: CohortData,
     index: int = 0,
     config: FhirSheetsConfiguration = FhirSheetsConfiguration({}),
+    patient_entry: Optional[PatientEntry] = None,
 ) -> Dict[str, Any]:
-    resource_dict = initialize_resource(resource_definition)
+    patient = get_patient_entry(cohort_data, index, patient_entry)
     #Get field entries for this entity
-    header_entries_for_resourcename = [
-        headerEntry
-        for headerEntry in cohort_data.headers
-        if headerEntry.entityName == resource_definition.entityName
-    ]
-    dataelements_for_resourcename = {
-        field_name: value
-        for (entityName, field_name), value in cohort_data.patients[index].entries.items()
+    entity_plan = compile_entity_plan(resource_definition, cohort_data.headers)
+    entity_entries = [
+        (field_name, value)
+        for (entityName, field_name), value in patient.entries.items()
         if entityName == resource_definition.entityName
-    }
-    if len(dataelements_for_resourcename.keys()) == 0:
+    ]
+    return build_fhir_resource(entity_plan, entity_entries, index)
+
+# Executes an entity plan against the (fieldName, value) entries of one patient for that entity
+def build_fhir_resource(
+    entity_plan: EntityPlan,
+    entity_entries: List[Tuple[Any, Any]],
+    index: int = 0,
+    resource_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    resource_definition = entity_plan.resource_definition
+    resource_dict = initialize_resource(resource_definition, resource_id)
+    if len(entity_entries) == 0:
         logger.warning(f"Patient index {index} - Create Fhir Resource Error - {resource_definition.entityName} - No columns for entity '{resource_definition.entityName}' found for resource in 'PatientData' sheet")
         return resource_dict
-        all_field_entries = cohort_data.entities[resource_definition.entityName].fields
+    #The fragments of special handlers are merged through entry indexes kept for this resource only
+    entry_indexes: EntryIndexes = {}
     #For each field within the entity
-    for fieldName, value in dataelements_for_resourcename.items():
-        header_element = next((header for header in header_entries_for_resourcename if header.fieldName == fieldName), None)
-        if header_element is None:
+    for fieldName, value in entity_entries:
+        planned_field = entity_plan.fields_by_name.get(fieldName)
+        if planned_field is None:
             logger.warning(f" Field Name {fieldName} - No Header Entry found.")
             continue
-        jsonPath = header_element.jsonPath
-        if jsonPath is None:
+        if planned_field.jsonPath is None:
             logger.warning(f" Field Name {fieldName} - Header Entry found, but jsonPath attribute is None. Skipping.")
             continue
-        valueType = header_element.valueType
-        if valueType is None:
+        if planned_field.valueType is None:
             logger.warning(f" Field Name {fieldName} - Header Entry found, but valueType attribute is None. Skipping.")
             continue
-        create_structure_from_jsonpath(resource_dict, jsonPath, resource_definition, valueType, value)
+        create_structure_from_planned_field(resource_dict, planned_field, resource_definition, value, entry_indexes)
     return resource_dict
 
 #Create a resource_link for default references in the cases where only 1 resourceType of the source and destination exist
+#Returns resource_link_entities followed by the default links that apply to created_resources; resource_link_entities is not modified.
 def add_default_resource_links(
     created_resources: Dict[str, Dict[str, Any]],
     resource_link_entities: List[ResourceLink],
-) -> None:
-    default_references = [
-        ('allergyintolerance', 'patient', 'patient'),
-        ('allergyintolerance', 'practitioner', 'asserter'),
-        ('careplan', 'goal', 'goal'),
-        ('careplan', 'patient', 'subject'),
-        ('careplan', 'practitioner', 'performer'),
-        ('diagnosticreport', 'careteam', 'performer'),
-        ('diagnosticreport', 'imagingStudy', 'imagingStudy'),
-        ('diagnosticreport', 'observation', 'result'),
-        ('diagnosticreport', 'organization', 'performer'),
-        ('diagnosticreport', 'practitioner', 'performer'),
-        ('diagnosticreport', 'practitionerrole', 'performer'),
-        ('diagnosticreport', 'specimen', 'specimen'),
-        ('encounter', 'condition', 'reasonReference'),
-        ('encounter', 'location', 'location'),
-        ('encounter', 'organization', 'serviceProvider'),
-        ('encounter', 'patient', 'subject'),
-        ('encounter', 'practitioner', 'participant'),
-        ('goal', 'condition', 'addresses'),
-        ('goal', 'patient', 'subject'),
-        ('immunization', 'patient', 'patient'),
-        ('immunization', 'practitioner', 'performer'),
-        ('immunization', 'organization', 'manufacturer'),
-        ('medicationrequest', 'medication', 'medicationReference'),
-        ('medicationrequest', 'patient', 'subject'),
-        ('medicationrequest', 'practitioner', 'requester'),
-        ('observation', 'device', 'device'),
-        ('observation', 'patient', 'subject'),
-        ('observation', 'practitioner', 'performer'),
-        ('observation', 'specimen', 'specimen'),
-        ('procedure', 'device', 'usedReference'),
-        ('procedure', 'location', 'location'),
-        ('procedure', 'patient', 'subject'),
-        ('procedure', 'practitioner', 'performer'),
-    ]
-    
-    resource_counts = {}
-    for resourceName, resource in created_resources.items():
-        resourceType: str = resource['resourceType'].lower().strip()
-        if resourceType not in resource_counts:
-            resource_counts[resourceType]= {'count': 1, 'singletonEntityName': resourceName, 'singleResource': resource}
-        else:
-            resource_counts[resourceType]['count'] += 1
-            resource_counts[resourceType]['singletonResource'] = resource
-            resource_counts[resourceType]['singletonEntityName'] = resourceName
-            
-    for default_reference in default_references:
-        sourceType = default_reference[0]
-        destinationType = default_reference[1]
-        fieldName = default_reference[2]
-        if (
-            sourceType in resource_counts
-            and destinationType in resource_counts
-            and resource_counts[sourceType]["count"] == 1
-            and resource_counts[destinationType]["count"] == 1
-        ):
-            originResourceEntityName: str = resource_counts[sourceType]["singletonEntityName"]
-            destinationResourceEntityName: str = resource_counts[destinationType]["singletonEntityName"]
-            new_link = ResourceLink(originResourceEntityName, fieldName, destinationResourceEntityName)
-            if (new_link.originResource, new_link.referencePath, new_link.destinationResource) not in [(l.originResource, l.referencePath, l.destinationResource) for l in resource_link_entities]:
-                resource_link_entities.append(
-                    new_link
-                )
-    return
+) -> List[ResourceLink]:
+    return ResourceLinkPlan(resource_link_entities).resolve_links(created_resources)
         
             
 #List function to create resource references/links with created entities
@@ -321,7 +299,7 @@ def add_resource_to_transaction_bundle(root_bundle: Dict[str, Any], fhir_resourc
     root_bundle['entry'].append(entry)
     return root_bundle
 
-#Drill down and create a structure from a json path with a simple recurisve process
+#Drill down and create a structure from a json path
 # Supports 2 major features:
 # 1) dot notation such as $.codeableconcept.coding[0].value = 1234
 # 2) simple qualifiers such as $.name[use=official].family = Dickerson
@@ -344,11 +322,30 @@ def create_structure_from_jsonpath(
     if value == None:
         logger.warning(f" Full jsonpath: {json_path} - Expected to find a value but found None instead")
         return root_struct
-    #Start of top-level function which calls the enclosed recursive function
+    #Start of top-level function which walks the parsed path
     parts = json_path.split('.')
     return build_structure(root_struct, json_path, resource_definition, dataType, parts, value, [])
 
-# main recursive function to drill into the json structure, assign paths, and create structure where needed
+#Same as create_structure_from_jsonpath, for a field whose jsonPath was already parsed and whose handler was already resolved
+def create_structure_from_planned_field(
+    root_struct: Dict[str, Any],
+    planned_field: PlannedField,
+    resource_definition: ResourceDefinition,
+    value: Any,
+    entry_indexes: Optional["EntryIndexes"] = None,
+) -> Any:
+    if planned_field.normalizedValueType == 'string':
+        value = str(value)
+    if value == None:
+        logger.warning(f" Full jsonpath: {planned_field.jsonPath} - Expected to find a value but found None instead")
+        return root_struct
+    if planned_field.structureHandler is not None:
+        return apply_structure_handler(planned_field.structureHandler, root_struct, planned_field.jsonPath, resource_definition, planned_field.valueType,
+                                       planned_field.segments[-1].text, value, entry_indexes)
+    return build_structure_from_segments(root_struct, planned_field.jsonPath, resource_definition, planned_field.valueType, planned_field.segments, value,
+                                         formatter=planned_field.valueFormatter)
+
+# main function to drill into the json structure, assign paths, and create structure where needed
 def build_structure(
     current_struct: Any,
     json_path: str,
@@ -360,154 +357,314 @@ def build_structure(
 ) -> Any:
     if len(parts) == 0:
         return current_struct
-    #Grab current part
-    part = parts[0]
     #SPECIAL HANDLING CLAUSE
-    matching_handler = next((handler for handler in special_values.custom_structure_handlers if (json_path.startswith(handler) or json_path == handler)), None)
+    matching_handler = special_values.resolve_structure_handler(json_path)
     if matching_handler is not None:
-        return special_values.custom_structure_handlers[matching_handler].assign_value(json_path, resource_definition, dataType,  current_struct, parts[-1], value)
-    #Ignore dollar sign ($) and drill farther down
-    if part == '$' or part == resource_definition.resourceType.strip():
-        #Ignore the dollar sign and the resourcetype
-        return build_structure_recurse(current_struct, json_path, resource_definition, dataType, parts, value, previous_parts, part)
-    
-    # If parts length is one then this is the final key to access and pair
-    if len(parts) == 1:
-        #Check for numeric qualifier '[0]' and '[1]'
-        if '[' in part and ']' in part:
-        #Seperate the key from the qualifier
-            key_part = part[:part.index('[')]
-            qualifier = part[part.index('[')+1:part.index(']')]
-            qualifier_condition = qualifier.split('=')
-            
-            #If there is no key part, aka '[0]', '[1]' etc, then it's a simple accessor
-            if key_part is None or key_part == '':
-                if not qualifier.isdigit():
-                    raise TypeError(f"ERROR: Full jsonpath: {json_path} - current path - {'.'.join(previous_parts + parts[:1])} - qualifier - {qualifier} - standalone qualifier expected to be a single index numeric ([0], [1], etc)")
-                qualifier = int(qualifier)
-                if current_struct == {}:
-                    current_struct = []
-                if not isinstance(current_struct, list):
-                    raise TypeError(f"ERROR: Full jsonpath: {json_path} - current path - {'.'.join(previous_parts + parts[:1])} - Expected a list, but got {type(current_struct).__name__} instead.")
-                part = int(qualifier)
-                if part + 1 > len(current_struct):
-                    current_struct.extend({} for x in range (part + 1 - len(current_struct)))
-                #Assign the indexed part
-                fhir_formatting.assign_value(current_struct, part, value, dataType)
-                return current_struct
-        #Default case where there was no qualifier, simply assign here.
-        fhir_formatting.assign_value(current_struct, part, value, dataType)
-        return current_struct
-    
-    # If there is a simple qualifier with '['and ']'
-    elif '[' in part and ']' in part:
-        #Seperate the key from the qualifier
-        key_part = part[:part.index('[')]
-        qualifier = part[part.index('[')+1:part.index(']')]
-        qualifier_condition = qualifier.split('=')
-        
-        #If there is no key part, aka '[0]', '[1]' etc, then it's a simple accessor
-        if key_part is None or key_part == '':
-            if not qualifier.isdigit():
-                raise TypeError(f"ERROR: Full jsonpath: {json_path} - current path - {'.'.join(previous_parts + parts[:1])} - qualifier - {qualifier} - standalone qualifier expected to be a single index numeric ([0], [1], etc)")
-            if current_struct == {}:
-                current_struct = []
-            if not isinstance(current_struct, list):
-                raise TypeError(f"ERROR: Full jsonpath: {json_path} - current path - {'.'.join(previous_parts + parts[:1])} - Expected a list, but got {type(current_struct).__name__} instead.")
-            qualifier_as_number = int(qualifier)
-            if qualifier_as_number + 1 > len(current_struct):
-                current_struct.extend({} for x in range (qualifier_as_number + 1 - len(current_struct)))
-            inner_struct = current_struct[qualifier_as_number]
-            inner_struct = build_structure_recurse(inner_struct, json_path, resource_definition, dataType, parts, value, previous_parts, part)
-            current_struct[qualifier_as_number] = inner_struct
-            return current_struct
-        # Create the key part in the structure
-        if (not key_part in current_struct) or (isinstance(current_struct[key_part], dict)):
-            current_struct[key_part] = []
-        #If there is a key_part and the If the qualifier condition is defined
-        if len(qualifier_condition) == 2:
-            #special handling for code
-            if key_part != "coding" and (qualifier_condition[0] in ('code', 'system')):
-                #Move into the coding section if a qualifier asks for 'code' or 'system'
-                if 'coding' not in current_struct:
-                    current_struct['coding'] = []
-                    current_struct = current_struct['coding']
-            qualifier_key, qualifier_value = qualifier_condition
-            # Retrieve an inner structure if it exists allready that matches the criteria
-            inner_struct = next((innerElement for innerElement in current_struct[key_part] if isinstance(innerElement, dict) and innerElement.get(qualifier_key) == qualifier_value), None)
-            #If no inner structure exists, create one instead
-            if inner_struct is None:
-                inner_struct = {qualifier_key: qualifier_value}
-                current_struct[key_part].append(inner_struct)
-            #Recurse into that innerstructure where the qualifier matched to continue the part traversal
-            inner_struct = build_structure_recurse(inner_struct, json_path, resource_definition, dataType, parts, value, previous_parts, part)
-            return current_struct
-        #If there's no qualifier condition, but an index aka '[0]', '[1]' etc, then it's a simple accessor
-        elif qualifier.isdigit():
-            if not isinstance(current_struct[key_part], list):
-                raise TypeError(f"ERROR: Full jsonpath: {json_path} - current path - {'.'.join(previous_parts + [parts[0]])} - Expected a list, but got {type(current_struct).__name__} instead.")
-            qualifier_as_number = int(qualifier)
-            if qualifier_as_number > len(current_struct):
-                current_struct[key_part].extend({} for x in range (qualifier_as_number - len(current_struct)))
-            inner_struct = current_struct[key_part][qualifier_as_number]
-            inner_struct = build_structure_recurse(inner_struct, json_path, resource_definition, dataType, parts, value, previous_parts, part)
-            current_struct[key_part][qualifier_as_number] = inner_struct
-            return current_struct
-    #None qualifier accessor
-    else:
-        if(part not in current_struct):
-            current_struct[part] = {}
-        inner_struct = build_structure_recurse(current_struct[part], json_path, resource_definition, dataType, parts, value, previous_parts, part)
-        current_struct[part] = inner_struct
-        return current_struct
-    
-#Helper function to quickly recurse and return the next level of structure. Used by main recursive function
-def build_structure_recurse(
+        return apply_structure_handler(matching_handler, current_struct, json_path, resource_definition, dataType, parts[-1], value)
+    segments = parse_json_path('.'.join(parts))
+    return build_structure_from_segments(current_struct, json_path, resource_definition, dataType, segments, value, previous_parts)
+
+class EntryIndex:
+    """
+    Positions of the entries of one repeating element of a resource, such as its identifier list, by the keys
+    entry_keys returns for each entry (e.g. the identifier type codes), so fragments find the entry for a key in O(1).
+    Entries appended by anything else are indexed on the next lookup, and the list is indexed again when a position no
+    longer holds an entry with its key or the list got shorter. When several entries share a key the first one wins.
+    """
+    def __init__(self, entries: List[Any], entry_keys: Callable[[Any], Iterable[Any]]):
+        self.entries: List[Any] = entries
+        self.entry_keys: Callable[[Any], Iterable[Any]] = entry_keys
+        self.positions: Dict[Any, int] = {}
+        self.indexed_count: int = 0
+
+    def _index_entries(self) -> None:
+        if self.indexed_count > len(self.entries):
+            self.positions = {}
+            self.indexed_count = 0
+        for position in range(self.indexed_count, len(self.entries)):
+            for key in self.entry_keys(self.entries[position]):
+                self.positions.setdefault(key, position)
+        self.indexed_count = len(self.entries)
+
+    def find(self, key) -> Optional[Any]:
+        self._index_entries()
+        position = self.positions.get(key)
+        if position is None:
+            return None
+        entry = self.entries[position]
+        if key in self.entry_keys(entry):
+            return entry
+        # The list was changed in place; index it again from scratch
+        self.positions = {}
+        self.indexed_count = 0
+        self._index_entries()
+        position = self.positions.get(key)
+        return self.entries[position] if position is not None else None
+
+    def insert(self, position: int, key, entry) -> None:
+        self._index_entries()
+        self.entries.insert(position, entry)
+        if position < len(self.entries) - 1:
+            # The entries after it moved; index them again on the next lookup
+            self.positions = {}
+            self.indexed_count = 0
+            return
+        self.positions.setdefault(key, position)
+        self.indexed_count = len(self.entries)
+
+# The entry indexes of one resource, by (id of the entries list, entry_keys)
+EntryIndexes = Dict[Tuple[int, Callable[[Any], Iterable[Any]]], EntryIndex]
+
+#Find the index of entries by entry_keys among entry_indexes, creating it if the resource does not have it yet
+def get_entry_index(entry_indexes: EntryIndexes, entries: List[Any], entry_keys: Callable[[Any], Iterable[Any]]) -> EntryIndex:
+    index_key = (id(entries), entry_keys)
+    entry_index = entry_indexes.get(index_key)
+    # The index holds on to its list, so a matching id is the same list for as long as entry_indexes lasts
+    if entry_index is None or entry_index.entries is not entries:
+        entry_index = EntryIndex(entries, entry_keys)
+        entry_indexes[index_key] = entry_index
+    return entry_index
+
+#Apply the structure handler a jsonpath resolved to. Fragment handlers only describe what the value adds; their
+#fragment is merged here, through entry_indexes when the caller keeps them for the resource being built.
+#Returns {} when the value adds nothing, like the handlers' own assign_value.
+def apply_structure_handler(
+    handler: special_values.AbstractStructureHandler,
+    current_struct: Any,
+    json_path: Optional[str],
+    resource_definition: ResourceDefinition,
+    dataType: Optional[str],
+    key: str,
+    value: Any,
+    entry_indexes: Optional[EntryIndexes] = None,
+) -> Any:
+    if not isinstance(handler, special_values.FragmentStructureHandler):
+        return handler.assign_value(json_path, resource_definition, dataType, current_struct, key, value)
+    fragment = handler.build_fragment(json_path, value)
+    if fragment is None:
+        return {}
+    merge_fragment(current_struct, fragment, resource_definition, dataType, {} if entry_indexes is None else entry_indexes)
+    return current_struct
+
+#Merge a fragment built by a FragmentStructureHandler into current_struct
+def merge_fragment(
+    current_struct: Any,
+    fragment: special_values.StructureFragment,
+    resource_definition: ResourceDefinition,
+    dataType: Optional[str],
+    entry_indexes: EntryIndexes,
+) -> None:
+    if isinstance(fragment, special_values.FieldFragment):
+        current_struct[fragment.key] = fragment.value
+        return
+    if isinstance(fragment, special_values.PathFragment):
+        json_path = '.'.join(fragment.parts)
+        build_structure_from_segments(current_struct, json_path, resource_definition, dataType, parse_json_path(json_path), fragment.value, list(fragment.previous_parts))
+        return
+    entries = current_struct.setdefault(fragment.list_key, [])
+    entry_index = get_entry_index(entry_indexes, entries, fragment.entry_keys)
+    entry = entry_index.find(fragment.match_key)
+    if entry is None:
+        entry = fragment.new_entry
+        position = len(entries)
+        if fragment.order is not None:
+            entry_order = fragment.order(entry)
+            while position > 0:
+                previous_order = fragment.order(entries[position - 1])
+                if entry_order is None or previous_order is None or previous_order <= entry_order:
+                    break
+                position -= 1
+        entry_index.insert(position, fragment.match_key, entry)
+    for child in fragment.children:
+        merge_fragment(entry, child, resource_definition, dataType, entry_indexes)
+
+# Walks the parsed segments of a json path iteratively, creating structure where needed, and assigns the value at the last segment
+# Special structure handlers are not consulted here; callers resolve them for the whole json path beforehand.
+# formatter, when given, is the value formatter already resolved for dataType.
+def build_structure_from_segments(
     current_struct: Any,
     json_path: str,
     resource_definition: ResourceDefinition,
     dataType: str,
-    parts: List[str],
+    segments: Tuple[PathSegment, ...],
     value: Any,
-    previous_parts: List[str],
-    part: str,
+    previous_parts: List[str] = [],
+    formatter: Optional[Callable[[Any, Any, Any], Any]] = None,
 ) -> Any:
-    previous_parts.append(part)
-    return_struct = build_structure(current_struct, json_path, resource_definition, dataType, parts[1:], value, previous_parts)
-    return return_struct
+    resource_type = resource_definition.resourceType.strip()
+    root_struct = current_struct
+    # The structure holding current_struct, so that an empty {} placeholder can be swapped for a list
+    parent_struct: Any = None
+    parent_key: Any = None
+    last_position = len(segments) - 1
+    for position, segment in enumerate(segments):
+        segment_type = type(segment)
+        #Ignore dollar sign ($) and the resourcetype and drill farther down
+        if segment_type is KeySegment and (segment.key == '$' or segment.key == resource_type):
+            continue
+        # If there is no key part, aka '[0]', '[1]' etc, then it's a simple accessor
+        if segment_type is IndexSegment:
+            if segment.index is None:
+                raise TypeError(f"ERROR: Full jsonpath: {json_path} - current path - {_current_path(previous_parts, segment)} - qualifier - {segment.qualifier} - standalone qualifier expected to be a single index numeric ([0], [1], etc)")
+            if current_struct == {}:
+                current_struct = []
+                if parent_struct is None:
+                    root_struct = current_struct
+                else:
+                    parent_struct[parent_key] = current_struct
+            if not isinstance(current_struct, list):
+                raise TypeError(f"ERROR: Full jsonpath: {json_path} - current path - {_current_path(previous_parts, segment)} - Expected a list, but got {type(current_struct).__name__} instead.")
+            if segment.index + 1 > len(current_struct):
+                current_struct.extend({} for x in range (segment.index + 1 - len(current_struct)))
+            if position == last_position:
+                #Assign the indexed part
+                fhir_formatting.assign_value(current_struct, segment.index, value, dataType, formatter)
+                return root_struct
+            parent_struct, parent_key = current_struct, segment.index
+            current_struct = current_struct[segment.index]
+            continue
+        # The final key to access and pair; qualified final parts are assigned under their full text
+        if position == last_position:
+            fhir_formatting.assign_value(current_struct, segment.text, value, dataType, formatter)
+            return root_struct
+        if segment_type is KeySegment:
+            if segment.key not in current_struct:
+                current_struct[segment.key] = {}
+            parent_struct, parent_key = current_struct, segment.key
+            current_struct = current_struct[segment.key]
+            continue
+        key_part = segment.key
+        # Reject unusable qualifiers before touching the structure, so the resource is left as it was
+        if segment_type is not KeyIndexSegment:
+            #If there is a key_part and the qualifier condition is defined
+            if segment.qualifier_key is None:
+                logger.warning(f" Full jsonpath: {json_path} - current path - {_current_path(previous_parts, segment)} - qualifier - {segment.qualifier} - unsupported qualifier, expected a 'key=value' condition or an index. Skipping.")
+                return root_struct
+            #special handling for code
+            if key_part != "coding" and segment.qualifier_key in ('code', 'system') and 'coding' not in current_struct:
+                raise TypeError(f"ERROR: Full jsonpath: {json_path} - current path - {_current_path(previous_parts, segment)} - qualifier - {segment.qualifier} - a '{segment.qualifier_key}' qualifier is only supported on 'coding' or alongside an existing 'coding' list.")
+        # Create the key part in the structure
+        if (not key_part in current_struct) or (isinstance(current_struct[key_part], dict)):
+            current_struct[key_part] = []
+        if segment_type is KeyIndexSegment:
+            #An index on a key, aka 'given[0]', is a simple accessor into the list under that key
+            elements = current_struct[key_part]
+            if not isinstance(elements, list):
+                raise TypeError(f"ERROR: Full jsonpath: {json_path} - current path - {_current_path(previous_parts, segment)} - Expected a list, but got {type(elements).__name__} instead.")
+            if segment.index + 1 > len(elements):
+                elements.extend({} for x in range (segment.index + 1 - len(elements)))
+            parent_struct, parent_key = elements, segment.index
+            current_struct = elements[segment.index]
+            continue
+        qualifier_key, qualifier_value = segment.qualifier_key, segment.qualifier_value
+        # Retrieve an inner structure if it exists allready that matches the criteria
+        inner_struct = next((innerElement for innerElement in current_struct[key_part] if isinstance(innerElement, dict) and innerElement.get(qualifier_key) == qualifier_value), None)
+        #If no inner structure exists, create one instead
+        if inner_struct is None:
+            inner_struct = {qualifier_key: qualifier_value}
+            current_struct[key_part].append(inner_struct)
+        # The matched element stays in place; the walk continues inside it
+        parent_struct, parent_key = None, None
+        current_struct = inner_struct
+    return root_struct
+
+def _current_path(previous_parts: List[str], segment: PathSegment) -> str:
+    return '.'.join(list(previous_parts) + [segment.path])
 
 #Post-process function to add medication reference in specific references
-def post_process_create_medication_references(root_bundle: Dict[str, Any]) -> None:
-    medication_resources = [resource['resource'] for resource in root_bundle['entry'] if resource['resource']['resourceType'] == "Medication"]
-    medication_request_resources = [resource['resource'] for resource in root_bundle['entry'] if resource['resource']['resourceType'] == "MedicationRequest"]
+def post_process_create_medication_references(root_bundle: Dict[str, Any], id_generator: Optional['ResourceIdGenerator'] = None) -> None:
+    #Index the Medication resources by their code; the first Medication with a code is the one referenced
+    medications_by_code: Dict[Any, Dict[str, Any]] = {}
+    medication_request_resources: List[Dict[str, Any]] = []
+    for entry in root_bundle['entry']:
+        resource = entry['resource']
+        if resource['resourceType'] == "Medication" and 'code' in resource:
+            medications_by_code.setdefault(canonical_code_key(resource['code']), resource)
+        elif resource['resourceType'] == "MedicationRequest":
+            medication_request_resources.append(resource)
     for medication_request_resource in medication_request_resources:
-        #Get candidates
-        medication_candidates = [resource for resource in medication_resources if resource['code'] == medication_request_resource['medicationCodeableConcept']]
-        if not medication_candidates: #If no candidates, create, else get the first candidate
-            medication_target = target_medication = createMedicationResource(root_bundle, medication_request_resource['medicationCodeableConcept'])
-            medication_resources.append(target_medication)
-        else:
-            target_medication = medication_candidates[0]
-            
+        if 'medicationCodeableConcept' not in medication_request_resource:
+            continue
+        code_key = canonical_code_key(medication_request_resource['medicationCodeableConcept'])
+        target_medication = medications_by_code.get(code_key)
+        if target_medication is None: #If no Medication has the code yet, create one
+            target_medication = createMedicationResource(root_bundle, medication_request_resource['medicationCodeableConcept'], id_generator)
+            medications_by_code[code_key] = target_medication
         del(medication_request_resource['medicationCodeableConcept'])
         medication_request_resource['medicationReference'] = target_medication['resourceType'] + "/" + target_medication['id']
     return
 
-def createMedicationResource(root_bundle: Dict[str, Any], medicationCodeableConcept: Any) -> Dict[str, Any]:
+def createMedicationResource(root_bundle: Dict[str, Any], medicationCodeableConcept: Any, id_generator: Optional['ResourceIdGenerator'] = None) -> Dict[str, Any]:
     # ``ResourceDefinition.from_dict`` returns a ``ResourceDefinition``; we cast the result
     # of ``initialize_resource`` to the expected dict type for clarity.
     target_medication: Dict[str, Any] = initialize_resource(
-        ResourceDefinition.from_dict({"ResourceType": "Medication"})
+        ResourceDefinition.from_dict({"ResourceType": "Medication"}),
+        id_generator.generate_medication_id(medicationCodeableConcept) if id_generator is not None else None,
     )
     target_medication['code'] = medicationCodeableConcept
     add_resource_to_transaction_bundle(root_bundle, target_medication)
     return target_medication
 
+# Hashable key of a CodeableConcept, or any other JSON value, that is equal for two values exactly when the values are equal
+def canonical_code_key(value: Any) -> Any:
+    if isinstance(value, dict):
+        return frozenset((key, canonical_code_key(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(canonical_code_key(item) for item in value)
+    return value
+
 def generate_UUID() -> uuid.UUID:
     """Generate a random UUID (Version 4)."""
     return uuid.uuid4()
 
-def entries_exist(entityName: str, cohort_data: CohortData, index: int = 0) -> bool:
+# Root namespace of the uuid5 ids created when deterministic_ids is configured
+DETERMINISTIC_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "https://github.com/CDCgov/FHIRSheets")
+
+class ResourceIdGenerator:
+    """
+    Creates the bundle and resource ids for the bundle of the patient at index.
+    With config.deterministic_ids the ids are uuid5s derived from (random_seed, patient index, entity name), so a
+    workbook converted with the same seed gets the same ids whichever process, shard or run converts each patient.
+    Otherwise every id is a random uuid4.
+    With config.deterministic_ids or config.deduplicate_medications, the ids of the Medication resources created for
+    medications_as_reference are derived from (random_seed, medication code) instead, so a medication has one id
+    across the cohort.
+    """
+    def __init__(self, config: FhirSheetsConfiguration, index: int = 0):
+        self.cohort_namespace: Optional[uuid.UUID] = None
+        self.patient_namespace: Optional[uuid.UUID] = None
+        if config.deterministic_ids or config.deduplicate_medications:
+            self.cohort_namespace = uuid.uuid5(DETERMINISTIC_ID_NAMESPACE, str(config.random_seed))
+        if config.deterministic_ids:
+            self.patient_namespace = uuid.uuid5(self.cohort_namespace, str(index))
+
+    # Id for the bundle ('Bundle') or the resource of an entity name
+    def generate(self, name: str) -> str:
+        if self.patient_namespace is None:
+            return str(generate_UUID())
+        return str(uuid.uuid5(self.patient_namespace, name))
+
+    # Id for the Medication resource of a medicationCodeableConcept
+    def generate_medication_id(self, medicationCodeableConcept: Any) -> str:
+        if self.cohort_namespace is None:
+            return str(generate_UUID())
+        code_key = orjson.dumps(medicationCodeableConcept, option=orjson.OPT_SORT_KEYS).decode()
+        return str(uuid.uuid5(self.cohort_namespace, 'Medication/' + code_key))
+
+def get_patient_entry(cohort_data: CohortData, index: int = 0, patient_entry: Optional[PatientEntry] = None) -> PatientEntry:
+    """Return ``patient_entry`` when given, otherwise the patient at ``index`` of ``cohort_data``."""
+    if patient_entry is not None:
+        return patient_entry
+    return cohort_data.patients[index]
+
+def group_entries_by_entity(patient: PatientEntry) -> Dict[Any, List[Tuple[Any, Any]]]:
+    """Group the entries of ``patient`` into ``(field_name, value)`` lists keyed by entity name, in column order."""
+    entries_by_entity: Dict[Any, List[Tuple[Any, Any]]] = {}
+    for (entityName, field_name), value in patient.entries.items():
+        entries_by_entity.setdefault(entityName, []).append((field_name, value))
+    return entries_by_entity
+
+def entries_exist(entityName: str, cohort_data: CohortData, index: int = 0, patient_entry: Optional[PatientEntry] = None) -> bool:
     """Utility function to determine if any entries exist for ``entityName``
     in the patient at ``index``.
 
@@ -516,7 +673,7 @@ def entries_exist(entityName: str, cohort_data: CohortData, index: int = 0) -> b
     version returns ``True`` if at least one entry in ``patient.entries`` has a
     matching entity name, otherwise ``False``.
     """
-    patient = cohort_data.patients[index]
+    patient = get_patient_entry(cohort_data, index, patient_entry)
     # ``patient.entries`` is a dict keyed by a tuple (entityName, field_name)
     # We only care about the first element of the key.
     return any(entry_entityName == entityName for (entry_entityName, _), _ in patient.entries.items())
@@ -560,4 +717,38 @@ def clean_empty(data: Any) -> Any:
         return cleaned_list
     else:
         # Primitive values (including empty strings) are returned unchanged.
-        return data
\ No newline at end of file
+        return data
+
+def prune_empty_in_place(data: Any) -> Any:
+    """Remove the same *empty* structures as ``clean_empty``, but in place.
+
+    ``None``, empty strings, empty dicts and empty lists are deleted from dicts, and
+    ``None``, empty dicts and empty lists are deleted from lists, after their own
+    contents have been pruned. Nothing is copied, so peak memory stays at the size of
+    the structure itself. Returns ``data``, which is empty afterwards when everything
+    in it was.
+    """
+    _prune_empty(data)
+    return data
+
+# Prunes data in place and returns whether it is an empty dict or list afterwards
+def _prune_empty(data: Any) -> bool:
+    if isinstance(data, dict):
+        empty_keys = [
+            key for key, value in data.items()
+            if value is None
+            or (isinstance(value, (dict, list)) and _prune_empty(value))
+            or (isinstance(value, str) and value == "")
+        ]
+        for key in empty_keys:
+            del data[key]
+        return not data
+    if isinstance(data, list):
+        kept_items = [
+            item for item in data
+            if not (item is None or (isinstance(item, (dict, list)) and _prune_empty(item)))
+        ]
+        if len(kept_items) != len(data):
+            data[:] = kept_items
+        return not data
+    return False
@@ -1,27 +1,62 @@
-from . import fhir_formatting as fhir_formatting, special_values as special_values
+import uuid
+from . import fhir_formatting as fhir_formatting, metrics as metrics, special_values as special_values
 from .config.FhirSheetsConfiguration import FhirSheetsConfiguration as FhirSheetsConfiguration
-from .model.cohort_data_entity import CohortData as CohortData
+from .conversion_plan import ConversionPlan as ConversionPlan, EntityPlan as EntityPlan, PlannedField as PlannedField, ResourceLinkPlan as ResourceLinkPlan, compile_entity_plan as compile_entity_plan
+from .json_path import IndexSegment as IndexSegment, KeyIndexSegment as KeyIndexSegment, KeySegment as KeySegment, PathSegment as PathSegment, parse_json_path as parse_json_path
+from .model.cohort_data_entity import CohortData as CohortData, PatientEntry as PatientEntry
 from .model.resource_definition_entity import ResourceDefinition as ResourceDefinition
 from .model.resource_link_entity import ResourceLink as ResourceLink
 from _typeshed import Incomplete
 from jsonpath_ng.jsonpath import Fields as Fields, Slice as Slice, Where as Where
-from typing import Any
+from typing import Any, Callable, Iterable
 
-FILE_RANDOM: Incomplete
+logger: Incomplete
 
-def create_transaction_bundle(resource_definition_entities: list[ResourceDefinition], resource_link_entities: list[ResourceLink], cohort_data: CohortData, index: int = 0, config: FhirSheetsConfiguration = ...) -> dict: ...
-def create_resources(resource_definition_entities: list[ResourceDefinition], resource_link_entities: list[ResourceLink], cohort_data: CohortData, index: int = 0, config: FhirSheetsConfiguration = ...) -> dict: ...
-def create_singular_resource(singleton_entityName: str, resource_definition_entities: list[ResourceDefinition], resource_link_entities: list[ResourceLink], cohort_data: CohortData, index: int = 0) -> dict: ...
-def initialize_bundle(config: FhirSheetsConfiguration) -> dict: ...
-def initialize_resource(resource_definition: ResourceDefinition) -> dict: ...
-def create_fhir_resource(resource_definition: ResourceDefinition, cohort_data: CohortData, index: int = 0, config: FhirSheetsConfiguration = ...) -> dict: ...
-def add_default_resource_links(created_resources: dict, resource_link_entities: list[ResourceLink]) -> None: ...
-def create_resource_links(created_resources, resource_link_entites, preview_mode: bool = False) -> None: ...
-def create_resource_link(created_resources, resource_link_entity, preview_mode: bool = False) -> None: ...
-def add_resource_to_transaction_bundle(root_bundle, fhir_resource) -> dict: ...
-def create_structure_from_jsonpath(root_struct: dict, json_path: str, resource_definition: ResourceDefinition, dataType: str, value: Any) -> Any: ...
+def create_transaction_bundle(resource_definition_entities: list[ResourceDefinition], resource_link_entities: list[ResourceLink], cohort_data: CohortData, index: int = 0, config: FhirSheetsConfiguration = ..., patient_entry: PatientEntry | None = None, conversion_plan: ConversionPlan | None = None) -> dict[str, Any]: ...
+def create_resources(resource_definition_entities: list[ResourceDefinition], resource_link_entities: list[ResourceLink], cohort_data: CohortData, index: int = 0, config: FhirSheetsConfiguration = ..., patient_entry: PatientEntry | None = None, conversion_plan: ConversionPlan | None = None, id_generator: ResourceIdGenerator | None = None) -> dict[str, dict[str, Any]]: ...
+def create_singular_resource(singleton_entityName: str, resource_definition_entities: list[ResourceDefinition], resource_link_entities: list[ResourceLink], cohort_data: CohortData, index: int = 0) -> dict[str, Any]: ...
+def initialize_bundle(config: FhirSheetsConfiguration, bundle_id: str | None = None) -> dict[str, Any]: ...
+def initialize_resource(resource_definition: ResourceDefinition, resource_id: str | None = None) -> dict[str, Any]: ...
+def create_fhir_resource(resource_definition: ResourceDefinition, cohort_data: CohortData, index: int = 0, config: FhirSheetsConfiguration = ..., patient_entry: PatientEntry | None = None) -> dict[str, Any]: ...
+def build_fhir_resource(entity_plan: EntityPlan, entity_entries: list[tuple[Any, Any]], index: int = 0, resource_id: str | None = None) -> dict[str, Any]: ...
+def add_default_resource_links(created_resources: dict[str, dict[str, Any]], resource_link_entities: list[ResourceLink]) -> list[ResourceLink]: ...
+def create_resource_links(created_resources: dict[str, dict[str, Any]], resource_link_entites: list[ResourceLink], preview_mode: bool = False) -> None: ...
+def create_resource_link(created_resources: dict[str, dict[str, Any]], resource_link_entity: ResourceLink, preview_mode: bool = False) -> None: ...
+def add_resource_to_transaction_bundle(root_bundle: dict[str, Any], fhir_resource: dict[str, Any]) -> dict[str, Any]: ...
+def create_structure_from_jsonpath(root_struct: dict[str, Any], json_path: str, resource_definition: ResourceDefinition, dataType: str, value: Any) -> Any: ...
+def create_structure_from_planned_field(root_struct: dict[str, Any], planned_field: PlannedField, resource_definition: ResourceDefinition, value: Any, entry_indexes: EntryIndexes | None = None) -> Any: ...
 def build_structure(current_struct: Any, json_path: str, resource_definition: ResourceDefinition, dataType: str, parts: list[str], value: Any, previous_parts: list[str]) -> Any: ...
-def build_structure_recurse(current_struct, json_path, resource_definition, dataType, parts, value, previous_parts, part): ...
-def post_process_create_medication_references(root_bundle: dict): ...
-def createMedicationResource(root_bundle, medicationCodeableConcept): ...
-def generate_UUID(): ...
+
+class EntryIndex:
+    entries: list[Any]
+    entry_keys: Callable[[Any], Iterable[Any]]
+    positions: dict[Any, int]
+    indexed_count: int
+    def __init__(self, entries: list[Any], entry_keys: Callable[[Any], Iterable[Any]]) -> None: ...
+    def find(self, key) -> Any | None: ...
+    def insert(self, position: int, key, entry) -> None: ...
+EntryIndexes = dict[tuple[int, Callable[[Any], Iterable[Any]]], EntryIndex]
+
+def get_entry_index(entry_indexes: EntryIndexes, entries: list[Any], entry_keys: Callable[[Any], Iterable[Any]]) -> EntryIndex: ...
+def apply_structure_handler(handler: special_values.AbstractStructureHandler, current_struct: Any, json_path: str | None, resource_definition: ResourceDefinition, dataType: str | None, key: str, value: Any, entry_indexes: EntryIndexes | None = None) -> Any: ...
+def merge_fragment(current_struct: Any, fragment: special_values.StructureFragment, resource_definition: ResourceDefinition, dataType: str | None, entry_indexes: EntryIndexes) -> None: ...
+def build_structure_from_segments(current_struct: Any, json_path: str, resource_definition: ResourceDefinition, dataType: str, segments: tuple[PathSegment, ...], value: Any, previous_parts: list[str] = [], formatter: Callable[[Any, Any, Any], Any] | None = None) -> Any: ...
+def post_process_create_medication_references(root_bundle: dict[str, Any], id_generator: ResourceIdGenerator | None = None) -> None: ...
+def createMedicationResource(root_bundle: dict[str, Any], medicationCodeableConcept: Any, id_generator: ResourceIdGenerator | None = None) -> dict[str, Any]: ...
+def canonical_code_key(value: Any) -> Any: ...
+def generate_UUID() -> uuid.UUID: ...
+
+DETERMINISTIC_ID_NAMESPACE: Incomplete
+
+class ResourceIdGenerator:
+    cohort_namespace: uuid.UUID | None
+    patient_namespace: uuid.UUID | None
+    def __init__(self, config: FhirSheetsConfiguration, index: int = 0) -> None: ...
+    def generate(self, name: str) -> str: ...
+    def generate_medication_id(self, medicationCodeableConcept: Any) -> str: ...
+
+def get_patient_entry(cohort_data: CohortData, index: int = 0, patient_entry: PatientEntry | None = None) -> PatientEntry: ...
+def group_entries_by_entity(patient: PatientEntry) -> dict[Any, list[tuple[Any, Any]]]: ...
+def entries_exist(entityName: str, cohort_data: CohortData, index: int = 0, patient_entry: PatientEntry | None = None) -> bool: ...
+def clean_empty(data: Any) -> Any: ...
+def prune_empty_in_place(data: Any) -> Any: ...
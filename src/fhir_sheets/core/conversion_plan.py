@@ -0,0 +1,165 @@
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from .model.cohort_data_entity import HeaderEntry
+from .model.resource_definition_entity import ResourceDefinition
+from .model.resource_link_entity import ResourceLink
+from .json_path import PathSegment, parse_json_path
+from . import fhir_formatting, special_values
+
+
+class PlannedField:
+    """
+    A single PatientData column, resolved once per workbook so each patient only has to execute it.
+    """
+    def __init__(self, header: HeaderEntry):
+        self.fieldName: Optional[str] = header.fieldName
+        self.jsonPath: Optional[str] = header.jsonPath
+        self.valueType: Optional[str] = header.valueType
+        # Normalized value type used for dispatch; None when the header has no value type
+        self.normalizedValueType: Optional[str] = fhir_formatting.normalize_value_type(header.valueType)
+        # Formatter the value type resolves to; None when the value type is missing or unsupported
+        self.valueFormatter: Optional[fhir_formatting.ValueFormatter] = fhir_formatting.resolve_value_formatter(header.valueType)
+        # Parsed dot notation segments of the jsonPath
+        self.segments: Tuple[PathSegment, ...] = parse_json_path(header.jsonPath) if isinstance(header.jsonPath, str) else ()
+        # Special structure handler the jsonPath resolves to, if any
+        self.structureHandler: Optional[special_values.AbstractStructureHandler] = (
+            special_values.resolve_structure_handler(header.jsonPath) if isinstance(header.jsonPath, str) else None
+        )
+
+    def __repr__(self) -> str:
+        return (f"PlannedField(fieldName='{self.fieldName}', jsonPath='{self.jsonPath}', "
+                f"valueType='{self.valueType}', structureHandler={type(self.structureHandler).__name__ if self.structureHandler else None})")
+
+
+class EntityPlan:
+    """
+    The ordered fields to build for one resource definition.
+    """
+    def __init__(self, resource_definition: ResourceDefinition, fields: List[PlannedField]):
+        self.resource_definition: ResourceDefinition = resource_definition
+        self.fields: List[PlannedField] = fields
+        # When several headers share a field name the first one wins, matching the PatientData lookup order
+        self.fields_by_name: Dict[Any, PlannedField] = {}
+        for field in fields:
+            self.fields_by_name.setdefault(field.fieldName, field)
+
+    def __repr__(self) -> str:
+        return f"EntityPlan(entityName='{self.resource_definition.entityName}', fields={self.fields})"
+
+
+#Default references, in the form of (source resourceType, destination resourceType, referencePath), linked when a patient
+#has exactly one resource of the source and of the destination resourceType
+default_references = [
+    ('allergyintolerance', 'patient', 'patient'),
+    ('allergyintolerance', 'practitioner', 'asserter'),
+    ('careplan', 'goal', 'goal'),
+    ('careplan', 'patient', 'subject'),
+    ('careplan', 'practitioner', 'performer'),
+    ('diagnosticreport', 'careteam', 'performer'),
+    ('diagnosticreport', 'imagingStudy', 'imagingStudy'),
+    ('diagnosticreport', 'observation', 'result'),
+    ('diagnosticreport', 'organization', 'performer'),
+    ('diagnosticreport', 'practitioner', 'performer'),
+    ('diagnosticreport', 'practitionerrole', 'performer'),
+    ('diagnosticreport', 'specimen', 'specimen'),
+    ('encounter', 'condition', 'reasonReference'),
+    ('encounter', 'location', 'location'),
+    ('encounter', 'organization', 'serviceProvider'),
+    ('encounter', 'patient', 'subject'),
+    ('encounter', 'practitioner', 'participant'),
+    ('goal', 'condition', 'addresses'),
+    ('goal', 'patient', 'subject'),
+    ('immunization', 'patient', 'patient'),
+    ('immunization', 'practitioner', 'performer'),
+    ('immunization', 'organization', 'manufacturer'),
+    ('medicationrequest', 'medication', 'medicationReference'),
+    ('medicationrequest', 'patient', 'subject'),
+    ('medicationrequest', 'practitioner', 'requester'),
+    ('observation', 'device', 'device'),
+    ('observation', 'patient', 'subject'),
+    ('observation', 'practitioner', 'performer'),
+    ('observation', 'specimen', 'specimen'),
+    ('procedure', 'device', 'usedReference'),
+    ('procedure', 'location', 'location'),
+    ('procedure', 'patient', 'subject'),
+    ('procedure', 'practitioner', 'performer'),
+]
+
+class ResourceLinkPlan:
+    """
+    The resource links of a workbook: its explicit ResourceLinks, plus the default references that can apply between
+    the resourceTypes of its resource definitions. Only resolving which default references apply is left per patient;
+    the explicit links are never modified, so a plan can be shared between patients, threads and processes.
+    """
+    def __init__(self, resource_link_entities: List[ResourceLink], resource_definition_entities: Optional[List[ResourceDefinition]] = None):
+        self.resource_link_entities: List[ResourceLink] = list(resource_link_entities)
+        self.resource_link_keys: FrozenSet[Tuple[str, str, str]] = frozenset(
+            (link.originResource, link.referencePath, link.destinationResource) for link in self.resource_link_entities
+        )
+        # Without resource definitions any default reference may apply
+        self.candidate_default_references: Tuple[Tuple[str, str, str], ...] = tuple(default_references)
+        if resource_definition_entities is not None:
+            resource_types = {resource_definition.resourceType.strip().lower() for resource_definition in resource_definition_entities
+                              if isinstance(resource_definition.resourceType, str)}
+            self.candidate_default_references = tuple(
+                default_reference for default_reference in default_references
+                if default_reference[0] in resource_types and default_reference[1] in resource_types
+            )
+
+    def resolve_links(self, created_resources: Dict[str, Dict[str, Any]]) -> List[ResourceLink]:
+        """The explicit links followed by the default links that apply to the resources created for one patient."""
+        if not self.candidate_default_references:
+            return self.resource_link_entities
+        # Entity name of the only created resource of each resourceType; None when there are several
+        singleton_entity_names: Dict[str, Optional[str]] = {}
+        for entityName, resource in created_resources.items():
+            resourceType = resource['resourceType'].lower().strip()
+            singleton_entity_names[resourceType] = entityName if resourceType not in singleton_entity_names else None
+        resource_links = list(self.resource_link_entities)
+        link_keys = set(self.resource_link_keys)
+        for sourceType, destinationType, fieldName in self.candidate_default_references:
+            originResourceEntityName = singleton_entity_names.get(sourceType)
+            destinationResourceEntityName = singleton_entity_names.get(destinationType)
+            if originResourceEntityName is None or destinationResourceEntityName is None:
+                continue
+            link_key = (originResourceEntityName, fieldName, destinationResourceEntityName)
+            if link_key not in link_keys:
+                link_keys.add(link_key)
+                resource_links.append(ResourceLink(originResourceEntityName, fieldName, destinationResourceEntityName))
+        return resource_links
+
+    def __repr__(self) -> str:
+        return (f"ResourceLinkPlan(resource_link_entities={self.resource_link_entities}, "
+                f"candidate_default_references={self.candidate_default_references})")
+
+
+class ConversionPlan:
+    """
+    Everything about a workbook that does not change from one patient to the next: for each resource definition,
+    the fields to build with their parsed jsonPaths, normalized value types and resolved special handlers, and,
+    when compiled with the workbook's resource links, its ResourceLinkPlan.
+    Compile it once per workbook and pass it to conversion.create_transaction_bundle for every patient.
+    """
+    def __init__(self, entity_plans: List[EntityPlan], link_plan: Optional[ResourceLinkPlan] = None):
+        # In ResourceDefinitions order
+        self.entity_plans: List[EntityPlan] = entity_plans
+        # None when compiled without resource links; conversion then plans the links it is given per call
+        self.link_plan: Optional[ResourceLinkPlan] = link_plan
+
+    @classmethod
+    def compile(cls, resource_definition_entities: List[ResourceDefinition], headers: List[HeaderEntry],
+                resource_link_entities: Optional[List[ResourceLink]] = None):
+        headers_by_entity: Dict[Any, List[HeaderEntry]] = {}
+        for header in headers:
+            headers_by_entity.setdefault(header.entityName, []).append(header)
+        link_plan = ResourceLinkPlan(resource_link_entities, resource_definition_entities) if resource_link_entities is not None else None
+        return cls([compile_entity_plan(resource_definition, headers_by_entity.get(resource_definition.entityName, []))
+                    for resource_definition in resource_definition_entities], link_plan)
+
+    def __repr__(self) -> str:
+        return f"ConversionPlan(entity_plans={self.entity_plans}, link_plan={self.link_plan})"
+
+
+def compile_entity_plan(resource_definition: ResourceDefinition, headers: List[HeaderEntry]) -> EntityPlan:
+    """Compile the plan for one resource definition from the headers of its entity."""
+    return EntityPlan(resource_definition, [PlannedField(header) for header in headers if header.entityName == resource_definition.entityName])
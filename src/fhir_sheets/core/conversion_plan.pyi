@@ -0,0 +1,41 @@
+from . import fhir_formatting as fhir_formatting, special_values as special_values
+from .json_path import PathSegment as PathSegment, parse_json_path as parse_json_path
+from .model.cohort_data_entity import HeaderEntry as HeaderEntry
+from .model.resource_definition_entity import ResourceDefinition as ResourceDefinition
+from .model.resource_link_entity import ResourceLink as ResourceLink
+from _typeshed import Incomplete
+from typing import Any
+
+class PlannedField:
+    fieldName: str | None
+    jsonPath: str | None
+    valueType: str | None
+    normalizedValueType: str | None
+    valueFormatter: fhir_formatting.ValueFormatter | None
+    segments: tuple[PathSegment, ...]
+    structureHandler: special_values.AbstractStructureHandler | None
+    def __init__(self, header: HeaderEntry) -> None: ...
+
+class EntityPlan:
+    resource_definition: ResourceDefinition
+    fields: list[PlannedField]
+    fields_by_name: dict[Any, PlannedField]
+    def __init__(self, resource_definition: ResourceDefinition, fields: list[PlannedField]) -> None: ...
+
+default_references: Incomplete
+
+class ResourceLinkPlan:
+    resource_link_entities: list[ResourceLink]
+    resource_link_keys: frozenset[tuple[str, str, str]]
+    candidate_default_references: tuple[tuple[str, str, str], ...]
+    def __init__(self, resource_link_entities: list[ResourceLink], resource_definition_entities: list[ResourceDefinition] | None = None) -> None: ...
+    def resolve_links(self, created_resources: dict[str, dict[str, Any]]) -> list[ResourceLink]: ...
+
+class ConversionPlan:
+    entity_plans: list[EntityPlan]
+    link_plan: ResourceLinkPlan | None
+    def __init__(self, entity_plans: list[EntityPlan], link_plan: ResourceLinkPlan | None = None) -> None: ...
+    @classmethod
+    def compile(cls, resource_definition_entities: list[ResourceDefinition], headers: list[HeaderEntry], resource_link_entities: list[ResourceLink] | None = None): ...
+
+def compile_entity_plan(resource_definition: ResourceDefinition, headers: list[HeaderEntry]) -> EntityPlan: ...
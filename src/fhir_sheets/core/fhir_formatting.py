@@ -1,15 +1,17 @@
 import re
 import datetime
 import logging
+from functools import lru_cache
+from . import metrics
 from . import special_values
-from typing import Any
+from typing import Any, Callable, Dict, Optional
 
 logger: logging.Logger = logging.getLogger("fhirsheets.core.fhir_formatting")
 
-#Dictionary of regexes
+#Dictionary of regexes for FHIR primitive values
 type_regexes = {
     'code': r'[^\s]+( [^\s]+)*',
-    'decimal': r'-?(0|[1-9][0-9]{0,17})(\.[0-9]{1,17})?([eE][+-]?[0-9]{1,9}})?',
+    'decimal': r'-?(0|[1-9][0-9]{0,17})(\.[0-9]{1,17})?([eE][+-]?[0-9]{1,9})?',
     'id': r'[A-Za-z0-9\-\.]{1,64}',
     'integer': r'[0]|[-+]?[1-9][0-9]*',
     'oid': r'urn:oid:[0-2](\.(0|[1-9][0-9]*))+',
@@ -17,15 +19,191 @@ type_regexes = {
     'unsignedInt': r'[0]|([1-9][0-9]*)',
     'uuid': r'urn:uuid:[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
 }
+#Compiled once at import; validate_primitive only accepts values matching the whole pattern
+type_patterns: Dict[str, re.Pattern] = {valueType: re.compile(regex) for valueType, regex in type_regexes.items()}
+
+#Compiled patterns the parsers below use to find a value within the input string
+parser_patterns: Dict[str, re.Pattern] = {
+    'date': re.compile(r'(\d{4}-\d{2}-\d{2})'),
+    'datetime': re.compile(r'(\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}:\d{2}(Z)?)?)'),
+    'instant': re.compile(r"(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d{1,6})?(?:Z)?)"),
+    'time': re.compile(r'((?:[01][0-9]|2[0-3]):[0-5][0-9]:([0-5][0-9]|60)(\.[0-9]{1,9})?)'),
+    # Postal code, state (typically a two-letter code) and an optional trailing country, each '^' delimited
+    'address': re.compile(r'^(?P<line>.*?)\^(?P<city>.*?)\^(?P<district>.*?)\^(?P<postalCode>.*)\^(?P<state>[A-Za-z]{2}|)\^(?:\s*(?P<country>[\w\s]+|))?$'),
+}
+
+# Return the text of value if it is a valid instance of the FHIR primitive valueType (a key of type_patterns); raise ValueError otherwise.
+def validate_primitive(valueType: str, value: Any) -> str:
+    # Spreadsheet cells hold numbers as int or float; whole numbers are validated as their integer text
+    if isinstance(value, float) and value.is_integer() and valueType != 'decimal':
+        value = int(value)
+    text = value if isinstance(value, str) else str(value)
+    if type_patterns[valueType].fullmatch(text) is None:
+        raise ValueError(f"Value '{value}' is not a valid FHIR {valueType}")
+    return text
+
+# Value formatters take (final_struct, key, value), assign the formatted value to final_struct[key] and return final_struct.
+# They are registered in value_formatters below by normalized (stripped, lowercased) valueType.
+ValueFormatter = Callable[[Any, Any, Any], Any]
+
+def format_address(final_struct, key, value):
+    address_value = parse_flexible_address(value)
+    if address_value:
+        final_struct[key] = address_value
+    return final_struct
+
+def format_as_is(final_struct, key, value):
+    final_struct[key] = value
+    return final_struct
+
+def format_boolean(final_struct, key, value):
+    # Use a robust parser to handle various boolean representations
+    final_struct[key] = parse_boolean(value)
+    return final_struct
+
+def format_codeableconcept(final_struct, key, value):
+    final_struct[key] = caret_delimited_string_to_codeableconcept(value)
+    return final_struct
+
+def format_code(final_struct, key, value):
+    final_struct[key] = validate_primitive('code', value)
+    return final_struct
+
+def format_decimal(final_struct, key, value):
+    # Columns typed 'decimal' that hold text (such as Observation.status in the sample templates) have always been
+    # passed through, so a value that is not a valid decimal is logged and kept as is rather than dropped
+    if isinstance(value, str):
+        try:
+            validate_primitive('decimal', value)
+        except ValueError as e:
+            logger.warning(f"Rending Value - {key} - {e}, keeping it as is")
+    final_struct[key] = value
+    return final_struct
+
+def format_coding(final_struct, key, value):
+    final_struct[key] = caret_delimited_string_to_coding(value)
+    return final_struct
+
+def format_date(final_struct, key, value):
+    if isinstance(value, datetime.date):
+        final_struct[key] = value
+    elif isinstance(value, datetime.datetime):
+        final_struct[key] = value.date()
+    elif isinstance(value, str):
+        final_struct[key] = parse_iso8601_date(value)
+    return final_struct
+
+def format_datetime(final_struct, key, value):
+    if isinstance(value, datetime.datetime):
+        final_struct[key] = value.replace(tzinfo=datetime.timezone.utc)
+    else:
+        final_struct[key] = parse_iso8601_datetime(value).replace(tzinfo=datetime.timezone.utc)
+    return final_struct
+
+def format_humanname(final_struct, key, value):
+    final_struct[key] = parse_human_name(value)
+    return final_struct
+
+def format_id(final_struct, key, value):
+    final_struct[key] = validate_primitive('id', value)
+    return final_struct
+
+def format_instant(final_struct, key, value):
+    if isinstance(value, datetime.datetime):
+        final_struct[key] = value.replace(tzinfo=datetime.timezone.utc)
+    else:
+        final_struct[key] = parse_iso8601_instant(value).replace(tzinfo=datetime.timezone.utc)
+    return final_struct
+
+def format_integer(final_struct, key, value):
+    final_struct[key] = int(validate_primitive('integer', value))
+    return final_struct
+
+def format_oid(final_struct, key, value):
+    final_struct[key] = validate_primitive('oid', value)
+    return final_struct
+
+def format_positiveint(final_struct, key, value):
+    final_struct[key] = int(validate_primitive('positiveInt', value))
+    return final_struct
+
+def format_quantity(final_struct, key, value):
+    final_struct[key] = string_to_quantity(value)
+    return final_struct
+
+def format_string_list(final_struct, key, value):
+    if not key in final_struct:
+        final_struct[key] = [value]
+    else:
+        final_struct[key].append(value)
+    return final_struct
+
+def format_time(final_struct, key, value):
+    if isinstance(value, datetime.time):
+        final_struct[key] = value
+    else:
+        final_struct[key] = parse_iso8601_time(value)
+    return final_struct
+
+def format_unsignedint(final_struct, key, value):
+    final_struct[key] = int(validate_primitive('unsignedInt', value))
+    return final_struct
+
+def format_uuid(final_struct, key, value):
+    final_struct[key] = validate_primitive('uuid', value)
+    return final_struct
+
+#Dictionary of value formatters by normalized valueType
+value_formatters: Dict[str, ValueFormatter] = {
+    'address': format_address,
+    'base64binary': format_as_is,
+    'boolean': format_boolean,
+    'codeableconcept': format_codeableconcept,
+    'code': format_code,
+    'coding': format_coding,
+    'date': format_date,
+    'datetime': format_datetime,
+    'decimal': format_decimal,
+    'humanname': format_humanname,
+    'id': format_id,
+    'instant': format_instant,
+    'integer': format_integer,
+    'oid': format_oid,
+    'positiveint': format_positiveint,
+    'quantity': format_quantity,
+    'string': format_as_is,
+    'string[]': format_string_list,
+    'time': format_time,
+    'unsignedint': format_unsignedint,
+    'uri': format_as_is,
+    'url': format_as_is,
+    'uuid': format_uuid,
+}
+
+def normalize_value_type(valueType: Any) -> Optional[str]:
+    return valueType.strip().lower() if isinstance(valueType, str) else None
+
+# Register a formatter for a valueType, replacing any existing formatter for it.
+# Conversion plans resolve their formatters when compiled, so register formatters before compiling one.
+def register_value_formatter(valueType: str, formatter: ValueFormatter) -> None:
+    value_formatters[normalize_value_type(valueType)] = formatter
+
+# Find the formatter for a valueType; None when the valueType is missing or unsupported
+def resolve_value_formatter(valueType: Any) -> Optional[ValueFormatter]:
+    return value_formatters.get(normalize_value_type(valueType))
+
 # Assign final_struct[key] to value; with formatting given the valueType
-def assign_value(final_struct, key, value, valueType):
-    for value_handler in special_values.custom_value_handlers:
-        if value in value_handler['value_criteria']:
-            handler = value_handler['handler']
-            handler.assign_value(final_struct, key, value, valueType)
-            return final_struct
-    # Removing white space
+# formatter may be passed when the caller has already resolved it for the valueType.
+def assign_value(final_struct, key, value, valueType, formatter: Optional[ValueFormatter] = None):
+    if metrics.active_metrics is not None:
+        metrics.count(f"assign_value.{normalize_value_type(valueType)}")
     if isinstance(value, str):
+        for value_handler in special_values.custom_value_handlers:
+            if value in value_handler['value_criteria']:
+                handler = value_handler['handler']
+                handler.assign_value(final_struct, key, value, valueType)
+                return final_struct
+        # Removing white space
         value = value.strip()
     # Checking for null or empty *string* values. We intentionally allow falsy
     # non‑string values such as ``False`` or ``0`` because they may be valid
@@ -38,87 +216,13 @@ def assign_value(final_struct, key, value, valueType):
     # If the valueType is not provide, do not construct the value.
     if valueType is None:
         return final_struct
-    # Switch case for valueType to construct a value
+    if formatter is None:
+        formatter = resolve_value_formatter(valueType)
+    if formatter is None:
+        logger.error(f"Rending Value - {key} - {value} - {valueType} - Saw a valueType of '{valueType}' unsupported in current formatting")
+        return final_struct
     try:
-        if valueType.lower() == 'address':
-            address_value = parse_flexible_address(value)
-            if address_value:
-                final_struct[key] = address_value
-        elif valueType.lower() == 'base64binary':
-            final_struct[key] = value
-        elif valueType.lower() == 'boolean':
-            # Use a robust parser to handle various boolean representations
-            final_struct[key] = parse_boolean(value)
-        elif valueType.lower() == 'codeableconcept':
-            final_struct[key] = caret_delimited_string_to_codeableconcept(value)
-        elif valueType.lower() == 'code':
-            match = re.search(type_regexes['code'], value)
-            final_struct[key] = match.group(0) if match else ''
-        elif valueType.lower() == 'coding':
-            final_struct[key] = caret_delimited_string_to_coding(value)
-        elif valueType.lower() == 'date':
-            if isinstance(value, datetime.date):
-                final_struct[key] = value
-            elif isinstance(value, datetime.datetime):
-                final_struct[key] = value.date()
-            elif isinstance(value, str):
-                final_struct[key] = parse_iso8601_date(value)
-        elif valueType.lower() == 'datetime':
-            if isinstance(value, datetime.datetime):
-                final_struct[key] = value.replace(tzinfo=datetime.timezone.utc)
-            else:
-                final_struct[key] = parse_iso8601_datetime(value).replace(tzinfo=datetime.timezone.utc)
-        elif valueType.lower() == 'decimal':
-            final_struct[key] = value
-        elif valueType.lower() == 'humanname':
-            final_struct[key] = parse_human_name(value)
-        elif valueType.lower() == 'id':
-            match = re.search(value, type_regexes['id'])
-            final_struct[key] = match.group(0) if match else ''
-        elif valueType.lower() == 'instant':
-            if isinstance(value, datetime.datetime):
-                final_struct[key] = value.replace(tzinfo=datetime.timezone.utc)
-            else:
-                final_struct[key] = final_struct[key] = parse_iso8601_instant(value).replace(tzinfo=datetime.timezone.utc)
-        elif valueType.lower() == 'integer':
-            match = re.search(value, type_regexes['integer'])
-            final_struct[key] = int(match.group(0)) if match else 0
-        elif valueType.lower() == 'oid':
-            match = re.search(value, type_regexes['oid'])
-            final_struct[key] = match.group(0) if match else ''
-        elif valueType.lower() == 'positiveInt':
-            match = re.search(value, type_regexes['positiveInt'])
-            final_struct[key] = int(match.group(0)) if match else 0
-        elif valueType.lower() == 'quantity':
-            final_struct[key] = string_to_quantity(value)
-        elif valueType.lower() == 'string':
-            final_struct[key] = value
-        elif valueType.lower() == 'string[]':
-            if not key in final_struct:
-                final_struct[key] = [value]
-            else:
-                final_struct[key].append(value)
-        elif valueType.lower() == 'time':
-            if isinstance(value, datetime.time):
-                final_struct[key] = value
-            else:
-                final_struct[key] = parse_iso8601_time(value)
-        elif valueType.lower() == 'unsignedInt':
-            match = re.search(value, type_regexes['unsignedInt'])
-            final_struct[key] = int(match.group(0)) if match else 0
-        elif valueType.lower() == 'uri':
-            final_struct[key] = value
-        elif valueType.lower() == 'url':
-            final_struct[key] = value
-        elif valueType.lower() == 'uuid':
-            match = re.search(value, type_regexes['uuid'])
-            final_struct[key] = match.group(0) if match else ''
-        elif valueType.lower() == 'coding':
-            if not isinstance(final_struct, list):
-                final_struct = []
-            final_struct.append(value)
-        else:
-            logger.error(f"Rending Value - {key} - {value} - {valueType} - Saw a valueType of '{valueType}' unsupported in current formatting")
+        formatter(final_struct, key, value)
     except ValueError as e:
         logger.error(e)
     return final_struct
@@ -150,30 +254,70 @@ def parse_boolean(value: Any) -> bool:
     # Fallback to Python truthiness for any other type
     return bool(value)
         
+#Bound on the number of distinct input strings memoized by parse_iso8601_date and parse_iso8601_datetime each.
+#Cohorts repeat the same dates heavily (birth dates, encounter and observation days), so most lookups hit.
+DATE_PARSE_CACHE_SIZE = 4096
+
+_ASCII_DIGITS = frozenset('0123456789')
+# Positions of the digits in 'YYYY-MM-DD' and 'YYYY-MM-DDTHH:MM:SS'
+_ISO_DIGIT_POSITIONS = {
+    10: (0, 1, 2, 3, 5, 6, 8, 9),
+    19: (0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18),
+}
+
+def _fromisoformat_fast_path(input_string):
+    """Parse exactly 'YYYY-MM-DD', 'YYYY-MM-DDTHH:MM:SS' or 'YYYY-MM-DDTHH:MM:SSZ' into a naive datetime.
+
+    Returns None for any other string, leaving it to the regex based parsing.
+    """
+    length = len(input_string)
+    if length not in (10, 19, 20) or input_string[4] != '-' or input_string[7] != '-':
+        return None
+    if length > 10 and (input_string[10] != 'T' or input_string[13] != ':' or input_string[16] != ':'
+                        or (length == 20 and input_string[19] != 'Z')):
+        return None
+    # Every other position must be an ASCII digit; anything else, such as a '+01' offset, takes the regex path
+    if not all(input_string[position] in _ASCII_DIGITS for position in _ISO_DIGIT_POSITIONS[min(length, 19)]):
+        return None
+    try:
+        return datetime.datetime.fromisoformat(input_string[:19])
+    except ValueError:
+        return None
+
+@lru_cache(maxsize=DATE_PARSE_CACHE_SIZE)
 def parse_iso8601_date(input_string):
-    # Regular expression to match ISO 8601 format with optional timezone 'Z'
-    pattern = r'(\d{4}-\d{2}-\d{2})'
-    match = re.search(pattern, input_string)
+    if len(input_string) == 10:
+        parsed = _fromisoformat_fast_path(input_string)
+        if parsed is not None:
+            return parsed.date()
+    # Find an ISO 8601 date within the input string
+    match = parser_patterns['date'].search(input_string)
     # Check if the input string matches the pattern
     if match:
         return datetime.datetime.strptime(match.group(1), '%Y-%m-%d').date()
     else:
         raise ValueError(f"Input string '{input_string}' is not in the valid ISO 8601 date format")
 
+@lru_cache(maxsize=DATE_PARSE_CACHE_SIZE)
 def parse_iso8601_datetime(input_string):
-    # Regular expression to match ISO 8601 format with optional timezone 'Z'
-    pattern = r'(\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}:\d{2}(Z)?)?)'
-    match = re.search(pattern, input_string)
+    parsed = _fromisoformat_fast_path(input_string)
+    if parsed is not None:
+        # Same results as below: a date alone is naive midnight, a date and time is UTC
+        return parsed if len(input_string) == 10 else parsed.replace(tzinfo=datetime.timezone.utc)
+    # Find an ISO 8601 date or datetime, with optional timezone 'Z', within the input string
+    match = parser_patterns['datetime'].search(input_string)
     # Check if the input string matches the pattern
     if match:
+        # The timezone 'Z' is not part of the strptime format; the parsed datetime is set to UTC instead
+        matched_string = match.group(1).removesuffix('Z')
         # Convert to datetime object
         if input_string.endswith('Z'):
             # If it has 'Z', convert to UTC
             try:
-                return datetime.datetime.strptime(match.group(1), '%Y-%m-%dT%H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+                return datetime.datetime.strptime(matched_string, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=datetime.timezone.utc)
             except ValueError: # If it fails (because the time part is missing), parse the date-only format and set time to midnight
                 try:
-                    parsed_date = datetime.datetime.strptime(match.group(1), '%Y-%m-%d')
+                    parsed_date = datetime.datetime.strptime(matched_string, '%Y-%m-%d')
                     parsed_datetime = parsed_date.replace(hour=0, minute=0, second=0)
                     return parsed_datetime
                 except ValueError: # Neither format worked so catch an entire error
@@ -181,16 +325,31 @@ def parse_iso8601_datetime(input_string):
         else:
             # Otherwise, just convert without timezone
             try:
-                return datetime.datetime.strptime(match.group(1), '%Y-%m-%dT%H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+                return datetime.datetime.strptime(matched_string, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=datetime.timezone.utc)
             except ValueError: # If it fails (because the time part is missing), parse the date-only format and set time to midnight
                 try:
-                    parsed_date = datetime.datetime.strptime(match.group(1), '%Y-%m-%d')
+                    parsed_date = datetime.datetime.strptime(matched_string, '%Y-%m-%d')
                     parsed_datetime = parsed_date.replace(hour=0, minute=0, second=0)
                     return parsed_datetime
                 except ValueError: # Neither format worked so catch an entire error
                     raise ValueError(f"Input string '{input_string}' is not in the valid ISO 8601 format date or datetime format")
     else:
         raise ValueError(f"Input string '{input_string}' is not in the valid ISO 8601 format date or datetime format")
+
+# Hits, misses and hit rate of the memoized parsers, by parser name
+def parse_cache_stats() -> Dict[str, Dict[str, Any]]:
+    stats = {}
+    for parser in (parse_iso8601_date, parse_iso8601_datetime, _parse_codeableconcept, _parse_coding):
+        info = parser.cache_info()
+        lookups = info.hits + info.misses
+        stats[parser.__name__] = {
+            'hits': info.hits,
+            'misses': info.misses,
+            'size': info.currsize,
+            'maxsize': info.maxsize,
+            'hit_rate': info.hits / lookups if lookups else 0.0,
+        }
+    return stats
     
 def parse_iso8601_instant(input_string):
     """Parse an ISO‑8601 *instant* string.
@@ -200,15 +359,14 @@ def parse_iso8601_instant(input_string):
     includes a case where a plain date (``2025-10-21``) should be interpreted as
     an instant at midnight.  This function now supports both full instant strings
     and simple date strings.  It also continues to accept any leading characters
-    (prefixes) because we use ``re.search`` rather than ``re.match``.
+    (prefixes) because the patterns are searched for rather than matched.
 
     The function returns a ``datetime.datetime`` object.  If the input ends with a
     ``Z`` the resulting datetime is timezone‑aware (UTC).  Otherwise it is naive.
     """
 
     # Try to match a full datetime instant first (with optional fractional seconds and optional Z)
-    instant_pattern = r"(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d{1,6})?(?:Z)?)"
-    match = re.search(instant_pattern, input_string)
+    match = parser_patterns['instant'].search(input_string)
     if match:
         iso_str = match.group(1)
         # Determine if timezone UTC is indicated
@@ -224,8 +382,7 @@ def parse_iso8601_instant(input_string):
         return dt
 
     # If not a full instant, fall back to a plain date (YYYY‑MM‑DD)
-    date_pattern = r"(\d{4}-\d{2}-\d{2})"
-    match = re.search(date_pattern, input_string)
+    match = parser_patterns['date'].search(input_string)
     if match:
         # Parse the date and set time components to zero
         dt = datetime.datetime.strptime(match.group(1), "%Y-%m-%d")
@@ -235,9 +392,8 @@ def parse_iso8601_instant(input_string):
     raise ValueError(f"Input string '{input_string}' is not in a recognized ISO 8601 instant or date format")
     
 def parse_iso8601_time(input_string):
-    # Regular expression to match the time format HH:MM:SS or HH:MM:SS.ssssss
-    pattern = r'((?:[01][0-9]|2[0-3]):[0-5][0-9]:([0-5][0-9]|60)(\.[0-9]{1,9})?)'
-    match = re.search(pattern, input_string)
+    # Find a time in the format HH:MM:SS or HH:MM:SS.ssssss within the input string
+    match = parser_patterns['time'].search(input_string)
     # Check if the input string matches the pattern
     if match:
         # Parse the time
@@ -251,19 +407,7 @@ def parse_iso8601_time(input_string):
         raise ValueError(f"Input string '{input_string}' is not in the valid time format")
     
 def parse_flexible_address(address):
-    # Attempt to capture postal code, which is often at the end and typically numeric (though it may vary internationally)
-    postal_code_pattern = r'(?P<postalCode>.*)'
-    
-    # State is typically a two-letter code (though this may vary internationally as well)
-    state_pattern = r'(?P<state>[A-Za-z]{2}|)'
-    
-    # This captures a country after a comma (or space-separated) if it's present
-    country_pattern = r'(?:\s*(?P<country>[\w\s]+|))?$'
-    
-    # Compile the full pattern to match the postal code, state, and country
-    full_pattern = rf'^(?P<line>.*?)\^(?P<city>.*?)\^(?P<district>.*?)\^{postal_code_pattern}\^{state_pattern}\^{country_pattern}'
-    
-    match = re.search(full_pattern, address)
+    match = parser_patterns['address'].search(address)
     
     if match:
         # Extract the components found in the regex
@@ -277,51 +421,51 @@ def parse_flexible_address(address):
     else:
         return None  # Return None if the format doesn't match
     
-def caret_delimited_string_to_codeableconcept(caret_delimited_str):
+#Bound on the number of distinct caret delimited strings memoized by the Coding and CodeableConcept parsers.
+#The parsed structure is cached as tuples and fresh dicts are built from it on every call, because the output path
+#may still add to or modify the returned dicts (e.g. CodeableConcept.text from another column).
+CODING_PARSE_CACHE_SIZE = 4096
+
+# Split one 'system^code^display' string into the (key, value) pairs of a Coding
+def _coding_items(coding_str):
+    # Split each part by '^' to get system, code, and display (optionally text at the end)
+    parts = coding_str.split('^')
+    # Create the coding pairs from the components
+    items = []
+    if len(parts) > 0:
+        items.append(('system', parts[0] if parts[0] else ''))
+    if len(parts) > 1:
+        items.append(('code', parts[1] if parts[1] else ''))
+    if len(parts) > 2:
+        items.append(('display', parts[2] if parts[2] else ''))
+    return tuple(items), parts
+
+@lru_cache(maxsize=CODING_PARSE_CACHE_SIZE)
+def _parse_codeableconcept(caret_delimited_str):
     # Split the string by '~' to separate multiple codings
-    codings = caret_delimited_str.split('~')
-    
-    # Initialize the CodeableConcept dictionary
-    codeable_concept = {"coding": []}
+    codings = []
     parts = []
-    # Loop over each coding section
-    for coding_str in codings:
-        # Split each part by '^' to get system, code, and display (optionally text at the end)
-        parts = coding_str.split('^')
-        
-        # Create a coding dictionary from the components
-        coding_dict = {}
-        if len(parts) > 0:
-            coding_dict['system'] = parts[0] if parts[0] else ''
-        if len(parts) > 1:
-            coding_dict['code'] = parts[1] if parts[1] else ''
-        if len(parts) > 2:
-            coding_dict['display'] = parts[2] if parts[2] else ''
-        
-        # Add coding to the 'coding' list in CodeableConcept
-        codeable_concept['coding'].append(coding_dict)
-    
+    for coding_str in caret_delimited_str.split('~'):
+        coding_items, parts = _coding_items(coding_str)
+        codings.append(coding_items)
     # Check if the last element contains 'text' (for the entire CodeableConcept)
-    if len(parts) == 4:
-        codeable_concept['text'] = parts[3]
+    text = parts[3] if len(parts) == 4 else None
+    return tuple(codings), text
+
+@lru_cache(maxsize=CODING_PARSE_CACHE_SIZE)
+def _parse_coding(caret_delimited_str):
+    return _coding_items(caret_delimited_str)[0]
+
+def caret_delimited_string_to_codeableconcept(caret_delimited_str):
+    codings, text = _parse_codeableconcept(caret_delimited_str)
+    # Initialize the CodeableConcept dictionary
+    codeable_concept = {"coding": [dict(coding_items) for coding_items in codings]}
+    if text is not None:
+        codeable_concept['text'] = text
     return codeable_concept
 
 def caret_delimited_string_to_coding(caret_delimited_str):
-    # Split the string by '~' to separate multiple codings
-    
-    # Initialize the CodeableConcept dictionary
-    coding = {}
-    
-    parts = caret_delimited_str.split('^')
-    
-    # Create a coding dictionary from the components
-    if len(parts) > 0:
-        coding['system'] = parts[0] if parts[0] else ''
-    if len(parts) > 1:
-        coding['code'] = parts[1] if parts[1] else ''
-    if len(parts) > 2:
-        coding['display'] = parts[2] if parts[2] else ''
-    return coding
+    return dict(_parse_coding(caret_delimited_str))
 
 def string_to_quantity(quantity_str):
     # Define potential comparators
@@ -1,14 +1,57 @@
-from . import special_values as special_values
+import logging
+import re
+from . import metrics as metrics, special_values as special_values
 from _typeshed import Incomplete
+from typing import Any, Callable
 
+logger: logging.Logger
 type_regexes: Incomplete
+type_patterns: dict[str, re.Pattern]
+parser_patterns: dict[str, re.Pattern]
+
+def validate_primitive(valueType: str, value: Any) -> str: ...
+ValueFormatter = Callable[[Any, Any, Any], Any]
+
+def format_address(final_struct, key, value): ...
+def format_as_is(final_struct, key, value): ...
+def format_boolean(final_struct, key, value): ...
+def format_codeableconcept(final_struct, key, value): ...
+def format_code(final_struct, key, value): ...
+def format_decimal(final_struct, key, value): ...
+def format_coding(final_struct, key, value): ...
+def format_date(final_struct, key, value): ...
+def format_datetime(final_struct, key, value): ...
+def format_humanname(final_struct, key, value): ...
+def format_id(final_struct, key, value): ...
+def format_instant(final_struct, key, value): ...
+def format_integer(final_struct, key, value): ...
+def format_oid(final_struct, key, value): ...
+def format_positiveint(final_struct, key, value): ...
+def format_quantity(final_struct, key, value): ...
+def format_string_list(final_struct, key, value): ...
+def format_time(final_struct, key, value): ...
+def format_unsignedint(final_struct, key, value): ...
+def format_uuid(final_struct, key, value): ...
+
+value_formatters: dict[str, ValueFormatter]
+
+def normalize_value_type(valueType: Any) -> str | None: ...
+def register_value_formatter(valueType: str, formatter: ValueFormatter) -> None: ...
+def resolve_value_formatter(valueType: Any) -> ValueFormatter | None: ...
+def assign_value(final_struct, key, value, valueType, formatter: ValueFormatter | None = None): ...
+def parse_boolean(value: Any) -> bool: ...
+
+DATE_PARSE_CACHE_SIZE: int
 
-def assign_value(final_struct, key, value, valueType): ...
 def parse_iso8601_date(input_string): ...
 def parse_iso8601_datetime(input_string): ...
+def parse_cache_stats() -> dict[str, dict[str, Any]]: ...
 def parse_iso8601_instant(input_string): ...
 def parse_iso8601_time(input_string): ...
 def parse_flexible_address(address): ...
+
+CODING_PARSE_CACHE_SIZE: int
+
 def caret_delimited_string_to_codeableconcept(caret_delimited_str): ...
 def caret_delimited_string_to_coding(caret_delimited_str): ...
 def string_to_quantity(quantity_str): ...
@@ -0,0 +1,83 @@
+from functools import lru_cache
+from typing import Optional, Tuple, Union
+
+# Parsed representation of the dot notation jsonPaths used in the PatientData sheet.
+# A jsonPath such as 'Patient.name[use=official].given.[0]' is split on '.' into segments, and each segment is
+# parsed once into one of the typed segments below. Parsed paths are cached by jsonPath string.
+
+
+class KeySegment:
+    """A plain key, such as 'name'."""
+    def __init__(self, text: str, path: str):
+        self.text: str = text
+        self.path: str = path
+        self.key: str = text
+
+    def __repr__(self) -> str:
+        return f"KeySegment(key='{self.key}')"
+
+
+class IndexSegment:
+    """A standalone index accessor, such as '[0]'. index is None when the qualifier is not numeric."""
+    def __init__(self, text: str, path: str, qualifier: str):
+        self.text: str = text
+        self.path: str = path
+        self.qualifier: str = qualifier
+        self.index: Optional[int] = int(qualifier) if qualifier.isdigit() else None
+
+    def __repr__(self) -> str:
+        return f"IndexSegment(index={self.index})"
+
+
+class KeyIndexSegment:
+    """A key followed by an index accessor, such as 'given[0]'."""
+    def __init__(self, text: str, path: str, key: str, index: int):
+        self.text: str = text
+        self.path: str = path
+        self.key: str = key
+        self.index: int = index
+
+    def __repr__(self) -> str:
+        return f"KeyIndexSegment(key='{self.key}', index={self.index})"
+
+
+class KeyQualifierSegment:
+    """
+    A key followed by an equality qualifier, such as 'name[use=official]'.
+    qualifier_key and qualifier_value are None when the qualifier is not of the form 'key=value' (e.g. 'extension[Race]');
+    such segments are only meaningful to the special structure handlers.
+    """
+    def __init__(self, text: str, path: str, key: str, qualifier: str):
+        self.text: str = text
+        self.path: str = path
+        self.key: str = key
+        self.qualifier: str = qualifier
+        qualifier_condition = qualifier.split('=')
+        self.qualifier_key: Optional[str] = qualifier_condition[0] if len(qualifier_condition) == 2 else None
+        self.qualifier_value: Optional[str] = qualifier_condition[1] if len(qualifier_condition) == 2 else None
+
+    def __repr__(self) -> str:
+        return f"KeyQualifierSegment(key='{self.key}', qualifier='{self.qualifier}')"
+
+
+PathSegment = Union[KeySegment, IndexSegment, KeyIndexSegment, KeyQualifierSegment]
+
+
+def parse_segment(part: str, path: str) -> PathSegment:
+    """Parse one dot notation component of a jsonPath. path is the jsonPath up to and including this component."""
+    if '[' not in part or ']' not in part:
+        return KeySegment(part, path)
+    key_part = part[:part.index('[')]
+    qualifier = part[part.index('[')+1:part.index(']')]
+    if key_part == '':
+        return IndexSegment(part, path, qualifier)
+    if '=' not in qualifier and qualifier.isdigit():
+        return KeyIndexSegment(part, path, key_part, int(qualifier))
+    return KeyQualifierSegment(part, path, key_part, qualifier)
+
+
+@lru_cache(maxsize=None)
+def parse_json_path(json_path: str) -> Tuple[PathSegment, ...]:
+    """Parse a dot notation jsonPath into a tuple of typed segments. Results are cached by jsonPath."""
+    parts = json_path.split('.')
+    return tuple(parse_segment(part, '.'.join(parts[:position + 1])) for position, part in enumerate(parts))
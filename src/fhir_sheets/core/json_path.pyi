@@ -0,0 +1,32 @@
+class KeySegment:
+    text: str
+    path: str
+    key: str
+    def __init__(self, text: str, path: str) -> None: ...
+
+class IndexSegment:
+    text: str
+    path: str
+    qualifier: str
+    index: int | None
+    def __init__(self, text: str, path: str, qualifier: str) -> None: ...
+
+class KeyIndexSegment:
+    text: str
+    path: str
+    key: str
+    index: int
+    def __init__(self, text: str, path: str, key: str, index: int) -> None: ...
+
+class KeyQualifierSegment:
+    text: str
+    path: str
+    key: str
+    qualifier: str
+    qualifier_key: str | None
+    qualifier_value: str | None
+    def __init__(self, text: str, path: str, key: str, qualifier: str) -> None: ...
+PathSegment = KeySegment | IndexSegment | KeyIndexSegment | KeyQualifierSegment
+
+def parse_segment(part: str, path: str) -> PathSegment: ...
+def parse_json_path(json_path: str) -> tuple[PathSegment, ...]: ...
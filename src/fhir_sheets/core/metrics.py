@@ -0,0 +1,143 @@
+import logging
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+import orjson
+
+from . import fhir_formatting
+
+logger: logging.Logger = logging.getLogger("fhirsheets.core.metrics")
+
+# Opt-in instrumentation of a conversion run.
+# Nothing is recorded until enable_metrics() is called; until then stage() and count() return immediately, so the
+# instrumented code paths cost one global lookup each. Every process records into its own Metrics; worker processes
+# send theirs back to be merged (see parallel.py).
+
+class Metrics:
+    """
+    Wall time and number of runs of each stage, plus named counters.
+    Stage names are dotted, e.g. 'read.PatientData' or 'convert.resource.PrimaryPatient'; nested stages are timed
+    independently, so the time of a stage includes the stages nested in it.
+    """
+    def __init__(self):
+        self.stage_seconds: Dict[str, float] = {}
+        self.stage_runs: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(name, time.perf_counter() - start)
+
+    def record_stage(self, name: str, seconds: float, runs: int = 1) -> None:
+        self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+        self.stage_runs[name] = self.stage_runs.get(name, 0) + runs
+
+    def count(self, name: str, amount: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def merge(self, other: 'Metrics') -> None:
+        for name, seconds in other.stage_seconds.items():
+            self.record_stage(name, seconds, other.stage_runs.get(name, 0))
+        for name, amount in other.counters.items():
+            self.count(name, amount)
+
+    def to_dict(self) -> Dict[str, Any]:
+        stages = {
+            name: {'seconds': seconds, 'runs': self.stage_runs[name]}
+            for name, seconds in sorted(self.stage_seconds.items())
+        }
+        # Cache counters are recorded as 'cache.<name>.hits' and 'cache.<name>.misses'
+        caches: Dict[str, Dict[str, Any]] = {}
+        for name, amount in self.counters.items():
+            if name.startswith('cache.'):
+                cache_name, _, field = name[len('cache.'):].rpartition('.')
+                caches.setdefault(cache_name, {'hits': 0, 'misses': 0})[field] = amount
+        for cache in caches.values():
+            lookups = cache['hits'] + cache['misses']
+            cache['hit_rate'] = cache['hits'] / lookups if lookups else 0.0
+        counters = {name: amount for name, amount in sorted(self.counters.items()) if not name.startswith('cache.')}
+        return {'stages': stages, 'counters': counters, 'caches': dict(sorted(caches.items()))}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]):
+        metrics = cls()
+        for name, stage in data.get('stages', {}).items():
+            metrics.record_stage(name, stage['seconds'], stage['runs'])
+        for name, amount in data.get('counters', {}).items():
+            metrics.count(name, amount)
+        for name, cache in data.get('caches', {}).items():
+            metrics.count(f"cache.{name}.hits", cache['hits'])
+            metrics.count(f"cache.{name}.misses", cache['misses'])
+        return metrics
+
+    def write_json(self, file_path: Path) -> None:
+        with open(file_path, 'wb') as metrics_file:
+            metrics_file.write(orjson.dumps(self.to_dict(), option=orjson.OPT_INDENT_2))
+
+    def __repr__(self) -> str:
+        return f"Metrics(stage_seconds={self.stage_seconds}, stage_runs={self.stage_runs}, counters={self.counters})"
+
+# The Metrics being recorded in this process; None while instrumentation is disabled
+active_metrics: Optional[Metrics] = None
+# Cumulative cache statistics already recorded into active_metrics, by cache name
+_recorded_cache_stats: Dict[str, Dict[str, int]] = {}
+_no_stage = nullcontext()
+
+# Start recording into a new Metrics, which is returned
+def enable_metrics() -> Metrics:
+    global active_metrics
+    active_metrics = Metrics()
+    # Cache lookups made before instrumentation was enabled are not recorded
+    _recorded_cache_stats.clear()
+    for cache_name, stats in fhir_formatting.parse_cache_stats().items():
+        _recorded_cache_stats[cache_name] = {'hits': stats['hits'], 'misses': stats['misses']}
+    return active_metrics
+
+# Stop recording; returns the Metrics recorded so far, if any
+def disable_metrics() -> Optional[Metrics]:
+    global active_metrics
+    metrics, active_metrics = active_metrics, None
+    return metrics
+
+def get_metrics() -> Optional[Metrics]:
+    return active_metrics
+
+# Return the Metrics recorded since the last collection, including cache statistics, and keep recording into a new one.
+# Worker processes use this to send back the metrics of each batch.
+def collect_metrics() -> Optional[Metrics]:
+    global active_metrics
+    if active_metrics is None:
+        return None
+    record_cache_stats()
+    metrics, active_metrics = active_metrics, Metrics()
+    return metrics
+
+# Context manager timing a stage when instrumentation is enabled
+def stage(name: str):
+    metrics = active_metrics
+    if metrics is None:
+        return _no_stage
+    return metrics.stage(name)
+
+# Add to a counter when instrumentation is enabled
+def count(name: str, amount: int = 1) -> None:
+    metrics = active_metrics
+    if metrics is not None:
+        metrics.count(name, amount)
+
+# Record the hits and misses of the memoized fhir_formatting parsers since they were last recorded
+def record_cache_stats() -> None:
+    metrics = active_metrics
+    if metrics is None:
+        return
+    for cache_name, stats in fhir_formatting.parse_cache_stats().items():
+        recorded = _recorded_cache_stats.setdefault(cache_name, {'hits': 0, 'misses': 0})
+        for field in ('hits', 'misses'):
+            metrics.count(f"cache.{cache_name}.{field}", stats[field] - recorded[field])
+            recorded[field] = stats[field]
@@ -0,0 +1,32 @@
+import logging
+from . import fhir_formatting as fhir_formatting
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+logger: logging.Logger
+
+class Metrics:
+    stage_seconds: dict[str, float]
+    stage_runs: dict[str, int]
+    counters: dict[str, int]
+    def __init__(self) -> None: ...
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]: ...
+    def record_stage(self, name: str, seconds: float, runs: int = 1) -> None: ...
+    def count(self, name: str, amount: int = 1) -> None: ...
+    def merge(self, other: Metrics) -> None: ...
+    def to_dict(self) -> dict[str, Any]: ...
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]): ...
+    def write_json(self, file_path: Path) -> None: ...
+
+active_metrics: Metrics | None
+
+def enable_metrics() -> Metrics: ...
+def disable_metrics() -> Metrics | None: ...
+def get_metrics() -> Metrics | None: ...
+def collect_metrics() -> Metrics | None: ...
+def stage(name: str): ...
+def count(name: str, amount: int = 1) -> None: ...
+def record_cache_stats() -> None: ...
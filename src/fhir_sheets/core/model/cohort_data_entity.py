@@ -1,15 +1,17 @@
-from typing import Dict, Any, List, Optional, Tuple
+from dataclasses import dataclass
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 
 from .common import get_value_from_keys
 
+@dataclass(frozen=True, slots=True, repr=False)
 class HeaderEntry:
-    def __init__(self, entityName, fieldName, jsonPath, valueType, valueSets):
-        self.entityName: Optional[str] = entityName
-        self.fieldName: Optional[str] = fieldName
-        self.jsonPath: Optional[str] = jsonPath
-        self.valueType: Optional[str] = valueType
-        self.valueSets: Optional[str] = valueSets
-        
+    """A PatientData column. Frozen, so headers can be hashed and shared between patients and worker processes."""
+    entityName: Optional[str]
+    fieldName: Optional[str]
+    jsonPath: Optional[str]
+    valueType: Optional[str]
+    valueSets: Optional[str]
+
     @classmethod
     def from_dict(cls, data: Dict[str, Any]):
         return cls(get_value_from_keys(data, ['entityName', 'entity_name'], ''), get_value_from_keys(data, ['fieldName', 'field_name'], ''),get_value_from_keys(data, ['jsonPath', 'json_path'], ''),get_value_from_keys(data, ['valueType', "value_type"], ''),get_value_from_keys(data, ['valueSets', 'value_sets'], ''))
@@ -18,6 +20,7 @@ class HeaderEntry:
         return (f"\nHeaderEntry(entityName='{self.entityName}', \n\tfieldName='{self.fieldName}', \n\tjsonPath='{self.jsonPath}',\n\tvalueType='{self.valueType}', "
                 f"\n\tvalueSets='{self.valueSets}')")
     
+@dataclass(slots=True, repr=False)
 class PatientEntry:
     """Container for a single patient's data entries.
 
@@ -25,12 +28,13 @@ class PatientEntry:
     prevented non‑string values (e.g., booleans for ``deceasedBoolean``) from
     being used. The conversion logic can handle any JSON‑serialisable type, so
     we relax the annotation to ``Any``.
+
+    Slotted, as a cohort can hold one per spreadsheet row.
     """
 
-    def __init__(self, entries: Dict[Tuple[str, str], Any]):
-        # Store the raw mapping; conversion functions will interpret the values
-        # based on the associated ``valueType`` from the header.
-        self.entries: Dict[Tuple[str, str], Any] = entries
+    # Store the raw mapping; conversion functions will interpret the values
+    # based on the associated ``valueType`` from the header.
+    entries: Dict[Tuple[str, str], Any]
 
     @classmethod
     def from_dict(cls, entries: Dict[Tuple[str, str], Any]):
@@ -39,10 +43,10 @@ class PatientEntry:
     def __repr__(self) -> str:
         return (f"PatientEntry(\n\t'{self.entries}')")
     
+@dataclass(slots=True, repr=False)
 class CohortData:
-    def __init__(self, headers: List[HeaderEntry], patients: List[PatientEntry]):
-        self.headers:List[HeaderEntry] = headers
-        self.patients:List[PatientEntry] = patients
+    headers: List[HeaderEntry]
+    patients: List[PatientEntry]
         
     @classmethod
     def from_dict(cls, headers: List[Dict[str, Any]], patients: List[Dict[Tuple[str,str],str]]):
@@ -52,4 +56,8 @@ class CohortData:
         return (f"CohortData(\n\t-----\n\theaders='{self.headers}',\n\t-----\n\tpatients='{self.patients}')")
     
     def get_num_patients(self):
-        return len(self.patients)
\ No newline at end of file
+        return len(self.patients)
+
+    def iter_patients(self) -> Iterator[Tuple[int, PatientEntry]]:
+        """Yield ``(index, PatientEntry)`` pairs for every patient in the cohort."""
+        return enumerate(self.patients)
@@ -1,26 +1,28 @@
 from .common import get_value_from_keys as get_value_from_keys
-from typing import Any
+from dataclasses import dataclass
+from typing import Any, Iterator
 
+@dataclass(frozen=True, slots=True, repr=False)
 class HeaderEntry:
     entityName: str | None
     fieldName: str | None
     jsonPath: str | None
     valueType: str | None
     valueSets: str | None
-    def __init__(self, entityName, fieldName, jsonPath, valueType, valueSets) -> None: ...
     @classmethod
     def from_dict(cls, data: dict[str, Any]): ...
 
+@dataclass(slots=True, repr=False)
 class PatientEntry:
-    entries: dict[tuple[str, str], str]
-    def __init__(self, entries: dict[tuple[str, str], str]) -> None: ...
+    entries: dict[tuple[str, str], Any]
     @classmethod
-    def from_dict(cls, entries: dict[tuple[str, str], str]): ...
+    def from_dict(cls, entries: dict[tuple[str, str], Any]): ...
 
+@dataclass(slots=True, repr=False)
 class CohortData:
     headers: list[HeaderEntry]
     patients: list[PatientEntry]
-    def __init__(self, headers: list[HeaderEntry], patients: list[PatientEntry]) -> None: ...
     @classmethod
     def from_dict(cls, headers: list[dict[str, Any]], patients: list[dict[tuple[str, str], str]]): ...
     def get_num_patients(self): ...
+    def iter_patients(self) -> Iterator[tuple[int, PatientEntry]]: ...
@@ -1,27 +1,24 @@
-from typing import Any, Dict, List, Optional
+from dataclasses import dataclass, field
+from typing import Any, ClassVar, Dict, List, Optional
 
 from .common import get_value_from_keys
 
 
+@dataclass(frozen=True, slots=True, repr=False)
 class ResourceDefinition:
     """
     A class to represent a Resource Definition for FHIR initialization.
+    Frozen, so definitions can be hashed and shared between patients and worker processes.
     """
-    entityName_keys: List[str] = ['Entity Name', 'name', 'entity_name']
-    resourceType_keys: List[str] = ['ResourceType', 'resource_type', 'type']
-    profile_keys: List[str] = ['Profile(s)', 'profiles', 'profile_list']
-    
-    def __init__(self, entityName: str, resourceType: str, profiles: List[str]):
-        """
-        Initializes the ResourceLink object from a dictionary.
+    entityName_keys: ClassVar[List[str]] = ['Entity Name', 'name', 'entity_name']
+    resourceType_keys: ClassVar[List[str]] = ['ResourceType', 'resource_type', 'type']
+    profile_keys: ClassVar[List[str]] = ['Profile(s)', 'profiles', 'profile_list']
+
+    entityName: str
+    resourceType: str
+    # Still compared, but left out of the hash as a list is not hashable
+    profiles: List[str] = field(hash=False)
 
-        Args:
-            data: A dictionary containing 'EntityName', 'ResourceType', and 'Profile(s)'.
-        """
-        self.entityName: str = entityName
-        self.resourceType: str = resourceType
-        self.profiles: List[str] = profiles
-        
     @classmethod
     def from_dict(cls, data:  Dict[str, Any]):
         return cls(get_value_from_keys(data, cls.entityName_keys, ''), get_value_from_keys(data, cls.resourceType_keys, ''), get_value_from_keys(data, cls.profile_keys, []))
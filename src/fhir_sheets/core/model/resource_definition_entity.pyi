@@ -1,13 +1,14 @@
 from .common import get_value_from_keys as get_value_from_keys
-from typing import Any
+from dataclasses import dataclass, field
+from typing import Any, ClassVar
 
+@dataclass(frozen=True, slots=True, repr=False)
 class ResourceDefinition:
-    entityName_keys: list[str]
-    resourceType_keys: list[str]
-    profile_keys: list[str]
+    entityName_keys: ClassVar[list[str]] = ...
+    resourceType_keys: ClassVar[list[str]] = ...
+    profile_keys: ClassVar[list[str]] = ...
     entityName: str
     resourceType: str
-    profiles: list[str]
-    def __init__(self, entityName: str, resourceType: str, profiles: list[str]) -> None: ...
+    profiles: list[str] = field(hash=False)
     @classmethod
     def from_dict(cls, data: dict[str, Any]): ...
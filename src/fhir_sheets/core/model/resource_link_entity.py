@@ -1,26 +1,23 @@
-from typing import Any, Dict, List
+from dataclasses import dataclass
+from typing import Any, ClassVar, Dict, List
 
 from .common import get_value_from_keys
 
 
+@dataclass(frozen=True, slots=True, repr=False)
 class ResourceLink:
     """
     A class to represent a Fhir Reference between two resources.
+    Frozen, so links can be hashed and shared between patients and worker processes.
     """
-    originResource_keys: List[str] = ['OriginResource', 'Origin Resource', 'origin_resource']
-    referencePath_keys: List[str] = ['ReferencePath', 'Reference Path', 'reference_path']
-    destinationResource_keys: List[str] = ['DestinationResource', 'Destination Resource', 'destination_resource']
-    def __init__(self, originResource: str, referencePath: str, destinationResource: str):
-        """
-        Initializes the ResourceLink object from a dictionary.
+    originResource_keys: ClassVar[List[str]] = ['OriginResource', 'Origin Resource', 'origin_resource']
+    referencePath_keys: ClassVar[List[str]] = ['ReferencePath', 'Reference Path', 'reference_path']
+    destinationResource_keys: ClassVar[List[str]] = ['DestinationResource', 'Destination Resource', 'destination_resource']
+
+    originResource: str
+    referencePath: str
+    destinationResource: str
 
-        Args:
-            data: A dictionary containing 'OriginResource', 'ReferencePath', and 'DestinationResource'.
-        """
-        self.originResource: str = originResource
-        self.referencePath: str = referencePath
-        self.destinationResource: str = destinationResource
-        
     @classmethod
     def from_dict(cls, data: Dict[str, Any]):
         return cls(get_value_from_keys(data, cls.originResource_keys, ''), get_value_from_keys(data, cls.referencePath_keys, ''), 
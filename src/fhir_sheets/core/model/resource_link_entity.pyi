@@ -1,13 +1,14 @@
 from .common import get_value_from_keys as get_value_from_keys
-from typing import Any
+from dataclasses import dataclass
+from typing import Any, ClassVar
 
+@dataclass(frozen=True, slots=True, repr=False)
 class ResourceLink:
-    originResource_keys: list[str]
-    referencePath_keys: list[str]
-    destinationResource_keys: list[str]
+    originResource_keys: ClassVar[list[str]] = ...
+    referencePath_keys: ClassVar[list[str]] = ...
+    destinationResource_keys: ClassVar[list[str]] = ...
     originResource: str
     referencePath: str
     destinationResource: str
-    def __init__(self, originResource: str, referencePath: str, destinationResource: str) -> None: ...
     @classmethod
     def from_dict(cls, data: dict[str, Any]): ...
@@ -0,0 +1,196 @@
+import gzip
+import io
+import logging
+import tarfile
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, Optional, Set
+
+import orjson
+
+from . import metrics
+
+logger: logging.Logger = logging.getLogger("fhirsheets.core.output")
+
+# Serialize a FHIR bundle to JSON bytes in a single pass.
+# orjson writes datetime, date and time values natively as ISO 8601 strings; datetimes with a timezone keep their offset.
+def serialize_bundle(fhir_bundle: Dict[str, Any], compact: bool = False) -> bytes:
+    option = 0 if compact else orjson.OPT_INDENT_2
+    try:
+        with metrics.stage('write.serialize'):
+            return orjson.dumps(fhir_bundle, option=option)
+    except orjson.JSONEncodeError:
+        # Sets are the usual culprit; log where they are before failing
+        find_sets(fhir_bundle)
+        raise
+
+# Write a FHIR bundle to file_path as JSON, pretty printed unless compact
+def write_bundle_file(file_path: Path, fhir_bundle: Dict[str, Any], compact: bool = False) -> None:
+    json_bytes = serialize_bundle(fhir_bundle, compact)
+    with open(file_path, 'wb') as json_file:
+        json_file.write(json_bytes)
+
+# Write buffer size for the NDJSON and archive sinks; lines are collected in memory and flushed in large writes
+NDJSON_BUFFER_SIZE = 1024 * 1024
+
+#Dictionary of supported compressions to the suffix they add to output file names
+compression_suffixes = {
+    'none': '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+# Open a buffered binary file for writing at file_path plus the suffix of the compression.
+# compression_level of None uses the default level of the compression: 6 for gzip and 3 for zstd.
+def open_output_file(file_path: Path, compression: str = 'none', compression_level: Optional[int] = None) -> BinaryIO:
+    if compression not in compression_suffixes:
+        raise ValueError(f"Unsupported compression '{compression}'. Expected one of: {', '.join(compression_suffixes)}")
+    file_path = file_path.with_name(file_path.name + compression_suffixes[compression])
+    if compression == 'gzip':
+        raw_file = gzip.open(file_path, 'wb', compresslevel=6 if compression_level is None else compression_level)
+    elif compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError("zstd compression requires the optional 'zstandard' package. Install it with 'pip install zstandard' or use gzip compression instead.") from e
+        compressor = zstandard.ZstdCompressor(level=3 if compression_level is None else compression_level)
+        raw_file = compressor.stream_writer(open(file_path, 'wb'), closefd=True)
+    else:
+        return open(file_path, 'wb', buffering=NDJSON_BUFFER_SIZE)
+    # The compressors work best on large writes, so the lines are buffered before they are compressed
+    return io.BufferedWriter(raw_file, buffer_size=NDJSON_BUFFER_SIZE)
+
+class BundleSink(ABC):
+    """Destination for the bundles created from a workbook, written one patient at a time. Close it when done."""
+
+    @abstractmethod
+    def write(self, index: int, fhir_bundle: Dict[str, Any]) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class JsonFileSink(BundleSink):
+    """Writes each bundle to its own {index}.json file."""
+    def __init__(self, output_folder_path: Path, compact: bool = False):
+        self.output_folder_path = output_folder_path
+        self.compact = compact
+
+    def write(self, index, fhir_bundle):
+        write_bundle_file(self.output_folder_path / f"{index}.json", fhir_bundle, self.compact)
+
+class NdjsonBundleSink(BundleSink):
+    """Writes every bundle as one line of a single Bundle.ndjson file, optionally compressed."""
+    def __init__(self, output_folder_path: Path, compression: str = 'none', compression_level: Optional[int] = None):
+        self.file: BinaryIO = open_output_file(output_folder_path / "Bundle.ndjson", compression, compression_level)
+
+    def write(self, index, fhir_bundle):
+        self.file.write(serialize_line(fhir_bundle))
+
+    def close(self):
+        self.file.close()
+
+class NdjsonResourceSink(BundleSink):
+    """
+    Flattens the bundles into FHIR Bulk Data style output: every entry resource is written as one line of
+    {resourceType}.ndjson, optionally compressed. Files are opened as their resourceType is first seen.
+    Resources of the deduplicated resourceTypes are only written the first time their id is seen.
+    """
+    def __init__(self, output_folder_path: Path, compression: str = 'none', compression_level: Optional[int] = None,
+                 deduplicated_resource_types: Iterable[str] = ()):
+        self.output_folder_path = output_folder_path
+        self.compression = compression
+        self.compression_level = compression_level
+        self.files: Dict[str, BinaryIO] = {}
+        # Ids written so far, by deduplicated resourceType
+        self.written_ids: Dict[str, Set[str]] = {resource_type: set() for resource_type in deduplicated_resource_types}
+
+    def write(self, index, fhir_bundle):
+        for entry in fhir_bundle.get('entry', []):
+            resource = entry.get('resource')
+            if resource is None:
+                continue
+            resource_type = resource['resourceType']
+            written_ids = self.written_ids.get(resource_type)
+            if written_ids is not None:
+                if resource['id'] in written_ids:
+                    continue
+                written_ids.add(resource['id'])
+            resource_file = self.files.get(resource_type)
+            if resource_file is None:
+                resource_file = open_output_file(self.output_folder_path / f"{resource_type}.ndjson", self.compression, self.compression_level)
+                self.files[resource_type] = resource_file
+            resource_file.write(serialize_line(resource))
+
+    def close(self):
+        for resource_file in self.files.values():
+            resource_file.close()
+        self.files = {}
+
+class TarArchiveSink(BundleSink):
+    """
+    Streams every bundle as an {index}.json member of a single Bundle.tar archive, optionally compressed
+    (Bundle.tar.gz, Bundle.tar.zst). Members are written as they arrive, so the archive is never held in memory.
+    """
+    def __init__(self, output_folder_path: Path, compact: bool = False, compression: str = 'none', compression_level: Optional[int] = None):
+        self.compact = compact
+        self.file: BinaryIO = open_output_file(output_folder_path / "Bundle.tar", compression, compression_level)
+        self.archive = tarfile.open(fileobj=self.file, mode='w|')
+        self.mtime = time.time()
+
+    def write(self, index, fhir_bundle):
+        json_bytes = serialize_bundle(fhir_bundle, self.compact)
+        member = tarfile.TarInfo(f"{index}.json")
+        member.size = len(json_bytes)
+        member.mtime = self.mtime
+        member.mode = 0o644
+        self.archive.addfile(member, io.BytesIO(json_bytes))
+
+    def close(self):
+        self.archive.close()
+        self.file.close()
+
+#Dictionary of output formats to the sink writing them
+output_formats = {
+    'json': lambda output_folder_path, config: JsonFileSink(output_folder_path, config.compact_output),
+    'ndjson': lambda output_folder_path, config: NdjsonBundleSink(output_folder_path, config.compression, config.compression_level),
+    'bulk': lambda output_folder_path, config: NdjsonResourceSink(output_folder_path, config.compression, config.compression_level,
+                                                                  ('Medication',) if config.deduplicate_medications else ()),
+    'tar': lambda output_folder_path, config: TarArchiveSink(output_folder_path, config.compact_output, config.compression, config.compression_level),
+}
+
+# Create the sink for the configured output format and compression in output_folder_path
+def create_sink(output_folder_path: Path, config) -> BundleSink:
+    output_format = config.output_format
+    if output_format not in output_formats:
+        raise ValueError(f"Unsupported output format '{output_format}'. Expected one of: {', '.join(output_formats)}")
+    if output_format == 'json' and config.compression != 'none':
+        raise ValueError(f"Compression '{config.compression}' is not supported for the 'json' output format. Use the 'ndjson', 'bulk' or 'tar' output format instead.")
+    return output_formats[output_format](output_folder_path, config)
+
+# Serialize a bundle or resource as one compact NDJSON line
+def serialize_line(fhir_object: Dict[str, Any]) -> bytes:
+    try:
+        with metrics.stage('write.serialize'):
+            return orjson.dumps(fhir_object, option=orjson.OPT_APPEND_NEWLINE)
+    except orjson.JSONEncodeError:
+        find_sets(fhir_object)
+        raise
+
+def find_sets(d, path=""):
+    if isinstance(d, dict):
+        for key, value in d.items():
+            new_path = f"{path}.{key}" if path else str(key)
+            find_sets(value, new_path)
+    elif isinstance(d, list):  # Handle lists of dictionaries
+        for idx, item in enumerate(d):
+            find_sets(item, f"{path}[{idx}]")
+    elif isinstance(d, set):
+        logger.info(f"Set found at path: {path}")
@@ -0,0 +1,62 @@
+import abc
+import logging
+import types
+from . import metrics as metrics
+from _typeshed import Incomplete
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, BinaryIO, Iterable
+
+logger: logging.Logger
+
+def serialize_bundle(fhir_bundle: dict[str, Any], compact: bool = False) -> bytes: ...
+def write_bundle_file(file_path: Path, fhir_bundle: dict[str, Any], compact: bool = False) -> None: ...
+
+NDJSON_BUFFER_SIZE: Incomplete
+compression_suffixes: Incomplete
+
+def open_output_file(file_path: Path, compression: str = 'none', compression_level: int | None = None) -> BinaryIO: ...
+
+class BundleSink(ABC, metaclass=abc.ABCMeta):
+    @abstractmethod
+    def write(self, index: int, fhir_bundle: dict[str, Any]) -> None: ...
+    def close(self) -> None: ...
+    def __enter__(self): ...
+    def __exit__(self, exc_type: type[BaseException] | None, exc_value: BaseException | None, traceback: types.TracebackType | None) -> None: ...
+
+class JsonFileSink(BundleSink):
+    output_folder_path: Incomplete
+    compact: Incomplete
+    def __init__(self, output_folder_path: Path, compact: bool = False) -> None: ...
+    def write(self, index, fhir_bundle) -> None: ...
+
+class NdjsonBundleSink(BundleSink):
+    file: BinaryIO
+    def __init__(self, output_folder_path: Path, compression: str = 'none', compression_level: int | None = None) -> None: ...
+    def write(self, index, fhir_bundle) -> None: ...
+    def close(self) -> None: ...
+
+class NdjsonResourceSink(BundleSink):
+    output_folder_path: Incomplete
+    compression: Incomplete
+    compression_level: Incomplete
+    files: dict[str, BinaryIO]
+    written_ids: dict[str, set[str]]
+    def __init__(self, output_folder_path: Path, compression: str = 'none', compression_level: int | None = None, deduplicated_resource_types: Iterable[str] = ()) -> None: ...
+    def write(self, index, fhir_bundle) -> None: ...
+    def close(self) -> None: ...
+
+class TarArchiveSink(BundleSink):
+    compact: Incomplete
+    file: BinaryIO
+    archive: Incomplete
+    mtime: Incomplete
+    def __init__(self, output_folder_path: Path, compact: bool = False, compression: str = 'none', compression_level: int | None = None) -> None: ...
+    def write(self, index, fhir_bundle) -> None: ...
+    def close(self) -> None: ...
+
+output_formats: Incomplete
+
+def create_sink(output_folder_path: Path, config) -> BundleSink: ...
+def serialize_line(fhir_object: dict[str, Any]) -> bytes: ...
+def find_sets(d, path: str = '') -> None: ...
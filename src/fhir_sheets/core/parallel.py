@@ -0,0 +1,127 @@
+import logging
+import multiprocessing
+from collections import deque
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import conversion
+from . import fhir_formatting
+from . import metrics
+from . import special_values
+from .config.FhirSheetsConfiguration import FhirSheetsConfiguration
+from .conversion_plan import ConversionPlan
+from .model.cohort_data_entity import CohortData, PatientEntry
+from .model.resource_definition_entity import ResourceDefinition
+from .model.resource_link_entity import ResourceLink
+
+logger: logging.Logger = logging.getLogger("fhirsheets.core.parallel")
+
+# Patients sent to a worker per task
+PARALLEL_BATCH_SIZE = 32
+# Batches kept in flight per worker; bounds how far reading the workbook runs ahead of writing the output
+PARALLEL_BATCHES_IN_FLIGHT = 4
+
+# Everything a worker process needs that does not change between patients; set once per worker by _initialize_worker.
+# Each worker process has its own copy of this and of the conversion module globals, so nothing is shared between workers.
+_worker_context: Dict[str, Any] = {}
+
+#The module-global registries that register_value_formatter, register_structure_handler, register_identifier_type and
+#register_component_code change at runtime. Worker processes started with the 'spawn' or 'forkserver' start methods
+#import fresh copies of these modules, so the registries are sent along and restored in every worker.
+def _snapshot_registries() -> Dict[str, Any]:
+    return {
+        'value_formatters': dict(fhir_formatting.value_formatters),
+        'custom_structure_handlers': dict(special_values.custom_structure_handlers),
+        'custom_value_handlers': list(special_values.custom_value_handlers),
+        'identifier_types': dict(special_values.identifier_types),
+        'component_codes': dict(special_values.component_codes),
+    }
+
+def _restore_registries(registries: Dict[str, Any]) -> None:
+    fhir_formatting.value_formatters.clear()
+    fhir_formatting.value_formatters.update(registries['value_formatters'])
+    for prefix, handler in registries['custom_structure_handlers'].items():
+        special_values.register_structure_handler(prefix, handler)
+    special_values.custom_value_handlers[:] = registries['custom_value_handlers']
+    special_values.identifier_types.clear()
+    special_values.identifier_types.update(registries['identifier_types'])
+    special_values.component_codes.clear()
+    special_values.component_codes.update(registries['component_codes'])
+
+def _initialize_worker(
+    resource_definition_entities: List[ResourceDefinition],
+    resource_link_entities: List[ResourceLink],
+    cohort_data: CohortData,
+    config: FhirSheetsConfiguration,
+    conversion_plan: ConversionPlan,
+    metrics_enabled: bool = False,
+    registries: Optional[Dict[str, Any]] = None,
+) -> None:
+    if metrics_enabled:
+        metrics.enable_metrics()
+    if registries is not None:
+        _restore_registries(registries)
+    _worker_context['resource_definition_entities'] = resource_definition_entities
+    _worker_context['resource_link_entities'] = resource_link_entities
+    _worker_context['cohort_data'] = cohort_data
+    _worker_context['config'] = config
+    _worker_context['conversion_plan'] = conversion_plan
+
+#Returns the (index, bundle) pairs of the batch and, when instrumentation is enabled, the metrics recorded converting it
+def _convert_batch(batch: List[Tuple[int, PatientEntry]]) -> Tuple[List[Tuple[int, Dict[str, Any]]], Optional[metrics.Metrics]]:
+    bundles = [
+        (index, conversion.create_transaction_bundle(
+            _worker_context['resource_definition_entities'],
+            _worker_context['resource_link_entities'],
+            _worker_context['cohort_data'],
+            index,
+            _worker_context['config'],
+            patient_entry,
+            _worker_context['conversion_plan'],
+        ))
+        for index, patient_entry in batch
+    ]
+    return bundles, metrics.collect_metrics()
+
+#Returns the bundles of a converted batch, merging the metrics the worker recorded into this process's metrics
+def _collect_batch(result) -> List[Tuple[int, Dict[str, Any]]]:
+    bundles, batch_metrics = result.get()
+    active_metrics = metrics.get_metrics()
+    if batch_metrics is not None and active_metrics is not None:
+        active_metrics.merge(batch_metrics)
+    return bundles
+
+def _batches(patients: Iterable[Tuple[int, PatientEntry]], batch_size: int) -> Iterator[List[Tuple[int, PatientEntry]]]:
+    patients = iter(patients)
+    while True:
+        batch = list(islice(patients, batch_size))
+        if not batch:
+            return
+        yield batch
+
+#Converts (index, PatientEntry) pairs into (index, bundle) pairs on a pool of worker processes, yielded in patient order.
+#The definitions, links, headers, configuration, conversion plan and registries are sent to each worker once when it starts;
+#afterwards only batches of patients are sent out and their bundles sent back, so the caller can write them in order.
+#When instrumentation is enabled the workers record their own metrics, which are merged into this process's metrics,
+#so the convert stage times are summed over all workers.
+def convert_patients_in_parallel(
+    resource_definition_entities: List[ResourceDefinition],
+    resource_link_entities: List[ResourceLink],
+    cohort_data: CohortData,
+    patients: Iterable[Tuple[int, PatientEntry]],
+    config: FhirSheetsConfiguration,
+    conversion_plan: ConversionPlan,
+    workers: int,
+    batch_size: int = PARALLEL_BATCH_SIZE,
+) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    logger.info(f"Converting patients with {workers} worker processes in batches of {batch_size}")
+    initargs = (resource_definition_entities, resource_link_entities, cohort_data, config, conversion_plan,
+                metrics.get_metrics() is not None, _snapshot_registries())
+    with multiprocessing.Pool(workers, initializer=_initialize_worker, initargs=initargs) as pool:
+        pending = deque()
+        for batch in _batches(patients, batch_size):
+            pending.append(pool.apply_async(_convert_batch, (batch,)))
+            if len(pending) >= workers * PARALLEL_BATCHES_IN_FLIGHT:
+                yield from _collect_batch(pending.popleft())
+        while pending:
+            yield from _collect_batch(pending.popleft())
@@ -0,0 +1,14 @@
+import logging
+from . import conversion as conversion, fhir_formatting as fhir_formatting, metrics as metrics, special_values as special_values
+from .config.FhirSheetsConfiguration import FhirSheetsConfiguration as FhirSheetsConfiguration
+from .conversion_plan import ConversionPlan as ConversionPlan
+from .model.cohort_data_entity import CohortData as CohortData, PatientEntry as PatientEntry
+from .model.resource_definition_entity import ResourceDefinition as ResourceDefinition
+from .model.resource_link_entity import ResourceLink as ResourceLink
+from typing import Any, Iterable, Iterator
+
+logger: logging.Logger
+PARALLEL_BATCH_SIZE: int
+PARALLEL_BATCHES_IN_FLIGHT: int
+
+def convert_patients_in_parallel(resource_definition_entities: list[ResourceDefinition], resource_link_entities: list[ResourceLink], cohort_data: CohortData, patients: Iterable[tuple[int, PatientEntry]], config: FhirSheetsConfiguration, conversion_plan: ConversionPlan, workers: int, batch_size: int = ...) -> Iterator[tuple[int, dict[str, Any]]]: ...
@@ -1,33 +1,100 @@
-from typing import List
+from itertools import islice, zip_longest
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
 import openpyxl
 import logging
 
-from .model.cohort_data_entity import CohortData, CohortData
+from .model.cohort_data_entity import CohortData, HeaderEntry, PatientEntry
 
 from .model.resource_definition_entity import ResourceDefinition
 from .model.resource_link_entity import ResourceLink
+from . import metrics
 
 logger: logging.Logger = logging.getLogger("fhirsheets.core.read_input")
 
+# The PatientData sheet describes each column in its first 6 rows (Entity To Query, JsonPath, Data Type, Value Set,
+# Recommended Profile, Data Element); every row below them is one patient.
+PATIENT_DATA_HEADER_ROWS = 6
+# The first 2 columns of the PatientData sheet hold the row labels and their descriptions.
+PATIENT_DATA_FIRST_COLUMN = 3
+
 # Function to read the xlsx file and access specific sheets
-def read_xlsx_and_process(file_path):
+# read_only streams the workbook with openpyxl's read-only/values-only loader. Cell objects and styles are never
+# materialized, so this is the preferred mode whenever the workbook does not need to be written back.
+def read_xlsx_and_process(file_path, read_only: bool = False):
     # Load the workbook
-    workbook = openpyxl.load_workbook(file_path)
+    with metrics.stage('read.workbook_load'):
+        workbook = openpyxl.load_workbook(file_path, read_only=read_only)
+    try:
+        return process_workbook(workbook)
+    finally:
+        # Read-only workbooks keep the underlying archive open until closed
+        if read_only:
+            workbook.close()
+
+# Function to read the xlsx file lazily, for cohorts that should not be held in memory all at once.
+# Returns the resource definitions, resource links, a CohortData holding only the headers, and an iterator of
+# (index, PatientEntry) pairs streamed from the PatientData sheet. The workbook is closed once the iterator is exhausted.
+def stream_xlsx_and_process(file_path):
+    with metrics.stage('read.workbook_load'):
+        workbook = openpyxl.load_workbook(file_path, read_only=True)
+    resource_definition_entities = []
+    resource_link_entities = []
+    cohort_data = CohortData.from_dict([],[])
+    if 'ResourceDefinitions' in workbook.sheetnames:
+        with metrics.stage('read.ResourceDefinitions'):
+            resource_definition_entities = process_sheet_resource_definitions(workbook['ResourceDefinitions'])
+
+    if 'ResourceLinks' in workbook.sheetnames:
+        with metrics.stage('read.ResourceLinks'):
+            resource_link_entities = process_sheet_resource_links(workbook['ResourceLinks'])
+
+    if 'PatientData' not in workbook.sheetnames:
+        workbook.close()
+        return resource_definition_entities, resource_link_entities, cohort_data, iter(())
+    rows = workbook['PatientData'].iter_rows(min_row=1, min_col=PATIENT_DATA_FIRST_COLUMN, values_only=True)
+    with metrics.stage('read.PatientData.headers'):
+        header_columns = read_patient_data_headers(rows, resource_definition_entities)
+    cohort_data = CohortData(headers=[HeaderEntry.from_dict(header_data) for _, header_data in header_columns], patients=[])
+    logger.info(f"Headers\n----------{cohort_data.headers}")
+    return resource_definition_entities, resource_link_entities, cohort_data, _stream_patient_entries(workbook, rows, header_columns)
+
+def _stream_patient_entries(workbook, rows, header_columns) -> Iterator[Tuple[int, PatientEntry]]:
+    try:
+        patient_entries = enumerate(iter_patient_entries(rows, header_columns))
+        while True:
+            # Only the time spent reading each patient is recorded, not the time the consumer spends on it
+            with metrics.stage('read.PatientData.rows'):
+                patient = next(patient_entries, None)
+            if patient is None:
+                return
+            yield patient
+    finally:
+        workbook.close()
+
+# Function to process the ResourceDefinitions, ResourceLinks and PatientData sheets of a loaded workbook
+def process_workbook(workbook):
     resource_definition_entities = []
     resource_link_entities = []
     cohort_data = CohortData.from_dict([],[])
     # Example of accessing specific sheets
     if 'ResourceDefinitions' in workbook.sheetnames:
         sheet = workbook['ResourceDefinitions']
-        resource_definition_entities = process_sheet_resource_definitions(sheet)
+        with metrics.stage('read.ResourceDefinitions'):
+            resource_definition_entities = process_sheet_resource_definitions(sheet)
 
     if 'ResourceLinks' in workbook.sheetnames:
         sheet = workbook['ResourceLinks']
-        resource_link_entities = process_sheet_resource_links(sheet)
+        with metrics.stage('read.ResourceLinks'):
+            resource_link_entities = process_sheet_resource_links(sheet)
 
     if 'PatientData' in workbook.sheetnames:
         sheet = workbook['PatientData']
-        cohort_data = process_sheet_patient_data_revised(sheet, resource_definition_entities)
+        with metrics.stage('read.PatientData'):
+            # Column-wise access re-scans the whole sheet per column in read-only mode, so stream it row by row instead
+            if getattr(workbook, 'read_only', False):
+                cohort_data = process_sheet_patient_data_rows(sheet, resource_definition_entities)
+            else:
+                cohort_data = process_sheet_patient_data_revised(sheet, resource_definition_entities)
     
     return resource_definition_entities, resource_link_entities, cohort_data
 
@@ -70,8 +137,9 @@ def process_sheet_patient_data_revised(sheet, resource_definition_entities):
     patients = []
     # Initialize the dictionary to store the processed data
     # Process the Header Entries from the first 6 rows (Entity To Query, JsonPath, etc.) and the data from the rest.
-    for col in sheet.iter_cols(min_row=1, min_col=3, values_only=True):  # Start from 3rd column
-        if all(entry is None for entry in col):
+    for col in iter_sheet_columns(sheet, min_col=3):  # Start from 3rd column
+        # Columns without any header cells are not described, so they are skipped whatever values they hold
+        if all(entry is None for entry in col[:PATIENT_DATA_HEADER_ROWS]):
             continue
         entity_name = col[0]  # The entity name comes from the first row (Entity To Query)
         field_name = col[5]  #The "Data Element" comes from the fifth row
@@ -92,14 +160,78 @@ def process_sheet_patient_data_revised(sheet, resource_definition_entities):
         headers.append(header_data)
         # Create a data entry
         values = col[6:] # The values come from the 6th row and below
-        values = tuple(item for item in values if item is not None)
-        #Expand the patient dictionary set if needed
+        #Expand the patient dictionary set if needed, one per row
         if len(values) > len(patients):
             needed_count = len(values) - len(patients)
-            patients.extend([{}] * needed_count)
+            patients.extend({} for _ in range(needed_count))
+        # A blank cell leaves the field unset for the patient of its row
         for patient_dict, value in zip(patients, values):
-            patient_dict[(entity_name, field_name)] = value
+            if value is not None:
+                patient_dict[(entity_name, field_name)] = value
+    # Rows without any values are not patients
+    patients = [patient_dict for patient_dict in patients if patient_dict]
     logger.info(f"Headers\n----------{headers}")
     logger.info(f"Patients\n----------{patients}")
     cohort_data = CohortData.from_dict(headers=headers, patients=patients)
-    return cohort_data
\ No newline at end of file
+    return cohort_data
+
+# Function to process the "PatientData" sheet one row at a time.
+# The header rows are read once, then each patient row is turned into a PatientEntry, so memory stays flat as the
+# number of patients grows. Produces the same CohortData as process_sheet_patient_data_revised.
+def process_sheet_patient_data_rows(sheet, resource_definition_entities):
+    rows = sheet.iter_rows(min_row=1, min_col=PATIENT_DATA_FIRST_COLUMN, values_only=True)
+    header_columns = read_patient_data_headers(rows, resource_definition_entities)
+    headers = [HeaderEntry.from_dict(header_data) for _, header_data in header_columns]
+    patients = list(iter_patient_entries(rows, header_columns))
+    logger.info(f"Headers\n----------{headers}")
+    logger.info(f"Patients\n----------{patients}")
+    return CohortData(headers=headers, patients=patients)
+
+# Read the header rows of the PatientData sheet from the rows iterator, leaving it positioned at the first patient row.
+# Returns the (column offset, header data) pairs of every described column.
+def read_patient_data_headers(rows: Iterator[Tuple[Any, ...]], resource_definition_entities) -> List[Tuple[int, Dict[str, Any]]]:
+    header_rows = list(islice(rows, PATIENT_DATA_HEADER_ROWS))
+    header_rows.extend([()] * (PATIENT_DATA_HEADER_ROWS - len(header_rows)))
+    entity_names = {entry.entityName for entry in resource_definition_entities}
+    header_columns = []
+    for column, col in enumerate(zip_longest(*header_rows, fillvalue=None)):
+        if all(entry is None for entry in col):
+            continue
+        entity_name = col[0]  # The entity name comes from the first row (Entity To Query)
+        field_name = col[5]  #The "Data Element" comes from the fifth row
+        if (entity_name is None or entity_name == "") and (field_name is not None and field_name != ""):
+            logger.warning(f"Reading Patient Data Issue - {field_name} - 'Entity To Query' cell missing for column labelled '{field_name}', please provide entity name from the ResourceDefinitions tab.")
+
+        if entity_name not in entity_names:
+            logger.warning(f"Reading Patient Data Issue - {field_name} - 'Entity To Query' cell has entity named '{entity_name}', however, the ResourceDefinition tab has no matching resource. Please provide a corresponding entry in the ResourceDefinition tab.")
+
+        header_data = {
+            "fieldName": field_name,
+            "entityName": entity_name,
+            "jsonPath": col[1],  # JsonPath from the second row
+            "valueType": col[2], # Value Type from the third row
+            "valueSets": col[3] # Value Set from the fourth row
+        }
+        header_columns.append((column, header_data))
+    return header_columns
+
+# Yield a PatientEntry for each non-empty patient row left in the rows iterator
+def iter_patient_entries(rows: Iterable[Tuple[Any, ...]], header_columns: List[Tuple[int, Dict[str, Any]]]) -> Iterator[PatientEntry]:
+    keyed_columns = [(column, (header_data["entityName"], header_data["fieldName"])) for column, header_data in header_columns]
+    for row in rows:
+        row_length = len(row)
+        entries = {}
+        for column, key in keyed_columns:
+            if column < row_length and row[column] is not None:
+                entries[key] = row[column]
+        if entries:
+            yield PatientEntry(entries)
+
+# Yield the values of each column of a sheet, starting at min_col.
+# Read-only worksheets do not support iter_cols, so their rows are streamed once and transposed instead.
+def iter_sheet_columns(sheet, min_col=1):
+    if hasattr(sheet, 'iter_cols'):
+        yield from sheet.iter_cols(min_row=1, min_col=min_col, values_only=True)
+        return
+    rows = sheet.iter_rows(min_row=1, min_col=min_col, values_only=True)
+    yield from zip_longest(*rows, fillvalue=None)
\ No newline at end of file
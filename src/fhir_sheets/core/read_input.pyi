@@ -1,8 +1,23 @@
-from .model.cohort_data_entity import CohortData as CohortData
+import logging
+from . import metrics as metrics
+from .model.cohort_data_entity import CohortData as CohortData, HeaderEntry as HeaderEntry, PatientEntry as PatientEntry
 from .model.resource_definition_entity import ResourceDefinition as ResourceDefinition
 from .model.resource_link_entity import ResourceLink as ResourceLink
+from _typeshed import Incomplete
+from collections.abc import Generator
+from typing import Any, Iterable, Iterator
 
-def read_xlsx_and_process(file_path): ...
+logger: logging.Logger
+PATIENT_DATA_HEADER_ROWS: int
+PATIENT_DATA_FIRST_COLUMN: int
+
+def read_xlsx_and_process(file_path, read_only: bool = False): ...
+def stream_xlsx_and_process(file_path): ...
+def process_workbook(workbook): ...
 def process_sheet_resource_definitions(sheet) -> list[ResourceDefinition]: ...
 def process_sheet_resource_links(sheet) -> list[ResourceLink]: ...
 def process_sheet_patient_data_revised(sheet, resource_definition_entities): ...
+def process_sheet_patient_data_rows(sheet, resource_definition_entities): ...
+def read_patient_data_headers(rows: Iterator[tuple[Any, ...]], resource_definition_entities) -> list[tuple[int, dict[str, Any]]]: ...
+def iter_patient_entries(rows: Iterable[tuple[Any, ...]], header_columns: list[tuple[int, dict[str, Any]]]) -> Iterator[PatientEntry]: ...
+def iter_sheet_columns(sheet, min_col: int = 1) -> Generator[Incomplete, Incomplete]: ...
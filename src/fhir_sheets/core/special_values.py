@@ -1,8 +1,15 @@
 
-from . import conversion
-import copy
+from .json_path import parse_json_path
 from abc import ABC, abstractmethod
-from typing import Any
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional, Tuple, Union
+import logging
+
+logger: logging.Logger = logging.getLogger("fhirsheets.core.special_values")
+
+# FragmentStructureHandler.assign_value imports conversion when called rather than at the top of this module:
+# conversion imports conversion_plan, which imports this module through fhir_formatting, so a top-level import would
+# leave conversion_plan partially initialized whenever it is imported first.
 
 # Define an abstract base class
 class AbstractStructureHandler(ABC):
@@ -15,6 +22,10 @@ class AbstractStructureHandler(ABC):
         structure) or ``None``.  The return type is deliberately generic to
         accommodate the ``PatientRaceExtensionValueHandler`` implementation
         which now returns an empty ``dict`` when no match is found.
+
+        One handler instance serves every resource of every patient, possibly
+        from several threads at once, so handlers keep no state between calls:
+        every fragment added to ``final_struct`` is built fresh for the call.
         """
         pass
     
@@ -26,386 +37,410 @@ def utilFindExtensionWithURL(extension_block, url):
     
 def findComponentWithCoding(components, code):
   return next((component for component in components if any(coding['code'] == code for coding in component['code']['coding'])), None)
+
+class FieldFragment(NamedTuple):
+    """Assigns value to key of the structure a fragment is merged into, as is."""
+    key: str
+    value: Any
+
+class PathFragment(NamedTuple):
+    """Builds the jsonpath parts into the structure a fragment is merged into and assigns value at its end, like any
+    other jsonpath; previous_parts are the parts leading up to the structure, for messages."""
+    parts: Tuple[str, ...]
+    value: Any
+    previous_parts: Tuple[str, ...] = ()
+
+class EntryFragment(NamedTuple):
+    """
+    Adds to the entry of the list under list_key whose entry_keys include match_key, such as the identifier with a
+    given type code, and merges children into it. When the list has no such entry new_entry is added for it: at the
+    end, or when order is given before the trailing entries that order sorts after it (order may return None for
+    entries it does not know, which stay where they are).
+    """
+    list_key: str
+    entry_keys: Callable[[Any], Iterable[Any]]
+    match_key: Any
+    new_entry: Dict[str, Any]
+    children: Tuple['StructureFragment', ...] = ()
+    order: Optional[Callable[[Any], Optional[int]]] = None
+
+StructureFragment = Union[FieldFragment, PathFragment, EntryFragment]
+
+class FragmentStructureHandler(AbstractStructureHandler):
+    """
+    A structure handler that is a pure function of the jsonpath and the value: build_fragment describes what the value
+    adds to a resource, built fresh on every call, without looking at or changing any structure. conversion merges
+    the fragment into the resource being built, finding the entries it adds to through the entry indexes it keeps
+    for that resource, so handlers hold no state at all.
+    """
+    @abstractmethod
+    def build_fragment(self, json_path, value) -> Optional[StructureFragment]:
+        """Return the fragment value adds for json_path, or None when it adds nothing."""
+        pass
+
+    def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value):
+        """Merge the fragment of the value into final_struct and return final_struct, or return ``{}`` and leave
+        final_struct untouched when the value adds nothing."""
+        from . import conversion
+        return conversion.apply_structure_handler(self, final_struct, json_path, resource_definition, dataType, key, value)
+
+def extension_urls(extension) -> Tuple[Any, ...]:
+    return (extension.get('url'),)
     
-class PatientRaceExtensionValueHandler(AbstractStructureHandler):
+CDC_RACE_AND_ETHNICITY_SYSTEM = "urn:oid:2.16.840.1.113883.6.238"
+NULL_FLAVOR_SYSTEM = "http://terminology.hl7.org/CodeSystem/v3-NullFlavor"
+US_CORE_RACE_URL = "http://hl7.org/fhir/us/core/StructureDefinition/us-core-race"
+US_CORE_ETHNICITY_URL = "http://hl7.org/fhir/us/core/StructureDefinition/us-core-ethnicity"
+
+class TableCoding(NamedTuple):
+    """An immutable entry of a terminology lookup table; value_coding() builds a fresh valueCoding from it."""
+    system: str
+    code: str
+    display: str
+
+    def value_coding(self) -> Dict[str, str]:
+        return {"system": self.system, "code": self.code, "display": self.display}
+
+def normalize_lookup_key(value) -> str:
+    return str(value).strip().lower()
+
+#Index a terminology table by the normalized text of its keys and by its codes, to (table key, coding) pairs
+def index_table_codings(table: Dict[str, TableCoding]) -> Dict[str, Tuple[str, TableCoding]]:
+    lookup: Dict[str, Tuple[str, TableCoding]] = {}
+    for table_key, coding in table.items():
+        lookup.setdefault(normalize_lookup_key(table_key), (table_key, coding))
+        lookup.setdefault(normalize_lookup_key(coding.code), (table_key, coding))
+    return lookup
+
+#Order of the sub-extensions of the US Core race and ethnicity extensions
+coded_sub_extension_order = {"ombCategory": 0, "detailed": 1, "text": 2}
+
+#Keys of a sub-extension of the race or ethnicity extension: its url, and its url with the code of its coding
+def coded_sub_extension_keys(sub_extension) -> Tuple[Any, ...]:
+    url = sub_extension.get('url')
+    return (url, (url, sub_extension.get('valueCoding', {}).get('code')))
+
+def coded_sub_extension_position(sub_extension) -> Optional[int]:
+    return coded_sub_extension_order.get(sub_extension.get('url'))
+
+#Build the fragment adding a coded sub-extension, such as ombCategory or detailed, to the race or ethnicity extension
+#identified by url, which is created with the given text if the resource does not have it yet.
+#Unless repeats is set, a sub-extension is only added when the extension has none of its kind yet; otherwise a coding
+#already present is not added twice.
+def coded_sub_extension_fragment(url: str, sub_url: str, coding: TableCoding, text: str, repeats: bool = False) -> EntryFragment:
+    sub_extension = EntryFragment(
+        'extension', coded_sub_extension_keys, (sub_url, coding.code) if repeats else sub_url,
+        {"url": sub_url, "valueCoding": coding.value_coding()}, order=coded_sub_extension_position)
+    return EntryFragment(
+        'extension', extension_urls, url,
+        {"extension": [{"url": "text", "valueString": text}], "url": url}, children=(sub_extension,))
+
+class PatientRaceExtensionValueHandler(FragmentStructureHandler):
     omb_categories = {
-      "american indian or alaska native" : {
-        "url" : "ombCategory",
-        "valueCoding" : {
-          "system" : "urn:oid:2.16.840.1.113883.6.238",
-          "code" : "1002-5",
-          "display" : "American Indian or Alaska Native"
-          }
-      },
-      "asian" : {
-        "url" : "ombCategory",
-        "valueCoding" : {
-          "system" : "urn:oid:2.16.840.1.113883.6.238",
-          "code" : "2028-9",
-          "display" : "Asian"
-          }
-      },
-      "black or african american" : {
-        "url" : "ombCategory",
-        "valueCoding" : {
-          "system" : "urn:oid:2.16.840.1.113883.6.238",
-          "code" : "2054-5",
-          "display" : "Black or African American"
-          }
-      },
-      "native hawaiian or other pacific islander" : {
-        "url" : "ombCategory",
-        "valueCoding" : {
-          "system" : "urn:oid:2.16.840.1.113883.6.238",
-          "code" : "2054-5",
-          "display" : "Native Hawaiian or Other Pacific Islander"
-          }  
-      },
-      "white" : {
-        "url" : "ombCategory",
-        "valueCoding" : {
-          "system" : "urn:oid:2.16.840.1.113883.6.238",
-          "code" : "2106-3",
-          "display" : "White"
-        }
-      },
-      "asked but unknown" : {
-        "url" : "ombCategory",
-        "valueCoding" : {
-          "system" : "http://terminology.hl7.org/CodeSystem/v3-NullFlavor",
-          "code" : "ASKU",
-          "display" : "Asked but Unknown"
-          }
-      },
-      "unknown" : {
-        "url" : "ombCategory",
-        "valueCoding" : {
-          "system" : "http://terminology.hl7.org/CodeSystem/v3-NullFlavor",
-          "code" : "UNK",
-          "display" : "Unknown"
-          }
-      }
-    }
-    
-    initial_race_json = {
-      "extension" : [
-        {
-          "$ombCategory"
-        },
-        {
-          "url" : "text",
-          "valueString" : "$text"
-        }
-      ],
-      "url" : "http://hl7.org/fhir/us/core/StructureDefinition/us-core-race"
+      "american indian or alaska native": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "1002-5", "American Indian or Alaska Native"),
+      "asian": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2028-9", "Asian"),
+      "black or african american": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2054-5", "Black or African American"),
+      "native hawaiian or other pacific islander": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2076-8", "Native Hawaiian or Other Pacific Islander"),
+      "white": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2106-3", "White"),
+      "asked but unknown": TableCoding(NULL_FLAVOR_SYSTEM, "ASKU", "Asked but Unknown"),
+      "unknown": TableCoding(NULL_FLAVOR_SYSTEM, "UNK", "Unknown"),
     }
-    #Create an ombcategory and detailed section of race extension
-    def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value):
-        """Assign a race extension value.
+    omb_category_lookup = index_table_codings(omb_categories)
+
+    #Create the ombCategory section of the race extension
+    def build_fragment(self, json_path, value):
+        """Build a race extension value.
 
-        If the provided ``value`` matches one of the known ``omb_categories`` the
-        appropriate extension structure is added/updated and ``final_struct`` is
-        returned.  When there is **no** match, the function now returns an empty
-        dictionary (``{}``) as requested, effectively discarding any partially
-        built race extension.
+        Values are matched case-insensitively against the names and codes of ``omb_categories``. On a match the
+        race extension is created, with the matched name as its text, if the resource does not have it yet. When
+        there is **no** match there is no fragment, so ``assign_value`` leaves ``final_struct`` untouched and
+        returns an empty dictionary (``{}``).
         """
-        original_final_struct = copy.deepcopy(final_struct)  # Keep a copy of the original structure
-        # Retrieve the race extension if it exists; make it if it does not.
-        if 'extension' not in final_struct:
-            final_struct['extension'] = []
-        race_block = utilFindExtensionWithURL(final_struct['extension'], 'http://hl7.org/fhir/us/core/StructureDefinition/us-core-race')
-        if race_block is None:
-            race_block = copy.deepcopy(self.initial_race_json)
-            final_struct['extension'].append(race_block)
-
-        matched = False
-        for race_key, race_structure in self.omb_categories.items():
-            if value.strip().lower() == race_key:
-                matched = True
-                # Replace $ombCategory in the extension list
-                for i, item in enumerate(race_block["extension"]):
-                    if isinstance(item, set) and "$ombCategory" in item:
-                        # Replace the set with the new structure
-                        race_block["extension"][i] = copy.deepcopy(race_structure)
-                    elif isinstance(item, dict) and item.get("valueString") == "$text":
-                        item['valueString'] = race_key
-                return final_struct
-        # No match found – return an empty structure as per the new requirement
-        if not matched:
-            final_struct.clear()  # Clear any changes made to final_struct
-            final_struct.update(original_final_struct) # Revert to the original structure to discard any partial changes
-            return {}
-
-class PatientEthnicityExtensionValueHandler(AbstractStructureHandler):
-    omb_categories = {
-      "Hispanic or Latino" : {
-        "url" : "ombCategory",
-        "valueCoding" : {
-          "system" : "urn:oid:2.16.840.1.113883.6.238",
-          "code" : "2135-2",
-          "display" : "Hispanic or Latino"
-          }
-      },
-      "Not Hispanic or Latino" : {
-        "url" : "ombCategory",
-        "valueCoding" : {
-          "system" : "urn:oid:2.16.840.1.113883.6.238",
-          "code" : "2186-5",
-          "display" : "Not Hispanic or Latino"
-          }
-      },
-      "asked but unknown" : {
-        "url" : "ombCategory",
-        "valueCoding" : {
-          "system" : "http://terminology.hl7.org/CodeSystem/v3-NullFlavor",
-          "code" : "ASKU",
-          "display" : "Asked but Unknown"
-          }
-      },
-      "unknown" : {
-        "url" : "ombCategory",
-        "valueCoding" : {
-          "system" : "http://terminology.hl7.org/CodeSystem/v3-NullFlavor",
-          "code" : "UNK",
-          "display" : "Unknown"
-          }
-      }
+        match = self.omb_category_lookup.get(normalize_lookup_key(value))
+        if match is None:
+            return None
+        race_key, race_coding = match
+        return coded_sub_extension_fragment(US_CORE_RACE_URL, "ombCategory", race_coding, race_key)
+
+class PatientDetailedRaceExtensionValueHandler(FragmentStructureHandler):
+    #Detailed races of the CDC Race & Ethnicity code system, by OMB category
+    detailed_races = {
+      # American Indian or Alaska Native
+      "american indian": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "1004-1", "American Indian"),
+      "alaska native": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "1735-0", "Alaska Native"),
+      # Asian
+      "asian indian": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2029-7", "Asian Indian"),
+      "bangladeshi": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2030-5", "Bangladeshi"),
+      "bhutanese": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2031-3", "Bhutanese"),
+      "burmese": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2032-1", "Burmese"),
+      "cambodian": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2033-9", "Cambodian"),
+      "chinese": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2034-7", "Chinese"),
+      "taiwanese": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2035-4", "Taiwanese"),
+      "filipino": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2036-2", "Filipino"),
+      "hmong": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2037-0", "Hmong"),
+      "indonesian": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2038-8", "Indonesian"),
+      "japanese": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2039-6", "Japanese"),
+      "korean": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2040-4", "Korean"),
+      "laotian": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2041-2", "Laotian"),
+      "malaysian": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2042-0", "Malaysian"),
+      "okinawan": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2043-8", "Okinawan"),
+      "pakistani": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2044-6", "Pakistani"),
+      "sri lankan": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2045-3", "Sri Lankan"),
+      "thai": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2046-1", "Thai"),
+      "vietnamese": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2047-9", "Vietnamese"),
+      "iwo jiman": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2048-7", "Iwo Jiman"),
+      "maldivian": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2049-5", "Maldivian"),
+      "nepalese": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2050-3", "Nepalese"),
+      "singaporean": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2051-1", "Singaporean"),
+      "madagascar": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2052-9", "Madagascar"),
+      # Black or African American
+      "black": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2056-0", "Black"),
+      "african american": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2058-6", "African American"),
+      "african": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2060-2", "African"),
+      "bahamian": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2067-7", "Bahamian"),
+      "barbadian": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2068-5", "Barbadian"),
+      "dominican": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2069-3", "Dominican"),
+      "dominica islander": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2070-1", "Dominica Islander"),
+      "haitian": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2071-9", "Haitian"),
+      "jamaican": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2072-7", "Jamaican"),
+      "tobagoan": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2073-5", "Tobagoan"),
+      "trinidadian": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2074-3", "Trinidadian"),
+      "west indian": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2075-0", "West Indian"),
+      # Native Hawaiian or Other Pacific Islander
+      "polynesian": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2078-4", "Polynesian"),
+      "native hawaiian": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2079-2", "Native Hawaiian"),
+      "samoan": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2080-0", "Samoan"),
+      "tahitian": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2081-8", "Tahitian"),
+      "tongan": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2082-6", "Tongan"),
+      "micronesian": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2085-9", "Micronesian"),
+      "guamanian or chamorro": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2086-7", "Guamanian or Chamorro"),
+      "guamanian": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2087-5", "Guamanian"),
+      "chamorro": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2088-3", "Chamorro"),
+      "melanesian": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2100-6", "Melanesian"),
+      "fijian": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2101-4", "Fijian"),
+      "papua new guinean": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2102-2", "Papua New Guinean"),
+      "other pacific islander": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2500-7", "Other Pacific Islander"),
+      # White
+      "european": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2108-9", "European"),
+      "middle eastern or north african": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2118-8", "Middle Eastern or North African"),
+      # Other
+      "other race": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2131-1", "Other Race"),
     }
-    
-    initial_ethnicity_json = {
-      "extension" : [
-        {
-          "$ombCategory"
-        },
-        {
-          "url" : "text",
-          "valueString" : "$text"
-        }
-      ],
-      "url" : "http://hl7.org/fhir/us/core/StructureDefinition/us-core-ethnicity"
+    detailed_race_lookup = index_table_codings(detailed_races)
+
+    #Add a detailed section to the race extension; several detailed races may be given
+    def build_fragment(self, json_path, value):
+        """Build a detailed race, matched like :class:`PatientRaceExtensionValueHandler` against ``detailed_races``.
+        When there is no match there is no fragment."""
+        match = self.detailed_race_lookup.get(normalize_lookup_key(value))
+        if match is None:
+            return None
+        race_key, race_coding = match
+        return coded_sub_extension_fragment(US_CORE_RACE_URL, "detailed", race_coding, race_key, repeats=True)
+
+class PatientEthnicityExtensionValueHandler(FragmentStructureHandler):
+    omb_categories = {
+      "Hispanic or Latino": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2135-2", "Hispanic or Latino"),
+      "Not Hispanic or Latino": TableCoding(CDC_RACE_AND_ETHNICITY_SYSTEM, "2186-5", "Not Hispanic or Latino"),
+      "asked but unknown": TableCoding(NULL_FLAVOR_SYSTEM, "ASKU", "Asked but Unknown"),
+      "unknown": TableCoding(NULL_FLAVOR_SYSTEM, "UNK", "Unknown"),
     }
-    #Create an ombcategory and detailed section of ethnicitiy extension
-    def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value):
-        """Assign an ethnicity extension value.
+    omb_category_lookup = index_table_codings(omb_categories)
+
+    #Create the ombCategory section of the ethnicity extension
+    def build_fragment(self, json_path, value):
+        """Build an ethnicity extension value.
 
-        Mirrors the behaviour of :class:`PatientRaceExtensionValueHandler` – if the
-        supplied ``value`` matches one of the known ``omb_categories`` the
-        appropriate extension is added/updated and ``final_struct`` is returned.
-        When there is **no** match the function now returns an empty dictionary
-        (``{}``) to satisfy the new test requirement.
+        Mirrors the behaviour of :class:`PatientRaceExtensionValueHandler`; the text of the extension keeps the case
+        of the matched ``omb_categories`` name. When there is **no** match there is no fragment.
         """
-        original_final_struct = copy.deepcopy(final_struct)  # Keep a copy of the original structure
-        # Retrieve the ethnicity extension if it exists; make it if it does not.
-        if 'extension' not in final_struct:
-            final_struct['extension'] = []
-        ethnicity_block = utilFindExtensionWithURL(final_struct['extension'], 'http://hl7.org/fhir/us/core/StructureDefinition/us-core-ethnicity')
-        if ethnicity_block is None:
-            ethnicity_block = copy.deepcopy(self.initial_ethnicity_json)
-            final_struct['extension'].append(ethnicity_block)
-
-        matched = False
-        for ethnicity_key, ethnicity_structure in self.omb_categories.items():
-            if value.strip().lower() == ethnicity_key.strip().lower():
-                matched = True
-                # Replace $ombCategory in the extension list
-                for i, item in enumerate(ethnicity_block["extension"]):
-                    if isinstance(item, set) and "$ombCategory" in item:
-                        # Replace the set with the new structure
-                        ethnicity_block["extension"][i] = copy.deepcopy(ethnicity_structure)
-                    elif isinstance(item, dict) and item.get("valueString") == "$text":
-                        item['valueString'] = ethnicity_key
-                return final_struct
-        # No match – return empty dict as required
-        if not matched:
-            final_struct.clear()  # Clear any changes made to final_struct
-            final_struct.update(original_final_struct)  # Revert to the original structure to discard any partial changes
-            return {}
+        match = self.omb_category_lookup.get(normalize_lookup_key(value))
+        if match is None:
+            return None
+        ethnicity_key, ethnicity_coding = match
+        return coded_sub_extension_fragment(US_CORE_ETHNICITY_URL, "ombCategory", ethnicity_coding, ethnicity_key)
       
-class PatientBirthSexExtensionValueHandler(AbstractStructureHandler):
-    birth_sex_block = {
-      "url" : "http://hl7.org/fhir/us/core/StructureDefinition/us-core-birthsex",
-      "valueCode" : "$value"
-    }
-    #Assigna birthsex extension
-    def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value):
-        #Retrieve the birthsex extension if it exists; make it if it does not.
-        if 'extension' not in final_struct:
-            final_struct['extension'] = []
-        birthsex_block = utilFindExtensionWithURL(final_struct['extension'], 'http://hl7.org/fhir/us/core/StructureDefinition/us-core-ethnicity')
-        if birthsex_block is None:
-            birthsex_block = self.birth_sex_block
-            birthsex_block['valueCode'] = value
-            final_struct['extension'].append(birthsex_block)
-        pass
+US_CORE_BIRTHSEX_URL = "http://hl7.org/fhir/us/core/StructureDefinition/us-core-birthsex"
+
+class PatientBirthSexExtensionValueHandler(FragmentStructureHandler):
+    @staticmethod
+    def birth_sex_block(value):
+        return {
+          "url" : US_CORE_BIRTHSEX_URL,
+          "valueCode" : value
+        }
+    #Build a birthsex extension; a birthsex extension the resource already has is kept
+    def build_fragment(self, json_path, value):
+        return EntryFragment('extension', extension_urls, US_CORE_BIRTHSEX_URL, self.birth_sex_block(value))
       
-class PatientMRNIdentifierValueHandler(AbstractStructureHandler):
-    patient_mrn_block = {
+IDENTIFIER_TYPE_SYSTEM = "http://terminology.hl7.org/CodeSystem/v2-0203"
+NPI_SYSTEM = "http://hl7.org/fhir/sid/us-npi"
+CLIA_SYSTEM = "urn:oid:2.16.840.1.113883.4.7"
+
+def mrn_identifier():
+    return {
       "use" : "usual",
       "type" : {
         "coding" : [
           {
-            "system" : "http://terminology.hl7.org/CodeSystem/v2-0203",
+            "system" : IDENTIFIER_TYPE_SYSTEM,
             "code" : "MR",
             "display" : "Medical Record Number"
           }
         ],
         "text" : "Medical Record Number"
-      },
-      "system" : "$system",
-      "value" : "$value"
+      }
     }
-    #Assign a MRN identifier
-    def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value):
-        #Retrieve the MRN identifier if it exists; make it if it does not.
-        target_identifier = self.patient_mrn_block
-        new_identifier = True
-        if 'identifier' not in final_struct:
-          final_struct['identifier'] = []
-        for identifier in final_struct['identifier']:
-          if 'type' in identifier:
-            for coding in identifier['type']['coding']:
-              if coding['code'] == 'MR':
-                target_identifier = identifier
-                new_identifier = False
-        if new_identifier:
-          final_struct['identifier'].append(target_identifier)
-        target_identifier[key] = value
-        pass
-      
-class PatientSSNIdentifierValueHandler(AbstractStructureHandler):
-    patient_mrn_block = {
+
+def ssn_identifier():
+    return {
       "use" : "usual",
       "type" : {
         "coding" : [
           {
-            "system" : "http://terminology.hl7.org/CodeSystem/v2-0203",
+            "system" : IDENTIFIER_TYPE_SYSTEM,
             "code" : "SS"
           }
         ],
         "text" : "Social Security Number"
-      },
-      "system" : "$system",
-      "value" : "$value"
-    }
-    #Assign a MRN identifier
-    def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value):
-        #Retrieve the MRN identifier if it exists; make it if it does not.
-        target_identifier = self.patient_mrn_block
-        new_identifier = True
-        if 'identifier' not in final_struct:
-          final_struct['identifier'] = []
-        for identifier in final_struct['identifier']:
-          if 'type' in identifier:
-            for coding in identifier['type']['coding']:
-              if coding['code'] == 'SS':
-                target_identifier = identifier
-                new_identifier = False
-        if new_identifier:
-          final_struct['identifier'].append(target_identifier)
-        target_identifier[key] = value
-        pass
-      
-class OrganizationIdentiferNPIValueHandler(AbstractStructureHandler):
-    npi_identifier_block = {
-      "system" : "http://hl7.org.fhir/sid/us-npi",
-      "value" : "$value"
-    }
-    #Assigna birthsex extension
-    def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value):
-        #Retrieve the birthsex extension if it exists; make it if it does not.
-        if 'identifier' not in final_struct:
-            final_struct['identifier'] = []
-        identifier_block = next((entry for entry in final_struct['identifier'] if entry['system'] == "http://hl7.org.fhir/sid/us-npi"), None)
-        if identifier_block is None:
-          identifier_block = self.npi_identifier_block
-          final_struct['identifier'].append(identifier_block)
-        identifier_block['value'] = str(value)
-        pass
-      
-class OrganizationIdentiferCLIAValueHandler(AbstractStructureHandler):
-    clia_identifier_block = {
-      "system" : "urn:oid:2.16.840.1.113883.4.7",
-      "value" : "$value"
-    }
-    #Assign a birthsex extension
-    def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value):
-        #Retrieve the birthsex extension if it exists; make it if it does not.
-        if 'identifier' not in final_struct:
-            final_struct['identifier'] = []
-        identifier_block = next((entry for entry in final_struct['identifier'] if entry['system'] == "urn:oid:2.16.840.1.113883.4.7"), None)
-        if identifier_block is None:
-          identifier_block = self.clia_identifier_block
-          final_struct['identifier'].append(identifier_block)
-        identifier_block['value'] = str(value)
-        pass
-      
-class PractitionerIdentiferNPIValueHandler(AbstractStructureHandler):
-    npi_identifier_block = {
-      "system" : "http://hl7.org.fhir/sid/us-npi",
-      "value" : "$value"
-    }
-    #Assigna birthsex extension
-    def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value):
-        #Retrieve the birthsex extension if it exists; make it if it does not.
-        if 'identifier' not in final_struct:
-            final_struct['identifier'] = []
-        identifier_block = next((entry for entry in final_struct['identifier'] if entry['system'] == "http://hl7.org.fhir/sid/us-npi"), None)
-        if identifier_block is None:
-          identifier_block = self.npi_identifier_block
-          final_struct['identifier'].append(identifier_block)
-        identifier_block['value'] = value
-        pass
-      
-class ObservationComponentHandler(AbstractStructureHandler):
-    pulse_oximetry_oxygen_flow_rate = {
-      "code" : {
-        "coding" : [
-          {
-            "system" : "http://loinc.org",
-            "code" : "3151-8",
-            "display" : "Inhaled oxygen flow rate"
-          }
-        ],
-        "text" : "Inhaled oxygen flow rate"
       }
     }
-    pulse_oximetry_oxygen_concentration = {
-      "code" : {
-        "coding" : [
-          {
-            "system" : "http://loinc.org",
-            "code" : "3150-0",
-            "display" : "Inhaled oxygen concentration"
+
+def npi_identifier():
+    return {"system" : NPI_SYSTEM}
+
+def clia_identifier():
+    return {"system" : CLIA_SYSTEM}
+
+class IdentifierType(NamedTuple):
+    """
+    One kind of identifier handled by IdentifierValueHandler.
+    match_on is 'type' to find the identifier by the codes of its type codings, or 'system' to find it by its system;
+    code is the type code or system to find. template builds a new identifier when the resource has none yet.
+    """
+    match_on: str
+    code: str
+    template: Callable[[], Dict[str, Any]]
+    # Assign values as strings, e.g. for NPIs read from numeric cells
+    value_as_string: bool = False
+
+def identifier_type_codes(identifier) -> Tuple[Any, ...]:
+    return tuple(coding.get('code') for coding in identifier.get('type', {}).get('coding', []))
+
+def identifier_systems(identifier) -> Tuple[Any, ...]:
+    return (identifier.get('system'),)
+
+identifier_entry_keys = {
+    'type': identifier_type_codes,
+    'system': identifier_systems,
+}
+
+#Identifier types by (resourceType, identifier qualifier) of the jsonpath, e.g. ('Patient', 'type=MRN') for
+#'Patient.identifier[type=MRN].value'. Add entries with register_identifier_type.
+identifier_types: Dict[Tuple[str, str], IdentifierType] = {
+    ('Patient', 'type=MR'): IdentifierType('type', 'MR', mrn_identifier),
+    ('Patient', 'type=MRN'): IdentifierType('type', 'MR', mrn_identifier),
+    ('Patient', 'type=SSN'): IdentifierType('type', 'SS', ssn_identifier),
+    ('Organization', 'system=NPI'): IdentifierType('system', NPI_SYSTEM, npi_identifier, value_as_string=True),
+    ('Organization', 'system=CLIA'): IdentifierType('system', CLIA_SYSTEM, clia_identifier, value_as_string=True),
+    ('Practitioner', 'system=NPI'): IdentifierType('system', NPI_SYSTEM, npi_identifier),
+}
+
+class IdentifierValueHandler(FragmentStructureHandler):
+    """
+    Assigns a field of the identifier a jsonpath such as 'Patient.identifier[type=MRN].value' qualifies, creating the
+    identifier from its IdentifierType template if the resource does not have it yet. Deeper jsonpaths, such as
+    'Patient.identifier[type=MRN].period.start', are built into the identifier like any other jsonpath.
+    """
+    def build_fragment(self, json_path, value):
+        segments = parse_json_path(json_path)
+        identifier_type = identifier_types.get((segments[0].key, getattr(segments[1], 'qualifier', None)))
+        if identifier_type is None:
+            return None
+        if len(segments) > 3:
+            parts = tuple(json_path.split('.'))
+            child: StructureFragment = PathFragment(parts[2:], value, parts[:2])
+        else:
+            key = segments[-1].text
+            #The field the identifier is matched on is set by its template; overwriting it would orphan the identifier
+            if key == identifier_type.match_on:
+                logger.warning(f"Full jsonpath: {json_path} - the '{key}' of this identifier is set by its identifier type and cannot be assigned. Skipping value '{value}'.")
+                return None
+            child = FieldFragment(key, str(value) if identifier_type.value_as_string else value)
+        return EntryFragment('identifier', identifier_entry_keys[identifier_type.match_on], identifier_type.code, identifier_type.template(), children=(child,))
+
+#The identifier handlers before the identifier types were table driven; they all assign through identifier_types
+PatientMRNIdentifierValueHandler = IdentifierValueHandler
+PatientSSNIdentifierValueHandler = IdentifierValueHandler
+OrganizationIdentiferNPIValueHandler = IdentifierValueHandler
+OrganizationIdentiferCLIAValueHandler = IdentifierValueHandler
+PractitionerIdentiferNPIValueHandler = IdentifierValueHandler
+      
+LOINC_SYSTEM = "http://loinc.org"
+
+#Local code table of the component codes ObservationComponentHandler knows the display of, by code.
+#Add entries with register_component_code; components with other codes are created with just their code.
+component_codes: Dict[str, TableCoding] = {
+    # Pulse oximetry
+    "3151-8": TableCoding(LOINC_SYSTEM, "3151-8", "Inhaled oxygen flow rate"),
+    "3150-0": TableCoding(LOINC_SYSTEM, "3150-0", "Inhaled oxygen concentration"),
+    # Blood pressure
+    "8480-6": TableCoding(LOINC_SYSTEM, "8480-6", "Systolic blood pressure"),
+    "8462-4": TableCoding(LOINC_SYSTEM, "8462-4", "Diastolic blood pressure"),
+    # Vital signs
+    "8867-4": TableCoding(LOINC_SYSTEM, "8867-4", "Heart rate"),
+    "9279-1": TableCoding(LOINC_SYSTEM, "9279-1", "Respiratory rate"),
+    "8310-5": TableCoding(LOINC_SYSTEM, "8310-5", "Body temperature"),
+    "59408-5": TableCoding(LOINC_SYSTEM, "59408-5", "Oxygen saturation in Arterial blood by Pulse oximetry"),
+    "2708-6": TableCoding(LOINC_SYSTEM, "2708-6", "Oxygen saturation in Arterial blood"),
+    "29463-7": TableCoding(LOINC_SYSTEM, "29463-7", "Body weight"),
+    "8302-2": TableCoding(LOINC_SYSTEM, "8302-2", "Body height"),
+    "39156-5": TableCoding(LOINC_SYSTEM, "39156-5", "Body mass index (BMI) [Ratio]"),
+}
+
+def register_component_code(coding: TableCoding) -> None:
+    component_codes[coding.code] = coding
+
+def component_coding_codes(component) -> Tuple[Any, ...]:
+    return tuple(coding.get('code') for coding in component.get('code', {}).get('coding', []))
+
+#Split a component jsonpath such as 'Observation.component[code=8480-6].valueQuantity' into the component code and
+#the remaining parts, once per jsonpath. The code is None when the component qualifier is not of the form 'code=...'.
+@lru_cache(maxsize=None)
+def parse_component_path(json_path: str) -> Tuple[Optional[str], Tuple[str, ...], Tuple[str, ...]]:
+    segments = parse_json_path(json_path)
+    component_segment = segments[1] if len(segments) > 1 else None
+    code = getattr(component_segment, 'qualifier_value', None) if getattr(component_segment, 'qualifier_key', None) == 'code' else None
+    parts = tuple(segment.text for segment in segments)
+    return code, parts[2:], parts[:2]
+
+class ObservationComponentHandler(FragmentStructureHandler):
+    """
+    Builds 'Observation.component[code=XXXX]...' jsonpaths into the component with code XXXX, creating the component
+    with the display of component_codes if the Observation does not have it yet. conversion finds components through
+    an index by code, so panels with many components are built in linear time.
+    """
+    @staticmethod
+    def component_block(code):
+        coding = component_codes.get(code)
+        if coding is None:
+            return {"code": {"coding": [{"code": code}]}}
+        return {
+          "code" : {
+            "coding" : [coding.value_coding()],
+            "text" : coding.display
           }
-        ],
-        "text" : "Inhaled oxygen concentration"
-      }
-    }
-    #Find the appropriate component for the observaiton; then call build_structure again to continue the drill down
-    def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value):
-        #Check to make sure the component part exists
-        if 'component' not in final_struct:
-          final_struct['component'] = []
-        components = final_struct['component']
-        #Look through the qualifier parts.
-        parts = json_path.split('.')
-        key_part = parts[1][:parts[1].index('[')]
-        qualifier = parts[1][parts[1].index('[')+1:parts[1].index(']')]
-        qualifier_condition = qualifier.split('=')
-        
-        target_component: dict = {}
-        if qualifier_condition[0] == 'code' and qualifier_condition[1] == '3151-8':
-          target_component = findComponentWithCoding(components, '3151-8') or self.pulse_oximetry_oxygen_flow_rate
-          if target_component is self.pulse_oximetry_oxygen_flow_rate:
-            components.append(target_component)
-        if qualifier_condition[0] == 'code' and qualifier_condition[1] == '3150-0':
-          target_component = findComponentWithCoding(components, '3150-0') or self.pulse_oximetry_oxygen_concentration
-          if target_component is self.pulse_oximetry_oxygen_concentration:
-            components.append(target_component)
-        #Recurse back down into 
-        # current_struct: Dict, json_path: str, resource_definition: ResourceDefinition, dataType: str, parts: List[str], value: Any, previous_parts: List[str]
-        return conversion.build_structure(target_component, '.'.join(parts[2:]), resource_definition, dataType, parts[2:], value, parts[:2])
-        pass
+        }
+
+    #Build the rest of the jsonpath into the component for the code of the observation
+    def build_fragment(self, json_path, value):
+        code, remaining_parts, previous_parts = parse_component_path(json_path)
+        if code is None:
+          #Other qualifiers, such as component[0], are built like any other jsonpath
+          return PathFragment(previous_parts + remaining_parts, value)
+        return EntryFragment('component', component_coding_codes, code, self.component_block(code),
+                             children=(PathFragment(remaining_parts, value, previous_parts),))
+
 
 #Special Handler just for $values. This one is data absent reason
 class AbstractValueHandler(ABC):
@@ -417,11 +452,13 @@ class AbstractValueHandler(ABC):
 
 class DataAbsentReasonHandler(AbstractValueHandler):
   #Assign data absent reason extension
-    data_absent_reason_block = {
-      "url" : "http://hl7.org/fhir/StructureDefinition/data-absent-reason",
-      "value" : "$value"
-    }
-    data_absent_reason_values = ['$unknown','$asked-unknown','$temp-unknown','$not-asked','$asked-declined','$masked','$not-applicable','$unsupported','$as-text','$error','$not-a-number','$negative-infinity','$positive-infinity','$not-performed','$not-permitted']
+    @staticmethod
+    def data_absent_reason_block(value):
+      return {
+        "url" : "http://hl7.org/fhir/StructureDefinition/data-absent-reason",
+        "value" : value
+      }
+    data_absent_reason_values = frozenset(['$unknown','$asked-unknown','$temp-unknown','$not-asked','$asked-declined','$masked','$not-applicable','$unsupported','$as-text','$error','$not-a-number','$negative-infinity','$positive-infinity','$not-performed','$not-permitted'])
     def assign_value(self, final_struct, key, value, valueType):
         #Trim the value so the '$' is missing
         if value and value.startswith('$'):
@@ -439,28 +476,79 @@ class DataAbsentReasonHandler(AbstractValueHandler):
             final_struct['extension'] = []
         data_absent_reason_block = utilFindExtensionWithURL(final_struct['extension'], 'http://hl7.org/fhir/StructureDefinition/data-absent-reason')
         if data_absent_reason_block is None:
-            data_absent_reason_block = self.data_absent_reason_block
-            data_absent_reason_block['value'] = value
-            final_struct['extension'].append(data_absent_reason_block)
+            final_struct['extension'].append(self.data_absent_reason_block(value))
         pass
       
 #Data dictionary of jsonpaths to match vs classes that need to be called
-custom_structure_handlers = {
+custom_structure_handlers: Dict[str, AbstractStructureHandler] = {
     "Patient.extension[Race].ombCategory": PatientRaceExtensionValueHandler(),
+    "Patient.extension[Race].detailed": PatientDetailedRaceExtensionValueHandler(),
     "Patient.extension[Ethnicity].ombCategory": PatientEthnicityExtensionValueHandler(),
     "Patient.extension[Birthsex].value": PatientBirthSexExtensionValueHandler(),
-    "Patient.identifier[type=MR].system": PatientMRNIdentifierValueHandler(),
-    "Patient.identifier[type=MR].value": PatientMRNIdentifierValueHandler(),
-    "Patient.identifier[type=MRN].system": PatientMRNIdentifierValueHandler(),
-    "Patient.identifier[type=MRN].value": PatientMRNIdentifierValueHandler(),
-    "Patient.identifier[type=SSN].system": PatientSSNIdentifierValueHandler(),
-    "Patient.identifier[type=SSN].value": PatientSSNIdentifierValueHandler(),
-    "Organization.identifier[system=NPI].value": OrganizationIdentiferNPIValueHandler(),
-    "Organization.identifier[system=CLIA].value": OrganizationIdentiferCLIAValueHandler(),
-    "Practitioner.identifier[system=NPI].value": PractitionerIdentiferNPIValueHandler(),
     "Observation.component[": ObservationComponentHandler()
 }
 
+class StructureHandlerRegistry:
+    """Resolves jsonpaths to the structure handler registered for a prefix of them.
+
+    Prefixes are kept in a character trie, so resolving a path costs one walk over the path no matter how many
+    handlers are registered. When several registered prefixes match, the longest (most specific) one wins.
+    The handler each distinct jsonpath resolves to is memoized until another handler is registered.
+    """
+    # Key under which a trie node stores the handler registered for the prefix ending at that node
+    _HANDLER_KEY = None
+
+    def __init__(self, handlers: Dict[str, AbstractStructureHandler] = {}):
+        self._trie: Dict[Any, Any] = {}
+        self._resolved: Dict[str, Optional[AbstractStructureHandler]] = {}
+        for prefix, handler in handlers.items():
+            self.register(prefix, handler)
+
+    def register(self, prefix: str, handler: AbstractStructureHandler) -> None:
+        node = self._trie
+        for character in prefix:
+            node = node.setdefault(character, {})
+        node[self._HANDLER_KEY] = handler
+        self._resolved = {}
+
+    def resolve(self, json_path: str) -> Optional[AbstractStructureHandler]:
+        resolved = self._resolved
+        if json_path in resolved:
+            return resolved[json_path]
+        node = self._trie
+        matching_handler = node.get(self._HANDLER_KEY)
+        for character in json_path:
+            node = node.get(character)
+            if node is None:
+                break
+            matching_handler = node.get(self._HANDLER_KEY, matching_handler)
+        resolved[json_path] = matching_handler
+        return matching_handler
+
+identifier_value_handler = IdentifierValueHandler()
+custom_structure_handlers.update({
+    f"{identifier_resource_type}.identifier[{identifier_qualifier}]": identifier_value_handler
+    for identifier_resource_type, identifier_qualifier in identifier_types
+})
+
+structure_handler_registry = StructureHandlerRegistry(custom_structure_handlers)
+
+#Register an additional structure handler for every jsonpath starting with prefix.
+#Conversion plans resolve their handlers when compiled, so register handlers before compiling one.
+def register_structure_handler(prefix: str, handler: AbstractStructureHandler) -> None:
+    custom_structure_handlers[prefix] = handler
+    structure_handler_registry.register(prefix, handler)
+
+#Handle '{resourceType}.identifier[{qualifier}]' jsonpaths with identifier_type, e.g.
+#register_identifier_type('Patient', 'type=DL', IdentifierType('type', 'DL', drivers_license_identifier))
+def register_identifier_type(resourceType: str, qualifier: str, identifier_type: IdentifierType) -> None:
+    identifier_types[(resourceType, qualifier)] = identifier_type
+    register_structure_handler(f"{resourceType}.identifier[{qualifier}]", identifier_value_handler)
+
+#Find the structure handler a jsonpath resolves to, if any
+def resolve_structure_handler(json_path):
+    return structure_handler_registry.resolve(json_path)
+
 #Data definition of values to match vs classes tht need to be called
 custom_value_handlers = [
   {'value_criteria':DataAbsentReasonHandler.data_absent_reason_values, 'handler': DataAbsentReasonHandler()}
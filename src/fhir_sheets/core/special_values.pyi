@@ -1,62 +1,148 @@
 import abc
-from . import conversion as conversion
+import logging
+from .json_path import parse_json_path as parse_json_path
 from _typeshed import Incomplete
 from abc import ABC, abstractmethod
+from typing import Any, Callable, Iterable, NamedTuple
+
+logger: logging.Logger
 
 class AbstractStructureHandler(ABC, metaclass=abc.ABCMeta):
     @abstractmethod
-    def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value): ...
+    def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value) -> Any: ...
 
 def utilFindExtensionWithURL(extension_block, url): ...
 def findComponentWithCoding(components, code): ...
 
-class PatientRaceExtensionValueHandler(AbstractStructureHandler):
-    omb_categories: Incomplete
-    initial_race_json: Incomplete
+class FieldFragment(NamedTuple):
+    key: str
+    value: Any
+
+class PathFragment(NamedTuple):
+    parts: tuple[str, ...]
+    value: Any
+    previous_parts: tuple[str, ...] = ...
+
+class EntryFragment(NamedTuple):
+    list_key: str
+    entry_keys: Callable[[Any], Iterable[Any]]
+    match_key: Any
+    new_entry: dict[str, Any]
+    children: tuple['StructureFragment', ...] = ...
+    order: Callable[[Any], int | None] | None = ...
+StructureFragment = FieldFragment | PathFragment | EntryFragment
+
+class FragmentStructureHandler(AbstractStructureHandler, metaclass=abc.ABCMeta):
+    @abstractmethod
+    def build_fragment(self, json_path, value) -> StructureFragment | None: ...
     def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value): ...
 
-class PatientEthnicityExtensionValueHandler(AbstractStructureHandler):
+def extension_urls(extension) -> tuple[Any, ...]: ...
+
+CDC_RACE_AND_ETHNICITY_SYSTEM: str
+NULL_FLAVOR_SYSTEM: str
+US_CORE_RACE_URL: str
+US_CORE_ETHNICITY_URL: str
+
+class TableCoding(NamedTuple):
+    system: str
+    code: str
+    display: str
+    def value_coding(self) -> dict[str, str]: ...
+
+def normalize_lookup_key(value) -> str: ...
+def index_table_codings(table: dict[str, TableCoding]) -> dict[str, tuple[str, TableCoding]]: ...
+
+coded_sub_extension_order: Incomplete
+
+def coded_sub_extension_keys(sub_extension) -> tuple[Any, ...]: ...
+def coded_sub_extension_position(sub_extension) -> int | None: ...
+def coded_sub_extension_fragment(url: str, sub_url: str, coding: TableCoding, text: str, repeats: bool = False) -> EntryFragment: ...
+
+class PatientRaceExtensionValueHandler(FragmentStructureHandler):
     omb_categories: Incomplete
-    initial_ethnicity_json: Incomplete
-    def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value): ...
+    omb_category_lookup: Incomplete
+    def build_fragment(self, json_path, value): ...
 
-class PatientBirthSexExtensionValueHandler(AbstractStructureHandler):
-    birth_sex_block: Incomplete
-    def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value) -> None: ...
+class PatientDetailedRaceExtensionValueHandler(FragmentStructureHandler):
+    detailed_races: Incomplete
+    detailed_race_lookup: Incomplete
+    def build_fragment(self, json_path, value): ...
 
-class PatientMRNIdentifierValueHandler(AbstractStructureHandler):
-    patient_mrn_block: Incomplete
-    def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value) -> None: ...
+class PatientEthnicityExtensionValueHandler(FragmentStructureHandler):
+    omb_categories: Incomplete
+    omb_category_lookup: Incomplete
+    def build_fragment(self, json_path, value): ...
 
-class PatientSSNIdentifierValueHandler(AbstractStructureHandler):
-    patient_mrn_block: Incomplete
-    def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value) -> None: ...
+US_CORE_BIRTHSEX_URL: str
 
-class OrganizationIdentiferNPIValueHandler(AbstractStructureHandler):
-    npi_identifier_block: Incomplete
-    def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value) -> None: ...
+class PatientBirthSexExtensionValueHandler(FragmentStructureHandler):
+    @staticmethod
+    def birth_sex_block(value): ...
+    def build_fragment(self, json_path, value): ...
 
-class OrganizationIdentiferCLIAValueHandler(AbstractStructureHandler):
-    clia_identifier_block: Incomplete
-    def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value) -> None: ...
+IDENTIFIER_TYPE_SYSTEM: str
+NPI_SYSTEM: str
+CLIA_SYSTEM: str
 
-class PractitionerIdentiferNPIValueHandler(AbstractStructureHandler):
-    npi_identifier_block: Incomplete
-    def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value) -> None: ...
+def mrn_identifier(): ...
+def ssn_identifier(): ...
+def npi_identifier(): ...
+def clia_identifier(): ...
 
-class ObservationComponentHandler(AbstractStructureHandler):
-    pulse_oximetry_oxygen_flow_rate: Incomplete
-    pulse_oximetry_oxygen_concentration: Incomplete
-    def assign_value(self, json_path, resource_definition, dataType, final_struct, key, value): ...
+class IdentifierType(NamedTuple):
+    match_on: str
+    code: str
+    template: Callable[[], dict[str, Any]]
+    value_as_string: bool = ...
+
+def identifier_type_codes(identifier) -> tuple[Any, ...]: ...
+def identifier_systems(identifier) -> tuple[Any, ...]: ...
+
+identifier_entry_keys: Incomplete
+identifier_types: dict[tuple[str, str], IdentifierType]
+
+class IdentifierValueHandler(FragmentStructureHandler):
+    def build_fragment(self, json_path, value): ...
+PatientMRNIdentifierValueHandler = IdentifierValueHandler
+PatientSSNIdentifierValueHandler = IdentifierValueHandler
+OrganizationIdentiferNPIValueHandler = IdentifierValueHandler
+OrganizationIdentiferCLIAValueHandler = IdentifierValueHandler
+PractitionerIdentiferNPIValueHandler = IdentifierValueHandler
+LOINC_SYSTEM: str
+component_codes: dict[str, TableCoding]
+
+def register_component_code(coding: TableCoding) -> None: ...
+def component_coding_codes(component) -> tuple[Any, ...]: ...
+def parse_component_path(json_path: str) -> tuple[str | None, tuple[str, ...], tuple[str, ...]]: ...
+
+class ObservationComponentHandler(FragmentStructureHandler):
+    @staticmethod
+    def component_block(code): ...
+    def build_fragment(self, json_path, value): ...
 
 class AbstractValueHandler(ABC, metaclass=abc.ABCMeta):
     @abstractmethod
     def assign_value(self, final_struct, key, value, valueType): ...
 
 class DataAbsentReasonHandler(AbstractValueHandler):
-    data_absent_reason_block: Incomplete
+    @staticmethod
+    def data_absent_reason_block(value): ...
     data_absent_reason_values: Incomplete
     def assign_value(self, final_struct, key, value, valueType) -> None: ...
 
-custom_structure_handlers: Incomplete
+custom_structure_handlers: dict[str, AbstractStructureHandler]
+
+class StructureHandlerRegistry:
+    def __init__(self, handlers: dict[str, AbstractStructureHandler] = {}) -> None: ...
+    def register(self, prefix: str, handler: AbstractStructureHandler) -> None: ...
+    def resolve(self, json_path: str) -> AbstractStructureHandler | None: ...
+
+identifier_value_handler: Incomplete
+structure_handler_registry: Incomplete
+
+def register_structure_handler(prefix: str, handler: AbstractStructureHandler) -> None: ...
+def register_identifier_type(resourceType: str, qualifier: str, identifier_type: IdentifierType) -> None: ...
+def resolve_structure_handler(json_path): ...
+
 custom_value_handlers: Incomplete
@@ -824,4 +824,73 @@ def test_condition_code_missing_system(tmp_path):
 
     
     assert fhir_bundle["entry"][1]["resource"]["resourceType"] == "Condition"
-    assert "system" not in fhir_bundle["entry"][1]["resource"]["code"]["coding"][0]
\ No newline at end of file
+    assert "system" not in fhir_bundle["entry"][1]["resource"]["code"]["coding"][0]
+
+def test_excel_conversion_compact_output(tmp_path):
+    input_file = (
+        TOP_DIR
+        / "Congenital_Hyperthyrodism/Congenital_Hyperthyrodism_Fhir_Cohort_Import_Template.xlsx"
+    ).__str__()
+    pretty_path = tmp_path / "pretty"
+    compact_path = tmp_path / "compact"
+    main(input_file, pretty_path, FhirSheetsConfiguration({"random_seed": 1}))
+    main(input_file, compact_path, FhirSheetsConfiguration({"random_seed": 1, "compact_output": True}))
+
+    compact_file = compact_path / "0.json"
+    assert b"\n" not in compact_file.read_bytes()
+    with compact_file.open("r") as file:
+        compact_bundle = json.load(file)
+    with (pretty_path / "0.json").open("r") as file:
+        pretty_bundle = json.load(file)
+    assert compact_bundle["resourceType"] == "Bundle"
+    assert len(compact_bundle["entry"]) == len(pretty_bundle["entry"])
+
+def test_excel_conversion_bulk_output(tmp_path):
+    input_file = (
+        TOP_DIR
+        / "Congenital_Hyperthyrodism/Congenital_Hyperthyrodism_Fhir_Cohort_Import_Template.xlsx"
+    ).__str__()
+    main(input_file, tmp_path, FhirSheetsConfiguration({"output_format": "bulk"}))
+
+    assert not list(tmp_path.glob("*.json"))
+    with (tmp_path / "Patient.ndjson").open("r") as file:
+        patients = [json.loads(line) for line in file]
+    assert patients
+    assert all(patient["resourceType"] == "Patient" for patient in patients)
+
+def test_excel_conversion_workers(tmp_path):
+    input_file = (
+        TOP_DIR
+        / "Congenital_Hyperthyrodism/Congenital_Hyperthyrodism_Fhir_Cohort_Import_Template.xlsx"
+    ).__str__()
+    serial_path = tmp_path / "serial"
+    parallel_path = tmp_path / "parallel"
+    main(input_file, serial_path)
+    main(input_file, parallel_path, FhirSheetsConfiguration({"workers": 2}))
+
+    serial_files = sorted(path.name for path in serial_path.glob("*.json"))
+    assert serial_files == sorted(path.name for path in parallel_path.glob("*.json"))
+    for file_name in serial_files:
+        with (parallel_path / file_name).open("r") as file:
+            parallel_bundle = json.load(file)
+        with (serial_path / file_name).open("r") as file:
+            serial_bundle = json.load(file)
+        assert [entry["resource"]["resourceType"] for entry in parallel_bundle["entry"]] == [entry["resource"]["resourceType"] for entry in serial_bundle["entry"]]
+
+
+def test_excel_conversion_metrics_out(tmp_path):
+    input_file = (
+        TOP_DIR
+        / "Congenital_Hyperthyrodism/Congenital_Hyperthyrodism_Fhir_Cohort_Import_Template.xlsx"
+    ).__str__()
+    metrics_path = tmp_path / "metrics.json"
+    main(input_file, tmp_path / "output", FhirSheetsConfiguration({"metrics_out": str(metrics_path), "workers": 2}))
+
+    with metrics_path.open("r") as file:
+        run_metrics = json.load(file)
+    patient_count = len(list((tmp_path / "output").glob("*.json")))
+    assert run_metrics["counters"]["patients"] == patient_count
+    assert run_metrics["stages"]["convert.bundle"]["runs"] == patient_count
+    assert run_metrics["stages"]["write"]["runs"] == patient_count
+    assert "read.workbook_load" in run_metrics["stages"]
+    assert "parse_iso8601_date" in run_metrics["caches"]
@@ -1,19 +1,34 @@
+import pathlib
+import subprocess
+import sys
+
 import pytest
 import uuid
 from src.fhir_sheets.core.conversion import (
+    create_transaction_bundle,
     initialize_bundle,
     initialize_resource,
     add_resource_to_transaction_bundle,
     create_structure_from_jsonpath,
     create_resources,
+    ResourceIdGenerator,
+    add_default_resource_links,
+    post_process_create_medication_references,
+    canonical_code_key,
+    EntryIndex,
+    get_entry_index,
+    merge_fragment,
+    build_fhir_resource,
 )
 from src.fhir_sheets.core.config.FhirSheetsConfiguration import FhirSheetsConfiguration
+from src.fhir_sheets.core.conversion_plan import ConversionPlan, ResourceLinkPlan, compile_entity_plan
+from src.fhir_sheets.core.special_values import EntryFragment, FieldFragment, PatientRaceExtensionValueHandler
 from src.fhir_sheets.core.model.resource_definition_entity import ResourceDefinition
 from src.fhir_sheets.core.model.resource_link_entity import ResourceLink
 from src.fhir_sheets.core.model.cohort_data_entity import CohortData, HeaderEntry, PatientEntry
 
 import json
-from src.fhir_sheets.core.conversion import clean_empty
+from src.fhir_sheets.core.conversion import clean_empty, prune_empty_in_place
 
 
 class TestInitializeBundle:
@@ -99,6 +114,38 @@ class TestCreateStructureFromJsonpath:
         # Currently converts None to string "None" due to type conversion order
         assert result == {'name': 'None'}
 
+    def test_create_structure_key_index(self):
+        root = {}
+        rd = ResourceDefinition("Patient", "Patient", [])
+        create_structure_from_jsonpath(root, "Patient.name[0].given", rd, "string", "Jane")
+        create_structure_from_jsonpath(root, "Patient.name[1].given", rd, "string", "John")
+        assert root['name'] == [{'given': 'Jane'}, {'given': 'John'}]
+
+    def test_create_structure_qualifier(self):
+        root = {}
+        rd = ResourceDefinition("Patient", "Patient", [])
+        create_structure_from_jsonpath(root, "Patient.name[use=official].family", rd, "string", "Doe")
+        create_structure_from_jsonpath(root, "Patient.name[use=official].text", rd, "string", "Jane Doe")
+        assert root['name'] == [{'use': 'official', 'family': 'Doe', 'text': 'Jane Doe'}]
+
+    def test_create_structure_invalid_standalone_qualifier(self):
+        rd = ResourceDefinition("Patient", "Patient", [])
+        with pytest.raises(TypeError):
+            create_structure_from_jsonpath({}, "Patient.name.[x].family", rd, "string", "Doe")
+
+    def test_create_structure_code_qualifier_without_coding_leaves_struct_untouched(self):
+        root = {'code': {'text': 'x'}}
+        rd = ResourceDefinition("Observation", "Observation", [])
+        with pytest.raises(TypeError):
+            create_structure_from_jsonpath(root, "Observation.code[system=loinc].text", rd, "string", "Heart rate")
+        assert root == {'code': {'text': 'x'}}
+
+    def test_create_structure_unsupported_qualifier_leaves_struct_untouched(self):
+        root = {'name': {'text': 'Jane Doe'}}
+        rd = ResourceDefinition("Patient", "Patient", [])
+        create_structure_from_jsonpath(root, "Patient.name[official].family", rd, "string", "Doe")
+        assert root == {'name': {'text': 'Jane Doe'}}
+
     def test_create_structure_with_datatype_conversion(self):
         root = {}
         rd = ResourceDefinition("Patient", "Patient", [])
@@ -106,6 +153,29 @@ class TestCreateStructureFromJsonpath:
         assert result['active'] == "123"  # Converted to string
 
 
+class TestPruneEmptyInPlace:
+    def test_prunes_like_clean_empty(self):
+        data = {
+            "resourceType": "Condition",
+            "code": {"coding": [{"system": "", "code": ""}], "text": ""},
+            "note": [None, {}, [], "", {"text": "kept"}],
+            "dosageInstruction": [{}],
+            "onsetDateTime": None,
+            "active": False,
+        }
+        expected = clean_empty(json.loads(json.dumps(data)))
+        nested_note = data["note"]
+        result = prune_empty_in_place(data)
+        assert result is data
+        assert data == expected == {"resourceType": "Condition", "note": ["", {"text": "kept"}], "active": False}
+        # Nested containers are pruned in place rather than replaced
+        assert data["note"] is nested_note
+
+    def test_prune_everything(self):
+        data = {"a": {"b": [None, {"c": ""}]}}
+        assert prune_empty_in_place(data) == {}
+
+
 class TestCleanEmptyFunction:
     def test_clean_empty_removes_empty_structures(self):
         """Ensure that clean_empty removes empty dicts, lists, and None values.
@@ -466,4 +536,237 @@ class TestCreateResources:
         assert isinstance(ref, list)
         expected_ref = f"Condition/{condition_res['id']}"
         assert ref[0]["reference"] == expected_ref
-        assert len(ref) == 1
\ No newline at end of file
+        assert len(ref) == 1
+
+    def test_create_resources_from_patient_entry(self):
+        """A streamed ``PatientEntry`` is converted instead of ``cohort_data.patients[index]``."""
+        header = HeaderEntry(
+            entityName="Patient",
+            fieldName="gender",
+            jsonPath="Patient.gender",
+            valueType="code",
+            valueSets=None,
+        )
+        # The cohort only supplies the headers; the patient itself is streamed
+        cohort = CohortData(headers=[header], patients=[])
+        rd = ResourceDefinition("Patient", "Patient", [])
+        bundle = create_transaction_bundle([rd], [], cohort, 7, FhirSheetsConfiguration({}), PatientEntry({("Patient", "gender"): "female"}))
+        assert len(bundle["entry"]) == 1
+        assert bundle["entry"][0]["resource"]["gender"] == "female"
+
+
+class TestConversionPlan:
+    def _headers(self):
+        return [
+            HeaderEntry(entityName="Patient", fieldName="gender", jsonPath="Patient.gender", valueType="code", valueSets=None),
+            HeaderEntry(entityName="Patient", fieldName="race", jsonPath="Patient.extension[Race].ombCategory", valueType=" String ", valueSets=None),
+            HeaderEntry(entityName="Encounter", fieldName="status", jsonPath="Encounter.status", valueType="code", valueSets=None),
+            HeaderEntry(entityName="Patient", fieldName="gender", jsonPath="Patient.ignored", valueType="code", valueSets=None),
+        ]
+
+    def test_compile_groups_fields_by_entity(self):
+        patient_rd = ResourceDefinition("Patient", "Patient", [])
+        encounter_rd = ResourceDefinition("Encounter", "Encounter", [])
+        plan = ConversionPlan.compile([patient_rd, encounter_rd], self._headers())
+        assert [entity_plan.resource_definition for entity_plan in plan.entity_plans] == [patient_rd, encounter_rd]
+        patient_plan = plan.entity_plans[0]
+        assert [field.fieldName for field in patient_plan.fields] == ["gender", "race", "gender"]
+        # The first header wins when field names repeat
+        assert patient_plan.fields_by_name["gender"].jsonPath == "Patient.gender"
+        race = patient_plan.fields_by_name["race"]
+        assert [segment.text for segment in race.segments] == ["Patient", "extension[Race]", "ombCategory"]
+        assert race.normalizedValueType == "string"
+        assert isinstance(race.structureHandler, PatientRaceExtensionValueHandler)
+        assert patient_plan.fields_by_name["gender"].structureHandler is None
+
+    def test_plan_reused_across_patients(self):
+        rd = ResourceDefinition("Patient", "Patient", [])
+        cohort = CohortData(headers=self._headers(), patients=[
+            PatientEntry({("Patient", "gender"): "male"}),
+            PatientEntry({("Patient", "gender"): "female"}),
+        ])
+        plan = ConversionPlan.compile([rd], cohort.headers)
+        genders = [create_resources([rd], [], cohort, index, FhirSheetsConfiguration({}), conversion_plan=plan)["Patient"]["gender"] for index in range(2)]
+        assert genders == ["male", "female"]
+
+    @pytest.mark.parametrize("module", ["conversion_plan", "conversion", "special_values", "fhir_formatting", "metrics", "parallel"])
+    def test_module_imports_first_in_fresh_interpreter(self, module):
+        # conversion, conversion_plan, fhir_formatting and special_values import each other; any of them may be imported first
+        result = subprocess.run([sys.executable, "-c", f"import src.fhir_sheets.core.{module}"],
+                                cwd=pathlib.Path(__file__).parent.parent, capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+
+
+def entry_codes(entry):
+    return (entry.get('code'),)
+
+
+class TestEntryIndex:
+    def test_find_and_insert(self):
+        entries = [{'code': 'a'}, {'code': 'b'}]
+        index = EntryIndex(entries, entry_codes)
+        assert index.find('b') is entries[1]
+        assert index.find('c') is None
+        index.insert(2, 'c', {'code': 'c'})
+        assert index.find('c') is entries[2]
+        index.insert(0, 'd', {'code': 'd'})
+        assert [index.find(code) for code in 'abcd'] == [entries[1], entries[2], entries[3], entries[0]]
+
+    def test_first_entry_wins(self):
+        entries = [{'code': 'a', 'n': 1}, {'code': 'a', 'n': 2}]
+        assert EntryIndex(entries, entry_codes).find('a')['n'] == 1
+
+    def test_entries_changed_outside_the_index(self):
+        entries = [{'code': 'a'}]
+        index = EntryIndex(entries, entry_codes)
+        assert index.find('a') is entries[0]
+        entries.append({'code': 'b'})
+        assert index.find('b') is entries[1]
+        entries[:] = [{'code': 'b'}, {'code': 'a'}]
+        assert index.find('a') is entries[1]
+        entries.clear()
+        assert index.find('a') is None
+
+    def test_indexes_are_kept_per_resource(self):
+        entries = []
+        entry_indexes = {}
+        assert get_entry_index(entry_indexes, entries, entry_codes) is get_entry_index(entry_indexes, entries, entry_codes)
+        assert get_entry_index({}, entries, entry_codes) is not get_entry_index(entry_indexes, entries, entry_codes)
+
+
+class TestMergeFragment:
+    def test_merges_into_matching_entry(self):
+        rd = ResourceDefinition("Patient", "Patient", [])
+        resource = {'identifier': [{'code': 'a'}]}
+        entry_indexes = {}
+        merge_fragment(resource, EntryFragment('identifier', entry_codes, 'a', {'code': 'a'}, (FieldFragment('value', 1),)), rd, "string", entry_indexes)
+        merge_fragment(resource, EntryFragment('identifier', entry_codes, 'b', {'code': 'b'}, (FieldFragment('value', 2),)), rd, "string", entry_indexes)
+        assert resource == {'identifier': [{'code': 'a', 'value': 1}, {'code': 'b', 'value': 2}]}
+
+    def test_ordered_entries(self):
+        rd = ResourceDefinition("Patient", "Patient", [])
+        order = {'first': 0, 'last': 1}.get
+        def entry_order(entry):
+            return order(entry['code'])
+        resource = {'extension': [{'code': 'other'}, {'code': 'last'}]}
+        merge_fragment(resource, EntryFragment('extension', entry_codes, 'first', {'code': 'first'}, order=entry_order), rd, "string", {})
+        assert [entry['code'] for entry in resource['extension']] == ['other', 'first', 'last']
+
+    def test_resource_shares_entry_indexes(self):
+        rd = ResourceDefinition("Observation", "Observation", [])
+        headers = [
+            HeaderEntry(entityName="Observation", fieldName=f"component{code}", jsonPath=f"Observation.component[code={code}].valueString", valueType="string", valueSets=None)
+            for code in ("8480-6", "8462-4")
+        ]
+        resource = build_fhir_resource(compile_entity_plan(rd, headers), [("component8480-6", "120"), ("component8462-4", "80"), ("component8480-6", "121")])
+        assert [(component['code']['coding'][0]['code'], component['valueString']) for component in resource['component']] == [("8480-6", "121"), ("8462-4", "80")]
+
+
+class TestResourceIdGenerator:
+    def test_deterministic_ids(self):
+        config = FhirSheetsConfiguration({"random_seed": 5, "deterministic_ids": True})
+        first = ResourceIdGenerator(config, 3)
+        again = ResourceIdGenerator(config, 3)
+        other_patient = ResourceIdGenerator(config, 4)
+        assert first.generate("PrimaryPatient") == again.generate("PrimaryPatient")
+        assert first.generate("PrimaryPatient") != first.generate("PrimaryEncounter")
+        assert first.generate("PrimaryPatient") != other_patient.generate("PrimaryPatient")
+        assert str(uuid.UUID(first.generate("Bundle"))) == first.generate("Bundle")
+
+    def test_deterministic_medication_ids_are_cohort_wide(self):
+        config = FhirSheetsConfiguration({"random_seed": 5, "deterministic_ids": True})
+        code = {"coding": [{"system": "http://www.nlm.nih.gov/research/umls/rxnorm", "code": "197361"}]}
+        reordered = {"coding": [{"code": "197361", "system": "http://www.nlm.nih.gov/research/umls/rxnorm"}]}
+        assert ResourceIdGenerator(config, 0).generate_medication_id(code) == ResourceIdGenerator(config, 9).generate_medication_id(reordered)
+
+    def test_random_ids_by_default(self):
+        generator = ResourceIdGenerator(FhirSheetsConfiguration({"random_seed": 5}), 0)
+        assert generator.generate("PrimaryPatient") != generator.generate("PrimaryPatient")
+
+
+class TestResourceLinkPlan:
+    def _definitions(self):
+        return [
+            ResourceDefinition("PrimaryPatient", "Patient", []),
+            ResourceDefinition("FirstObservation", "Observation", []),
+            ResourceDefinition("SecondObservation", "Observation", []),
+        ]
+
+    def test_candidates_limited_to_defined_resource_types(self):
+        plan = ResourceLinkPlan([], self._definitions())
+        assert plan.candidate_default_references == (("observation", "patient", "subject"),)
+
+    def test_default_links_resolved_per_patient(self):
+        explicit = [ResourceLink("FirstObservation", "focus", "PrimaryPatient")]
+        plan = ResourceLinkPlan(explicit, self._definitions())
+        single = {
+            "PrimaryPatient": {"resourceType": "Patient"},
+            "FirstObservation": {"resourceType": "Observation"},
+        }
+        links = plan.resolve_links(single)
+        assert [(l.originResource, l.referencePath, l.destinationResource) for l in links] == [
+            ("FirstObservation", "focus", "PrimaryPatient"),
+            ("FirstObservation", "subject", "PrimaryPatient"),
+        ]
+        # A later patient with two observations gets no default link, and the explicit links are untouched
+        both = dict(single, SecondObservation={"resourceType": "Observation"})
+        assert plan.resolve_links(both) == explicit
+        assert explicit == [explicit[0]] and len(plan.resource_link_entities) == 1
+
+    def test_add_default_resource_links_does_not_mutate(self):
+        explicit = []
+        links = add_default_resource_links(
+            {"PrimaryPatient": {"resourceType": "Patient"}, "FirstObservation": {"resourceType": "Observation"}}, explicit
+        )
+        assert explicit == []
+        assert [(l.originResource, l.referencePath, l.destinationResource) for l in links] == [("FirstObservation", "subject", "PrimaryPatient")]
+
+    def test_compile_with_links(self):
+        plan = ConversionPlan.compile(self._definitions(), [], [])
+        assert isinstance(plan.link_plan, ResourceLinkPlan)
+        assert ConversionPlan.compile(self._definitions(), []).link_plan is None
+
+
+class TestMedicationReferences:
+    CODE = {"coding": [{"system": "http://www.nlm.nih.gov/research/umls/rxnorm", "code": "197361", "display": "amlodipine"}]}
+
+    def _bundle(self, *resources):
+        root_bundle = initialize_bundle(FhirSheetsConfiguration({}))
+        for resource in resources:
+            add_resource_to_transaction_bundle(root_bundle, resource)
+        return root_bundle
+
+    def _request(self, id, code):
+        return {"resourceType": "MedicationRequest", "id": id, "medicationCodeableConcept": json.loads(json.dumps(code))}
+
+    def test_one_medication_per_code(self):
+        other_code = {"coding": [{"system": "http://www.nlm.nih.gov/research/umls/rxnorm", "code": "1049221"}]}
+        root_bundle = self._bundle(self._request("r1", self.CODE), self._request("r2", self.CODE), self._request("r3", other_code))
+        post_process_create_medication_references(root_bundle)
+        medications = [entry["resource"] for entry in root_bundle["entry"] if entry["resource"]["resourceType"] == "Medication"]
+        requests = [entry["resource"] for entry in root_bundle["entry"] if entry["resource"]["resourceType"] == "MedicationRequest"]
+        assert len(medications) == 2
+        assert requests[0]["medicationReference"] == requests[1]["medicationReference"] == "Medication/" + medications[0]["id"]
+        assert requests[2]["medicationReference"] == "Medication/" + medications[1]["id"]
+        assert all("medicationCodeableConcept" not in request for request in requests)
+
+    def test_existing_medication_matched_regardless_of_key_order(self):
+        reordered = {"coding": [{"display": "amlodipine", "code": "197361", "system": "http://www.nlm.nih.gov/research/umls/rxnorm"}]}
+        medication = {"resourceType": "Medication", "id": "m1", "code": reordered}
+        root_bundle = self._bundle(medication, self._request("r1", self.CODE), {"resourceType": "MedicationRequest", "id": "r2"})
+        post_process_create_medication_references(root_bundle)
+        assert len(root_bundle["entry"]) == 3
+        assert root_bundle["entry"][1]["resource"]["medicationReference"] == "Medication/m1"
+
+    def test_deduplicated_medication_ids_across_patients(self):
+        config = FhirSheetsConfiguration({"random_seed": 3, "deduplicate_medications": True})
+        medication_ids = []
+        for index in range(2):
+            root_bundle = self._bundle(self._request("r1", self.CODE))
+            post_process_create_medication_references(root_bundle, ResourceIdGenerator(config, index))
+            medication_ids.append(root_bundle["entry"][1]["resource"]["id"])
+        assert medication_ids[0] == medication_ids[1]
+
+    def test_canonical_code_key(self):
+        assert canonical_code_key({"a": [1, {"b": 2}], "c": 3}) == canonical_code_key({"c": 3, "a": [1, {"b": 2}]})
+        assert canonical_code_key({"a": [1, 2]}) != canonical_code_key({"a": [2, 1]})
@@ -1,8 +1,11 @@
+import pytest
 
+import datetime
 import orjson
 import logging
 from src.fhir_sheets.core.fhir_formatting import (
     caret_delimited_string_to_codeableconcept,
+    caret_delimited_string_to_coding,
     parse_flexible_address,
     parse_iso8601_date,
     parse_iso8601_datetime,
@@ -11,6 +14,12 @@ from src.fhir_sheets.core.fhir_formatting import (
     parse_iso8601_time,
     parse_human_name,
     parse_boolean,
+    assign_value,
+    register_value_formatter,
+    resolve_value_formatter,
+    value_formatters,
+    validate_primitive,
+    parse_cache_stats,
 )
 
 logger: logging.Logger = logging.getLogger("fhirsheets.test_fhir_values")
@@ -176,4 +185,111 @@ def test_parse_boolean_variants():
     # Unrecognised string should raise ValueError
     import pytest
     with pytest.raises(ValueError):
-        parse_boolean("notabool")
\ No newline at end of file
+        parse_boolean("notabool")
+def test_assign_value_normalizes_value_type():
+    final_struct = {}
+    assign_value(final_struct, "active", "yes", " Boolean ")
+    assert final_struct == {"active": True}
+
+def test_assign_value_positive_and_unsigned_int():
+    final_struct = {}
+    assign_value(final_struct, "numberOfSeries", "12", "positiveInt")
+    assign_value(final_struct, "count", "0", "unsignedInt")
+    assert final_struct == {"numberOfSeries": 12, "count": 0}
+
+def test_assign_value_unsupported_value_type():
+    final_struct = {}
+    assign_value(final_struct, "value", "abc", "notAType")
+    assert final_struct == {}
+
+def test_assign_value_data_absent_reason():
+    final_struct = {}
+    assign_value(final_struct, "birthDate", "$unknown", "date")
+    assert final_struct["extension"][0]["value"] == "unknown"
+
+def test_register_value_formatter():
+    def format_upper(final_struct, key, value):
+        final_struct[key] = value.upper()
+        return final_struct
+    register_value_formatter("Shout", format_upper)
+    try:
+        assert resolve_value_formatter("shout") is format_upper
+        final_struct = {}
+        assign_value(final_struct, "text", "hello", "SHOUT")
+        assert final_struct == {"text": "HELLO"}
+    finally:
+        del value_formatters["shout"]
+
+def test_assign_value_with_resolved_formatter():
+    final_struct = {}
+    assign_value(final_struct, "gender", "female", "code", resolve_value_formatter("code"))
+    assert final_struct == {"gender": "female"}
+
+def test_validate_primitive_fullmatch():
+    assert validate_primitive("id", "patient-0001") == "patient-0001"
+    assert validate_primitive("oid", "urn:oid:2.16.840.1.113883.6.238") == "urn:oid:2.16.840.1.113883.6.238"
+    assert validate_primitive("decimal", "1.5e10") == "1.5e10"
+    assert validate_primitive("integer", 42.0) == "42"
+    with pytest.raises(ValueError):
+        validate_primitive("id", "not valid!")
+    with pytest.raises(ValueError):
+        validate_primitive("positiveInt", "0")
+    with pytest.raises(ValueError):
+        validate_primitive("code", "two  spaces")
+
+def test_assign_value_invalid_primitive_is_skipped():
+    final_struct = {}
+    assign_value(final_struct, "count", "-3", "unsignedInt")
+    assert final_struct == {}
+
+def test_assign_value_non_numeric_decimal_is_kept(caplog):
+    final_struct = {}
+    with caplog.at_level(logging.WARNING, logger="fhirsheets.core.fhir_formatting"):
+        assign_value(final_struct, "status", "final", "decimal")
+    assert final_struct == {"status": "final"}
+    assert "not a valid FHIR decimal" in caplog.text
+
+def test_assign_value_integer_and_uuid():
+    final_struct = {}
+    assign_value(final_struct, "value", "-42", "integer")
+    assign_value(final_struct, "id", "urn:uuid:9f1c7a52-3b6e-4d0b-8e5c-2a7f4c1d9e30", "uuid")
+    assert final_struct == {"value": -42, "id": "urn:uuid:9f1c7a52-3b6e-4d0b-8e5c-2a7f4c1d9e30"}
+
+def test_parse_iso8601_datetime_utc_suffix():
+    date = parse_iso8601_datetime("2025-10-21T11:59:34Z")
+    assert date == datetime.datetime(2025, 10, 21, 11, 59, 34, tzinfo=datetime.timezone.utc)
+
+def test_parse_iso8601_datetime_date_only_is_naive():
+    date = parse_iso8601_datetime("2025-10-21")
+    assert date == datetime.datetime(2025, 10, 21)
+    assert date.tzinfo is None
+
+def test_parse_iso8601_datetime_slow_path():
+    date = parse_iso8601_datetime("on 2025-10-21T11:59:34.250")
+    assert date == datetime.datetime(2025, 10, 21, 11, 59, 34, tzinfo=datetime.timezone.utc)
+
+def test_parse_iso8601_datetime_offset_is_not_fast_pathed():
+    # fromisoformat would parse the '+01' offset, then the result would be stamped UTC and shift the instant
+    assert parse_iso8601_datetime("2020-01-01T10:00+01") == datetime.datetime(2020, 1, 1, 0, 0)
+    assert parse_iso8601_datetime("2020-01-01T10:00:00+01") == datetime.datetime(2020, 1, 1, 10, 0, 0, tzinfo=datetime.timezone.utc)
+
+def test_parse_cache_stats():
+    parse_iso8601_date("1999-12-31")
+    before = parse_cache_stats()["parse_iso8601_date"]
+    parse_iso8601_date("1999-12-31")
+    after = parse_cache_stats()["parse_iso8601_date"]
+    assert after["hits"] == before["hits"] + 1
+    assert 0.0 < after["hit_rate"] <= 1.0
+
+def test_codeableconcept_memoized_copies():
+    first = caret_delimited_string_to_codeableconcept("http://loinc.org^8480-6^Systolic^Systolic BP")
+    first["coding"][0]["display"] = "changed"
+    first["text"] = "changed"
+    second = caret_delimited_string_to_codeableconcept("http://loinc.org^8480-6^Systolic^Systolic BP")
+    assert second == {"coding": [{"system": "http://loinc.org", "code": "8480-6", "display": "Systolic"}], "text": "Systolic BP"}
+    assert parse_cache_stats()["_parse_codeableconcept"]["hits"] >= 1
+
+def test_coding_memoized_copies():
+    first = caret_delimited_string_to_coding("http://snomed.info/sct^44054006")
+    first["code"] = "changed"
+    assert caret_delimited_string_to_coding("http://snomed.info/sct^44054006") == {"system": "http://snomed.info/sct", "code": "44054006"}
@@ -0,0 +1,29 @@
+from src.fhir_sheets.core.json_path import (
+    IndexSegment, KeyIndexSegment, KeyQualifierSegment, KeySegment, parse_json_path
+)
+
+
+class TestParseJsonPath:
+    def test_segment_types(self):
+        segments = parse_json_path("Patient.name[use=official].given[1].[0].extension[Race]")
+        assert [type(segment) for segment in segments] == [
+            KeySegment, KeyQualifierSegment, KeyIndexSegment, IndexSegment, KeyQualifierSegment
+        ]
+        assert segments[1].key == "name"
+        assert (segments[1].qualifier_key, segments[1].qualifier_value) == ("use", "official")
+        assert (segments[2].key, segments[2].index) == ("given", 1)
+        assert segments[3].index == 0
+        assert (segments[4].qualifier_key, segments[4].qualifier_value) == (None, None)
+
+    def test_segment_paths(self):
+        segments = parse_json_path("Patient.name.[0].family")
+        assert [segment.path for segment in segments] == ["Patient", "Patient.name", "Patient.name.[0]", "Patient.name.[0].family"]
+        assert segments[-1].text == "family"
+
+    def test_non_numeric_index(self):
+        segment = parse_json_path("Patient.[x]")[1]
+        assert isinstance(segment, IndexSegment)
+        assert segment.index is None
+
+    def test_parse_is_cached(self):
+        assert parse_json_path("Patient.birthDate") is parse_json_path("Patient.birthDate")
@@ -0,0 +1,97 @@
+import pytest
+
+from src.fhir_sheets.core import fhir_formatting, metrics
+from src.fhir_sheets.core.metrics import Metrics
+
+
+@pytest.fixture(autouse=True)
+def disabled_metrics():
+    metrics.disable_metrics()
+    yield
+    metrics.disable_metrics()
+
+
+class TestMetrics:
+    def test_stage_records_time_and_runs(self):
+        run_metrics = Metrics()
+        with run_metrics.stage("convert"):
+            pass
+        with run_metrics.stage("convert"):
+            pass
+        assert run_metrics.stage_runs == {"convert": 2}
+        assert run_metrics.stage_seconds["convert"] >= 0.0
+
+    def test_stage_recorded_when_body_raises(self):
+        run_metrics = Metrics()
+        with pytest.raises(ValueError):
+            with run_metrics.stage("convert"):
+                raise ValueError()
+        assert run_metrics.stage_runs == {"convert": 1}
+
+    def test_merge(self):
+        first = Metrics()
+        first.record_stage("convert", 1.0)
+        first.count("patients", 2)
+        second = Metrics()
+        second.record_stage("convert", 0.5, 3)
+        second.count("patients")
+        second.count("resources", 4)
+        first.merge(second)
+        assert first.stage_seconds == {"convert": 1.5}
+        assert first.stage_runs == {"convert": 4}
+        assert first.counters == {"patients": 3, "resources": 4}
+
+    def test_to_dict_groups_cache_counters(self):
+        run_metrics = Metrics()
+        run_metrics.count("patients", 2)
+        run_metrics.count("cache.parse_iso8601_date.hits", 3)
+        run_metrics.count("cache.parse_iso8601_date.misses", 1)
+        result = run_metrics.to_dict()
+        assert result["counters"] == {"patients": 2}
+        assert result["caches"] == {"parse_iso8601_date": {"hits": 3, "misses": 1, "hit_rate": 0.75}}
+
+    def test_from_dict_round_trip(self):
+        run_metrics = Metrics()
+        run_metrics.record_stage("convert", 1.0, 2)
+        run_metrics.count("patients", 2)
+        run_metrics.count("cache.parse_iso8601_date.hits", 3)
+        run_metrics.count("cache.parse_iso8601_date.misses", 1)
+        assert Metrics.from_dict(run_metrics.to_dict()).to_dict() == run_metrics.to_dict()
+
+
+class TestModuleInstrumentation:
+    def test_disabled_records_nothing(self):
+        with metrics.stage("convert"):
+            metrics.count("patients")
+        assert metrics.get_metrics() is None
+
+    def test_enabled_records_stages_and_counters(self):
+        run_metrics = metrics.enable_metrics()
+        with metrics.stage("convert"):
+            metrics.count("patients")
+        assert run_metrics.stage_runs == {"convert": 1}
+        assert run_metrics.counters == {"patients": 1}
+        assert metrics.disable_metrics() is run_metrics
+        assert metrics.get_metrics() is None
+
+    def test_assign_value_counted_by_value_type(self):
+        run_metrics = metrics.enable_metrics()
+        fhir_formatting.assign_value({}, "gender", "male", "Code")
+        fhir_formatting.assign_value({}, "active", "true", "boolean")
+        assert run_metrics.counters == {"assign_value.code": 1, "assign_value.boolean": 1}
+
+    def test_cache_stats_recorded_since_enabled(self):
+        fhir_formatting.parse_iso8601_date("1999-12-31")
+        run_metrics = metrics.enable_metrics()
+        fhir_formatting.parse_iso8601_date("1999-12-31")
+        metrics.record_cache_stats()
+        assert run_metrics.counters["cache.parse_iso8601_date.hits"] == 1
+        assert run_metrics.counters["cache.parse_iso8601_date.misses"] == 0
+
+    def test_collect_metrics_starts_new_metrics(self):
+        first = metrics.enable_metrics()
+        metrics.count("patients")
+        assert metrics.collect_metrics() is first
+        metrics.count("patients")
+        assert first.counters["patients"] == 1
+        assert metrics.get_metrics().counters["patients"] == 1
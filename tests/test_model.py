@@ -1,3 +1,6 @@
+import dataclasses
+import pickle
+
 import pytest
 from src.fhir_sheets.core.model.cohort_data_entity import CohortData, HeaderEntry, PatientEntry
 from src.fhir_sheets.core.model.resource_definition_entity import ResourceDefinition
@@ -34,6 +37,11 @@ class TestCohortData:
         cohort = CohortData.from_dict(headers, patients)
         assert cohort.get_num_patients() == 3
 
+    def test_iter_patients(self):
+        patients = [{("Patient", "name"): "Patient1"}, {("Patient", "name"): "Patient2"}]
+        cohort = CohortData.from_dict([], patients)
+        assert [(index, patient.entries) for index, patient in cohort.iter_patients()] == list(enumerate(patients))
+
 
 class TestHeaderEntry:
     def test_from_dict(self):
@@ -51,6 +59,18 @@ class TestHeaderEntry:
         assert header.valueType == "HumanName"
         assert header.valueSets is None
 
+    def test_frozen_and_hashable(self):
+        header = HeaderEntry("Patient", "name", "Patient.name", "string", None)
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            header.valueType = "code"
+        assert header == HeaderEntry("Patient", "name", "Patient.name", "string", None)
+        assert len({header, HeaderEntry("Patient", "name", "Patient.name", "string", None)}) == 1
+
+    def test_slotted_and_picklable(self):
+        header = HeaderEntry("Patient", "name", "Patient.name", "string", None)
+        assert not hasattr(header, "__dict__")
+        assert pickle.loads(pickle.dumps(header)) == header
+
 
 class TestPatientEntry:
     def test_from_dict(self):
@@ -66,6 +86,12 @@ class TestPatientEntry:
         patient = PatientEntry(entries)
         assert "PatientEntry" in repr(patient)
 
+    def test_slotted_and_mutable(self):
+        patient = PatientEntry({("Patient", "name"): "Test"})
+        assert not hasattr(patient, "__dict__")
+        patient.entries[("Patient", "gender")] = "female"
+        assert pickle.loads(pickle.dumps(patient)) == patient
+
 
 class TestResourceDefinition:
     def test_from_dict(self):
@@ -95,6 +121,19 @@ class TestResourceDefinition:
         rd = ResourceDefinition("Patient", "Patient", [])
         assert "ResourceDefinition" in repr(rd)
 
+    def test_frozen_and_hashable(self):
+        rd = ResourceDefinition("Patient", "Patient", ["http://example.org/profile"])
+        assert not hasattr(rd, "__dict__")
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            rd.resourceType = "Encounter"
+        assert rd == ResourceDefinition("Patient", "Patient", ["http://example.org/profile"])
+        assert rd != ResourceDefinition("Patient", "Patient", [])
+        assert hash(rd) == hash(ResourceDefinition("Patient", "Patient", ["http://example.org/profile"]))
+        assert pickle.loads(pickle.dumps(rd)) == rd
+
+    def test_key_lists_are_not_fields(self):
+        assert [f.name for f in dataclasses.fields(ResourceDefinition)] == ["entityName", "resourceType", "profiles"]
+
 
 class TestResourceLink:
     def test_from_dict(self):
@@ -123,6 +162,14 @@ class TestResourceLink:
         rl = ResourceLink("A", "ref", "B")
         assert "ResourceLink" in repr(rl)
 
+    def test_frozen_and_hashable(self):
+        rl = ResourceLink("A", "ref", "B")
+        assert not hasattr(rl, "__dict__")
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            rl.referencePath = "subject"
+        assert {rl, ResourceLink("A", "ref", "B")} == {rl}
+        assert pickle.loads(pickle.dumps(rl)) == rl
+
 
 class TestFhirSheetsConfiguration:
     def test_init_empty(self):
@@ -0,0 +1,164 @@
+import datetime
+import gzip
+import json
+import tarfile
+
+import orjson
+import pytest
+
+from src.fhir_sheets.core.config.FhirSheetsConfiguration import FhirSheetsConfiguration
+from src.fhir_sheets.core.output import (
+    JsonFileSink,
+    NdjsonBundleSink,
+    NdjsonResourceSink,
+    TarArchiveSink,
+    create_sink,
+    open_output_file,
+    serialize_bundle,
+    write_bundle_file,
+)
+
+BUNDLE = {
+    "resourceType": "Bundle",
+    "type": "transaction",
+    "entry": [
+        {
+            "resource": {
+                "resourceType": "Patient",
+                "birthDate": datetime.date(2017, 5, 15),
+                "meta": {"lastUpdated": datetime.datetime(2025, 10, 21, 11, 59, 34, tzinfo=datetime.timezone.utc)},
+            }
+        }
+    ],
+}
+
+
+def test_serialize_bundle_pretty():
+    json_bytes = serialize_bundle(BUNDLE)
+    assert json_bytes.startswith(b'{\n  "resourceType": "Bundle"')
+    resource = json.loads(json_bytes)["entry"][0]["resource"]
+    assert resource["birthDate"] == "2017-05-15"
+    assert resource["meta"]["lastUpdated"] == "2025-10-21T11:59:34+00:00"
+
+
+def test_serialize_bundle_compact():
+    json_bytes = serialize_bundle(BUNDLE, compact=True)
+    assert b"\n" not in json_bytes
+    assert json.loads(json_bytes) == json.loads(serialize_bundle(BUNDLE))
+
+
+def test_serialize_bundle_with_set_fails():
+    with pytest.raises(orjson.JSONEncodeError):
+        serialize_bundle({"resourceType": "Bundle", "entry": [{"values": {"a"}}]})
+
+
+def test_write_bundle_file(tmp_path):
+    file_path = tmp_path / "0.json"
+    write_bundle_file(file_path, BUNDLE, compact=True)
+    assert file_path.read_bytes() == serialize_bundle(BUNDLE, compact=True)
+
+
+def test_json_file_sink(tmp_path):
+    with JsonFileSink(tmp_path) as sink:
+        sink.write(0, BUNDLE)
+        sink.write(1, BUNDLE)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["0.json", "1.json"]
+    assert (tmp_path / "1.json").read_bytes() == serialize_bundle(BUNDLE)
+
+
+def test_ndjson_bundle_sink(tmp_path):
+    with NdjsonBundleSink(tmp_path) as sink:
+        sink.write(0, BUNDLE)
+        sink.write(1, BUNDLE)
+    lines = (tmp_path / "Bundle.ndjson").read_bytes().splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[1])["resourceType"] == "Bundle"
+
+
+def test_ndjson_resource_sink(tmp_path):
+    bundle = {
+        "resourceType": "Bundle",
+        "entry": [
+            {"resource": {"resourceType": "Patient", "id": "p1"}},
+            {"resource": {"resourceType": "Observation", "id": "o1"}},
+            {"resource": {"resourceType": "Observation", "id": "o2"}},
+        ],
+    }
+    with NdjsonResourceSink(tmp_path) as sink:
+        sink.write(0, bundle)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["Observation.ndjson", "Patient.ndjson"]
+    observations = [json.loads(line) for line in (tmp_path / "Observation.ndjson").read_bytes().splitlines()]
+    assert [observation["id"] for observation in observations] == ["o1", "o2"]
+
+
+def test_create_sink(tmp_path):
+    assert isinstance(create_sink(tmp_path, FhirSheetsConfiguration({})), JsonFileSink)
+    with create_sink(tmp_path, FhirSheetsConfiguration({"output_format": "bulk"})) as sink:
+        assert isinstance(sink, NdjsonResourceSink)
+    with pytest.raises(ValueError):
+        create_sink(tmp_path, FhirSheetsConfiguration({"output_format": "csv"}))
+
+
+def test_gzip_ndjson_bundle_sink(tmp_path):
+    with NdjsonBundleSink(tmp_path, compression="gzip", compression_level=1) as sink:
+        sink.write(0, BUNDLE)
+        sink.write(1, BUNDLE)
+    with gzip.open(tmp_path / "Bundle.ndjson.gz", "rb") as file:
+        lines = file.read().splitlines()
+    assert [json.loads(line)["resourceType"] for line in lines] == ["Bundle", "Bundle"]
+
+
+def test_gzip_ndjson_resource_sink(tmp_path):
+    with NdjsonResourceSink(tmp_path, compression="gzip") as sink:
+        sink.write(0, BUNDLE)
+    with gzip.open(tmp_path / "Patient.ndjson.gz", "rb") as file:
+        assert json.loads(file.readline())["birthDate"] == "2017-05-15"
+
+
+def test_tar_archive_sink(tmp_path):
+    with TarArchiveSink(tmp_path, compact=True, compression="gzip") as sink:
+        sink.write(0, BUNDLE)
+        sink.write(1, BUNDLE)
+    with tarfile.open(tmp_path / "Bundle.tar.gz", "r:gz") as archive:
+        assert archive.getnames() == ["0.json", "1.json"]
+        assert archive.extractfile("1.json").read() == serialize_bundle(BUNDLE, compact=True)
+
+
+def test_open_output_file_unsupported_compression(tmp_path):
+    with pytest.raises(ValueError):
+        open_output_file(tmp_path / "Bundle.ndjson", "bzip2")
+
+
+def test_open_output_file_zstd(tmp_path):
+    try:
+        import zstandard
+    except ImportError:
+        with pytest.raises(ImportError, match="zstandard"):
+            open_output_file(tmp_path / "Bundle.ndjson", "zstd")
+        return
+    with open_output_file(tmp_path / "Bundle.ndjson", "zstd") as file:
+        file.write(b"{}\n")
+    with open(tmp_path / "Bundle.ndjson.zst", "rb") as file:
+        assert zstandard.ZstdDecompressor().stream_reader(file).read() == b"{}\n"
+
+
+def test_create_sink_json_compression(tmp_path):
+    with pytest.raises(ValueError):
+        create_sink(tmp_path, FhirSheetsConfiguration({"compression": "gzip"}))
+    with create_sink(tmp_path, FhirSheetsConfiguration({"output_format": "tar", "compression": "gzip"})) as sink:
+        assert isinstance(sink, TarArchiveSink)
+
+
+def test_ndjson_resource_sink_deduplicates_resource_types(tmp_path):
+    bundle = {
+        "resourceType": "Bundle",
+        "entry": [
+            {"resource": {"resourceType": "Medication", "id": "m1"}},
+            {"resource": {"resourceType": "MedicationRequest", "id": "r1"}},
+        ],
+    }
+    with NdjsonResourceSink(tmp_path, deduplicated_resource_types=("Medication",)) as sink:
+        sink.write(0, bundle)
+        sink.write(1, bundle)
+    assert len((tmp_path / "Medication.ndjson").read_bytes().splitlines()) == 1
+    assert len((tmp_path / "MedicationRequest.ndjson").read_bytes().splitlines()) == 2
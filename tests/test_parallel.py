@@ -0,0 +1,81 @@
+import multiprocessing
+import pathlib
+import re
+import subprocess
+import sys
+
+from src.fhir_sheets.cli.main import main
+from src.fhir_sheets.core import conversion, parallel, read_input, special_values
+from src.fhir_sheets.core.config.FhirSheetsConfiguration import FhirSheetsConfiguration
+from src.fhir_sheets.core.conversion_plan import ConversionPlan
+from src.fhir_sheets.core.output import serialize_bundle
+from src.fhir_sheets.core.parallel import _batches, convert_patients_in_parallel
+
+TOP_DIR = pathlib.Path(__file__).parent.parent / "samples"
+INPUT_FILE = TOP_DIR / "Congenital_Hyperthyrodism/Congenital_Hyperthyrodism_Fhir_Cohort_Import_Template.xlsx"
+UUID_PATTERN = re.compile(rb"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+def normalize_ids(json_bytes):
+    # Resource ids are random uuids; number them in order of appearance so bundles can be compared
+    ids = {}
+    return UUID_PATTERN.sub(lambda match: ids.setdefault(match.group(0), b"ID%d" % len(ids)), json_bytes)
+
+
+def secondary_ssn_identifier():
+    return {**special_values.ssn_identifier(), 'use': 'secondary'}
+
+
+def test_batches():
+    assert list(_batches(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(_batches([], 2)) == []
+
+
+def test_parallel_matches_serial():
+    config = FhirSheetsConfiguration({"random_seed": 7})
+    resource_definitions, resource_links, cohort_data = read_input.read_xlsx_and_process(INPUT_FILE, read_only=True)
+    conversion_plan = ConversionPlan.compile(resource_definitions, cohort_data.headers)
+    serial = [
+        (index, conversion.create_transaction_bundle(resource_definitions, resource_links, cohort_data, index, config, patient_entry, conversion_plan))
+        for index, patient_entry in cohort_data.iter_patients()
+    ]
+    parallel = list(convert_patients_in_parallel(
+        resource_definitions, resource_links, cohort_data, cohort_data.iter_patients(), config, conversion_plan, workers=2, batch_size=1
+    ))
+    assert [index for index, _ in parallel] == [index for index, _ in serial]
+    for (_, serial_bundle), (_, parallel_bundle) in zip(serial, parallel):
+        assert normalize_ids(serialize_bundle(parallel_bundle)) == normalize_ids(serialize_bundle(serial_bundle))
+
+
+def test_spawned_workers_use_registries_changed_at_runtime(monkeypatch):
+    # Spawned workers import fresh copies of the registries, so the changed SSN identifier type must be sent to them
+    monkeypatch.setattr(parallel, "multiprocessing", multiprocessing.get_context("spawn"))
+    monkeypatch.setitem(special_values.identifier_types, ("Patient", "type=SSN"),
+                        special_values.IdentifierType("type", "SS", secondary_ssn_identifier))
+    config = FhirSheetsConfiguration({"random_seed": 7})
+    resource_definitions, resource_links, cohort_data = read_input.read_xlsx_and_process(INPUT_FILE, read_only=True)
+    conversion_plan = ConversionPlan.compile(resource_definitions, cohort_data.headers)
+    serial = [
+        conversion.create_transaction_bundle(resource_definitions, resource_links, cohort_data, index, config, patient_entry, conversion_plan)
+        for index, patient_entry in cohort_data.iter_patients()
+    ]
+    spawned = [bundle for _, bundle in convert_patients_in_parallel(
+        resource_definitions, resource_links, cohort_data, cohort_data.iter_patients(), config, conversion_plan, workers=2
+    )]
+    assert b'"use": "secondary"' in serialize_bundle(serial[0])
+    assert [normalize_ids(serialize_bundle(bundle)) for bundle in spawned] == [normalize_ids(serialize_bundle(bundle)) for bundle in serial]
+
+
+def test_parallel_output_is_byte_identical_with_deterministic_ids(tmp_path):
+    config = {"random_seed": 11, "deterministic_ids": True, "output_format": "ndjson"}
+    main(str(INPUT_FILE), tmp_path / "serial", FhirSheetsConfiguration(config))
+    main(str(INPUT_FILE), tmp_path / "parallel", FhirSheetsConfiguration({**config, "workers": 2}))
+    serial_bytes = (tmp_path / "serial" / "Bundle.ndjson").read_bytes()
+    assert serial_bytes
+    assert (tmp_path / "parallel" / "Bundle.ndjson").read_bytes() == serial_bytes
+
+def test_parallel_module_imports_first_in_fresh_interpreter():
+    # Worker processes started with the 'spawn' start method import the parallel module before any other
+    result = subprocess.run([sys.executable, "-c", "import src.fhir_sheets.core.parallel"],
+                            cwd=pathlib.Path(__file__).parent.parent, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,91 @@
+import pathlib
+import openpyxl
+import pytest
+from src.fhir_sheets.core import read_input
+
+TOP_DIR = pathlib.Path(__file__).parent.parent / "samples"
+SAMPLE_WORKBOOKS = sorted(TOP_DIR.glob("*/*_Fhir_Cohort_Import_Template.xlsx"))
+
+
+@pytest.mark.parametrize("input_file", SAMPLE_WORKBOOKS, ids=lambda path: path.parent.name)
+def test_read_only_matches_full_load(input_file):
+    definitions, links, cohort_data = read_input.read_xlsx_and_process(input_file)
+    ro_definitions, ro_links, ro_cohort_data = read_input.read_xlsx_and_process(input_file, read_only=True)
+
+    assert repr(ro_definitions) == repr(definitions)
+    assert repr(ro_links) == repr(links)
+    assert repr(ro_cohort_data.headers) == repr(cohort_data.headers)
+    assert [patient.entries for patient in ro_cohort_data.patients] == [patient.entries for patient in cohort_data.patients]
+
+
+def _write_cohort_workbook(path, patient_rows):
+    workbook = openpyxl.Workbook()
+    definitions = workbook.active
+    definitions.title = "ResourceDefinitions"
+    definitions.append(["Entity Name", "ResourceType", "Profile(s)"])
+    definitions.append(["Description", "Description", "Description"])
+    definitions.append(["PrimaryPatient", "Patient", "http://hl7.org/fhir/us/core/StructureDefinition/us-core-patient"])
+    links = workbook.create_sheet("ResourceLinks")
+    links.append(["OriginResource", "ReferencePath", "DestinationResource"])
+    links.append(["Description", "Description", "Description"])
+    patient_data = workbook.create_sheet("PatientData")
+    patient_data.append(["Entity To Query", "Description", "PrimaryPatient", "PrimaryPatient", "PrimaryPatient"])
+    patient_data.append(["JsonPath", "Description", "Patient.gender", "Patient.birthDate", "Patient.name"])
+    patient_data.append(["Data Type", "Description", "code", "date", "HumanName"])
+    patient_data.append(["Value Set", "Description", None, None, None])
+    patient_data.append(["Recommended Profile", "Description", None, None, None])
+    patient_data.append(["Data Element", "Description", "Gender", "Birth Date", "Name"])
+    for patient_row in patient_rows:
+        patient_data.append([None, None, *patient_row])
+    workbook.save(path)
+    return path
+
+
+def test_row_reader_matches_column_reader(tmp_path):
+    input_file = _write_cohort_workbook(tmp_path / "cohort.xlsx", [
+        ("male", "2001-02-03", "John Doe"),
+        ("female", "1999-12-31", "Jane Roe"),
+        ("other", "1980-01-01", "Sam Poe"),
+    ])
+    workbook = openpyxl.load_workbook(input_file)
+    definitions = read_input.process_sheet_resource_definitions(workbook["ResourceDefinitions"])
+    column_cohort = read_input.process_sheet_patient_data_revised(workbook["PatientData"], definitions)
+    row_cohort = read_input.process_sheet_patient_data_rows(workbook["PatientData"], definitions)
+
+    assert repr(row_cohort.headers) == repr(column_cohort.headers)
+    assert [patient.entries for patient in row_cohort.patients] == [patient.entries for patient in column_cohort.patients]
+    assert row_cohort.get_num_patients() == 3
+    assert row_cohort.patients[1].entries[("PrimaryPatient", "Name")] == "Jane Roe"
+
+
+def test_row_reader_skips_blank_rows_and_cells(tmp_path):
+    input_file = _write_cohort_workbook(tmp_path / "cohort.xlsx", [
+        ("male", None, "John Doe"),
+        (None, None, None),
+        ("female", "1999-12-31", None),
+    ])
+    _, _, cohort_data = read_input.read_xlsx_and_process(input_file, read_only=True)
+
+    assert [patient.entries for patient in cohort_data.patients] == [
+        {("PrimaryPatient", "Gender"): "male", ("PrimaryPatient", "Name"): "John Doe"},
+        {("PrimaryPatient", "Gender"): "female", ("PrimaryPatient", "Birth Date"): "1999-12-31"},
+    ]
+
+    # The full load reads column by column; each value must stay with the patient of its row
+    _, _, full_cohort_data = read_input.read_xlsx_and_process(input_file)
+    assert [patient.entries for patient in full_cohort_data.patients] == [patient.entries for patient in cohort_data.patients]
+
+
+def test_stream_matches_eager_read(tmp_path):
+    input_file = _write_cohort_workbook(tmp_path / "cohort.xlsx", [
+        ("male", "2001-02-03", "John Doe"),
+        ("female", "1999-12-31", "Jane Roe"),
+    ])
+    definitions, links, cohort_data = read_input.read_xlsx_and_process(input_file, read_only=True)
+    stream_definitions, stream_links, stream_cohort_data, patients = read_input.stream_xlsx_and_process(input_file)
+
+    assert repr(stream_definitions) == repr(definitions)
+    assert repr(stream_links) == repr(links)
+    assert repr(stream_cohort_data.headers) == repr(cohort_data.headers)
+    assert stream_cohort_data.get_num_patients() == 0
+    assert [(index, patient.entries) for index, patient in patients] == [(index, patient.entries) for index, patient in cohort_data.iter_patients()]
@@ -1,9 +1,16 @@
+import logging
+
 import pytest
 from src.fhir_sheets.core.special_values import (
-    DataAbsentReasonHandler, PatientRaceExtensionValueHandler,
+    DataAbsentReasonHandler, PatientRaceExtensionValueHandler, PatientDetailedRaceExtensionValueHandler,
     PatientEthnicityExtensionValueHandler, PatientBirthSexExtensionValueHandler,
     PatientMRNIdentifierValueHandler, PatientSSNIdentifierValueHandler,
-    utilFindExtensionWithURL, findComponentWithCoding
+    utilFindExtensionWithURL, findComponentWithCoding, ObservationComponentHandler,
+    StructureHandlerRegistry, resolve_structure_handler,
+    IdentifierType, IdentifierValueHandler, identifier_types,
+    register_identifier_type, custom_structure_handlers,
+    TableCoding, component_codes, register_component_code, NPI_SYSTEM,
+    EntryFragment, FieldFragment, PathFragment, US_CORE_RACE_URL
 )
 from src.fhir_sheets.core.model.resource_definition_entity import ResourceDefinition
 
@@ -141,6 +148,68 @@ class TestPatientEthnicityExtensionValueHandler:
         assert final_struct == {}
 
 
+class TestPatientRaceLookups:
+    RACE_URL = 'http://hl7.org/fhir/us/core/StructureDefinition/us-core-race'
+
+    def test_native_hawaiian_or_other_pacific_islander_code(self):
+        final_struct = {}
+        PatientRaceExtensionValueHandler().assign_value("Patient.extension[Race].ombCategory", None, "string", final_struct, "ombCategory", "Native Hawaiian or Other Pacific Islander")
+        assert final_struct['extension'][0]['extension'][0]['valueCoding']['code'] == '2076-8'
+
+    def test_match_by_code(self):
+        final_struct = {}
+        PatientRaceExtensionValueHandler().assign_value("Patient.extension[Race].ombCategory", None, "string", final_struct, "ombCategory", " 2028-9 ")
+        race_ext = final_struct['extension'][0]
+        assert race_ext['extension'][0]['valueCoding']['display'] == 'Asian'
+        assert race_ext['extension'][1]['valueString'] == 'asian'
+
+    def test_no_match_leaves_existing_struct_untouched(self):
+        final_struct = {'resourceType': 'Patient', 'extension': [{'url': 'other', 'valueString': 'x'}]}
+        result = PatientRaceExtensionValueHandler().assign_value("Patient.extension[Race].ombCategory", None, "string", final_struct, "ombCategory", "martian")
+        assert result == {}
+        assert final_struct == {'resourceType': 'Patient', 'extension': [{'url': 'other', 'valueString': 'x'}]}
+
+    def test_first_omb_category_is_kept(self):
+        handler = PatientRaceExtensionValueHandler()
+        final_struct = {}
+        handler.assign_value("Patient.extension[Race].ombCategory", None, "string", final_struct, "ombCategory", "Asian")
+        handler.assign_value("Patient.extension[Race].ombCategory", None, "string", final_struct, "ombCategory", "White")
+        race_ext = final_struct['extension'][0]
+        assert [ext['url'] for ext in race_ext['extension']] == ['ombCategory', 'text']
+        assert race_ext['extension'][0]['valueCoding']['code'] == '2028-9'
+
+    def test_fragments_are_not_shared(self):
+        handler = PatientRaceExtensionValueHandler()
+        first, second = {}, {}
+        handler.assign_value("Patient.extension[Race].ombCategory", None, "string", first, "ombCategory", "Asian")
+        handler.assign_value("Patient.extension[Race].ombCategory", None, "string", second, "ombCategory", "Asian")
+        first['extension'][0]['extension'][0]['valueCoding']['code'] = 'changed'
+        assert second['extension'][0]['extension'][0]['valueCoding']['code'] == '2028-9'
+
+    def test_detailed_races(self):
+        final_struct = {}
+        detailed_handler = PatientDetailedRaceExtensionValueHandler()
+        detailed_handler.assign_value("Patient.extension[Race].detailed", None, "string", final_struct, "detailed", "Chinese")
+        detailed_handler.assign_value("Patient.extension[Race].detailed", None, "string", final_struct, "detailed", "2036-2")
+        detailed_handler.assign_value("Patient.extension[Race].detailed", None, "string", final_struct, "detailed", "chinese")
+        PatientRaceExtensionValueHandler().assign_value("Patient.extension[Race].ombCategory", None, "string", final_struct, "ombCategory", "Asian")
+        race_ext = utilFindExtensionWithURL(final_struct['extension'], self.RACE_URL)
+        assert [(ext['url'], ext.get('valueCoding', {}).get('code')) for ext in race_ext['extension']] == [
+            ('ombCategory', '2028-9'), ('detailed', '2034-7'), ('detailed', '2036-2'), ('text', None)
+        ]
+        assert race_ext['extension'][-1]['valueString'] == 'chinese'
+
+    def test_detailed_race_no_match(self):
+        final_struct = {}
+        result = PatientDetailedRaceExtensionValueHandler().assign_value("Patient.extension[Race].detailed", None, "string", final_struct, "detailed", "martian")
+        assert result == {}
+        assert final_struct == {}
+
+    def test_detailed_race_handler_resolves(self):
+        assert isinstance(resolve_structure_handler("Patient.extension[Race].detailed"), PatientDetailedRaceExtensionValueHandler)
+        assert isinstance(resolve_structure_handler("Patient.extension[Race].ombCategory"), PatientRaceExtensionValueHandler)
+
+
 class TestPatientBirthSexExtensionValueHandler:
     def test_assign_value_male(self):
         handler = PatientBirthSexExtensionValueHandler()
@@ -152,6 +221,51 @@ class TestPatientBirthSexExtensionValueHandler:
         assert birthsex_ext['url'] == 'http://hl7.org/fhir/us/core/StructureDefinition/us-core-birthsex'
         assert birthsex_ext['valueCode'] == 'M'
 
+    def test_assign_value_with_ethnicity_extension(self):
+        rd = ResourceDefinition("Patient", "Patient", [])
+        final_struct = {}
+        PatientEthnicityExtensionValueHandler().assign_value("Patient.extension[Ethnicity].ombCategory", rd, "string", final_struct, "ombCategory", "Hispanic or Latino")
+        PatientBirthSexExtensionValueHandler().assign_value("Patient.extension[Birthsex].value", rd, "code", final_struct, "value", "F")
+        birthsex_ext = utilFindExtensionWithURL(final_struct['extension'], 'http://hl7.org/fhir/us/core/StructureDefinition/us-core-birthsex')
+        assert birthsex_ext['valueCode'] == 'F'
+
+
+class TestHandlersBuildFreshFragments:
+    def test_birth_sex(self):
+        handler = PatientBirthSexExtensionValueHandler()
+        first, second = {}, {}
+        handler.assign_value("Patient.extension[Birthsex].value", None, "code", first, "value", "M")
+        handler.assign_value("Patient.extension[Birthsex].value", None, "code", second, "value", "F")
+        assert first['extension'][0]['valueCode'] == 'M'
+        assert second['extension'][0]['valueCode'] == 'F'
+
+    def test_data_absent_reason(self):
+        handler = DataAbsentReasonHandler()
+        first, second = {}, {}
+        handler.assign_value(first, "gender", "$masked", "code")
+        handler.assign_value(second, "gender", "$unknown", "code")
+        assert first['extension'][0]['value'] == 'masked'
+        assert second['extension'][0]['value'] == 'unknown'
+
+    def test_identifier(self):
+        handler = PatientMRNIdentifierValueHandler()
+        first, second = {}, {}
+        handler.assign_value("Patient.identifier[type=MR].value", None, "string", first, "value", "1")
+        handler.assign_value("Patient.identifier[type=MR].value", None, "string", second, "value", "2")
+        assert first['identifier'][0]['value'] == '1'
+        assert second['identifier'][0]['value'] == '2'
+        assert first['identifier'][0]['type'] is not second['identifier'][0]['type']
+
+    def test_observation_component(self):
+        handler = ObservationComponentHandler()
+        rd = ResourceDefinition("Observation", "Observation", [])
+        first, second = {}, {}
+        handler.assign_value("Observation.component[code=3150-0].valueString", rd, "string", first, "valueString", "first")
+        handler.assign_value("Observation.component[code=3150-0].valueString", rd, "string", second, "valueString", "second")
+        assert first['component'][0]['valueString'] == 'first'
+        assert second['component'][0]['valueString'] == 'second'
+        assert first['component'][0]['code'] is not second['component'][0]['code']
+
 
 class TestPatientMRNIdentifierValueHandler:
     def test_assign_system(self):
@@ -236,3 +350,163 @@ class TestFindComponentWithCoding:
         ]
         result = findComponentWithCoding(components, "9999-9")
         assert result is None
+
+
+class TestStructureHandlerRegistry:
+    def test_resolve_prefix(self):
+        handler = PatientBirthSexExtensionValueHandler()
+        registry = StructureHandlerRegistry({"Patient.extension[Birthsex]": handler})
+        assert registry.resolve("Patient.extension[Birthsex].value") is handler
+        assert registry.resolve("Patient.extension[Birthsex]") is handler
+        assert registry.resolve("Patient.extension") is None
+        assert registry.resolve("Observation.status") is None
+
+    def test_most_specific_prefix_wins(self):
+        general = PatientMRNIdentifierValueHandler()
+        specific = PatientSSNIdentifierValueHandler()
+        registry = StructureHandlerRegistry({"Patient.identifier": general})
+        registry.register("Patient.identifier[type=SSN]", specific)
+        assert registry.resolve("Patient.identifier[type=SSN].value") is specific
+        assert registry.resolve("Patient.identifier[type=MR].value") is general
+
+    def test_register_invalidates_resolved_paths(self):
+        handler = PatientMRNIdentifierValueHandler()
+        registry = StructureHandlerRegistry()
+        assert registry.resolve("Patient.identifier[type=MR].value") is None
+        registry.register("Patient.identifier[type=MR]", handler)
+        assert registry.resolve("Patient.identifier[type=MR].value") is handler
+
+    def test_default_handlers(self):
+        assert isinstance(resolve_structure_handler("Patient.extension[Race].ombCategory"), PatientRaceExtensionValueHandler)
+        assert isinstance(resolve_structure_handler("Observation.component[code=3150-0].valueQuantity"), ObservationComponentHandler)
+        assert resolve_structure_handler("Patient.name.family") is None
+
+
+class TestBuildFragment:
+    def test_identifier_fragment(self):
+        handler = IdentifierValueHandler()
+        fragment = handler.build_fragment("Patient.identifier[type=MRN].value", "42")
+        assert isinstance(fragment, EntryFragment)
+        assert (fragment.list_key, fragment.match_key, fragment.children) == ('identifier', 'MR', (FieldFragment('value', '42'),))
+        assert fragment.new_entry['type']['coding'][0]['code'] == 'MR'
+        # Every call builds its own fragment
+        assert handler.build_fragment("Patient.identifier[type=MRN].value", "42").new_entry is not fragment.new_entry
+
+    def test_deeper_identifier_path_fragment(self):
+        fragment = IdentifierValueHandler().build_fragment("Patient.identifier[type=MRN].period.start", "2020-01-02")
+        assert fragment.children == (PathFragment(('period', 'start'), "2020-01-02", ('Patient', 'identifier[type=MRN]')),)
+
+    def test_race_fragment(self):
+        fragment = PatientRaceExtensionValueHandler().build_fragment("Patient.extension[Race].ombCategory", "Asian")
+        assert (fragment.match_key, fragment.new_entry) == (US_CORE_RACE_URL, {'extension': [{'url': 'text', 'valueString': 'asian'}], 'url': US_CORE_RACE_URL})
+        sub_extension, = fragment.children
+        assert sub_extension.new_entry == {'url': 'ombCategory', 'valueCoding': {'system': 'urn:oid:2.16.840.1.113883.6.238', 'code': '2028-9', 'display': 'Asian'}}
+
+    def test_no_fragment(self):
+        assert PatientRaceExtensionValueHandler().build_fragment("Patient.extension[Race].ombCategory", "martian") is None
+        assert IdentifierValueHandler().build_fragment("Patient.identifier[type=XX].value", "42") is None
+
+    def test_component_index_qualifier_fragment(self):
+        fragment = ObservationComponentHandler().build_fragment("Observation.component[0].valueString", "x")
+        assert fragment == PathFragment(('Observation', 'component[0]', 'valueString'), "x")
+
+
+class TestIdentifierValueHandler:
+    def test_system_and_value_share_identifier(self):
+        handler = IdentifierValueHandler()
+        final_struct = {}
+        handler.assign_value("Patient.identifier[type=MRN].system", None, "string", final_struct, "system", "urn:mrn")
+        handler.assign_value("Patient.identifier[type=MRN].value", None, "string", final_struct, "value", "42")
+        handler.assign_value("Patient.identifier[type=SSN].value", None, "string", final_struct, "value", "123-45-6789")
+        assert [identifier['type']['coding'][0]['code'] for identifier in final_struct['identifier']] == ['MR', 'SS']
+        assert final_struct['identifier'][0]['system'] == 'urn:mrn'
+        assert final_struct['identifier'][0]['value'] == '42'
+
+    def test_finds_existing_identifier(self):
+        final_struct = {'identifier': [{'system': 'other'}, {'type': {'coding': [{'code': 'MR'}]}}]}
+        IdentifierValueHandler().assign_value("Patient.identifier[type=MR].value", None, "string", final_struct, "value", "42")
+        assert len(final_struct['identifier']) == 2
+        assert final_struct['identifier'][1]['value'] == '42'
+
+    def test_system_matched_identifier(self):
+        final_struct = {}
+        IdentifierValueHandler().assign_value("Organization.identifier[system=NPI].value", None, "string", final_struct, "value", 1234567893)
+        assert final_struct['identifier'] == [{'system': 'http://hl7.org/fhir/sid/us-npi', 'value': '1234567893'}]
+
+    def test_matched_field_is_not_overwritten(self, caplog):
+        handler = IdentifierValueHandler()
+        final_struct = {}
+        handler.assign_value("Organization.identifier[system=NPI].value", None, "string", final_struct, "value", "1234567890")
+        with caplog.at_level(logging.WARNING, logger="fhirsheets.core.special_values"):
+            handler.assign_value("Organization.identifier[system=NPI].system", None, "string", final_struct, "system", "http://x")
+        handler.assign_value("Organization.identifier[system=NPI].value", None, "string", final_struct, "value", "999")
+        assert final_struct['identifier'] == [{'system': NPI_SYSTEM, 'value': '999'}]
+        assert "cannot be assigned" in caplog.text
+
+    def test_deeper_path(self):
+        rd = ResourceDefinition("Patient", "Patient", [])
+        final_struct = {}
+        resolve_structure_handler("Patient.identifier[type=MRN].period.start").assign_value(
+            "Patient.identifier[type=MRN].period.start", rd, "date", final_struct, "start", "2020-01-02")
+        assert str(final_struct['identifier'][0]['period']['start']) == '2020-01-02'
+
+    def test_register_identifier_type(self):
+        def drivers_license_identifier():
+            return {'type': {'coding': [{'system': 'http://terminology.hl7.org/CodeSystem/v2-0203', 'code': 'DL'}]}}
+        try:
+            register_identifier_type('Patient', 'type=DL', IdentifierType('type', 'DL', drivers_license_identifier))
+            json_path = "Patient.identifier[type=DL].value"
+            final_struct = {}
+            resolve_structure_handler(json_path).assign_value(json_path, None, "string", final_struct, "value", "D123")
+            assert final_struct['identifier'][0]['type']['coding'][0]['code'] == 'DL'
+            assert final_struct['identifier'][0]['value'] == 'D123'
+        finally:
+            identifier_types.pop(('Patient', 'type=DL'), None)
+            custom_structure_handlers.pop("Patient.identifier[type=DL]", None)
+
+
+class TestObservationComponentHandler:
+    def assign(self, final_struct, json_path, value, valueType="string"):
+        rd = ResourceDefinition("Observation", "Observation", [])
+        key = json_path.split('.')[-1]
+        return ObservationComponentHandler().assign_value(json_path, rd, valueType, final_struct, key, value)
+
+    def test_blood_pressure_panel(self):
+        final_struct = {}
+        self.assign(final_struct, "Observation.component[code=8480-6].valueQuantity.value", 120, "decimal")
+        self.assign(final_struct, "Observation.component[code=8462-4].valueQuantity.value", 80, "decimal")
+        self.assign(final_struct, "Observation.component[code=8480-6].valueQuantity.unit", "mm[Hg]")
+        self.assign(final_struct, "Observation.component[code=8462-4].valueQuantity.unit", "mm[Hg]")
+        systolic, diastolic = final_struct['component']
+        assert systolic['code'] == {
+            'coding': [{'system': 'http://loinc.org', 'code': '8480-6', 'display': 'Systolic blood pressure'}],
+            'text': 'Systolic blood pressure',
+        }
+        assert systolic['valueQuantity'] == {'value': 120, 'unit': 'mm[Hg]'}
+        assert diastolic['code']['coding'][0]['code'] == '8462-4'
+        assert diastolic['valueQuantity'] == {'value': 80, 'unit': 'mm[Hg]'}
+
+    def test_unknown_code(self):
+        final_struct = {}
+        self.assign(final_struct, "Observation.component[code=1234-5].valueString", "x")
+        assert final_struct['component'] == [{'code': {'coding': [{'code': '1234-5'}]}, 'valueString': 'x'}]
+
+    def test_finds_existing_component(self):
+        final_struct = {'component': [{'code': {'coding': [{'system': 'http://loinc.org', 'code': '3150-0'}]}}]}
+        self.assign(final_struct, "Observation.component[code=3150-0].valueString", "x")
+        assert len(final_struct['component']) == 1
+        assert final_struct['component'][0]['valueString'] == 'x'
+
+    def test_register_component_code(self):
+        try:
+            register_component_code(TableCoding('http://loinc.org', '2339-0', 'Glucose [Mass/volume] in Blood'))
+            final_struct = {}
+            self.assign(final_struct, "Observation.component[code=2339-0].valueString", "x")
+            assert final_struct['component'][0]['code']['text'] == 'Glucose [Mass/volume] in Blood'
+        finally:
+            component_codes.pop('2339-0', None)
+
+    def test_index_qualifier(self):
+        final_struct = {}
+        self.assign(final_struct, "Observation.component[0].valueString", "x")
+        assert final_struct['component'] == [{'valueString': 'x'}]